@@ -1,14 +1,32 @@
 import wx
 from printrun.gcview import GcodeViewMainWrapper
-from printrun.gcoder import GCode
 import printrun.gcview
 import printrun.gviz as gviz
 import printrun
 from marker import MarkerActor
-import re
+from render_cache import SceneCache
+from lod import LodModelActor
+import tool_palette
+import profiles
+import planner
+import parallel_parse
+import lazy_gcode
+import drill_library
+import verify
+import printer_stream
+import pocket
+import injection
+import objects
+import output_cache
+import panel
+import jobs
 import os
+import tempfile
 
 DEFAULT_DIMENSIONS = [250, 210, 210, 0, 0, 0]  # Default to MK3 size
+CACHE_STATUS_INTERVAL = 500  # ms between checks for a stored result of the current placement
+SAVE_BLOCK_SIZE = 1 << 22  # Bytes of lazily loaded G-code written between progress checks
+DRILL_LIBRARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Examples')
 
 def parse_bed_shape(line):
     # Parse line like "; bed_shape = 0x0,360x0,360x360,0x360"
@@ -55,6 +73,8 @@ class PrintegrateApp(wx.App):
         super(PrintegrateApp, self).__init__()
 
     def OnInit(self):
+        # Compile the printer profiles once before any G-code is loaded
+        profiles.load_profiles()
         frame = PrintegrateFrame(None, gcode_path=self.gcode_path)
         self.SetTopWindow(frame)
         frame.Show()
@@ -68,6 +88,26 @@ class PrintegrateFrame(wx.Frame):
             
             self.SetBackgroundColour(wx.Colour(255, 255, 255))
             self.drl_path = None
+            self.printer_profile = None
+            self.lazy_gcode = None  # Set instead of a full parse for very large files
+            self.drill_library = drill_library.DrillLibrary()
+            self.library_paths = []  # Drill files in the order of the library list
+            self.pattern_markers = {}  # Marker showing each placed drill file, by path
+            self.printer_stream = None  # Set while G-code is being sent to a printer
+            self.printer_port = ""
+            self.send_permille = 0
+            self.job = None  # Background Printegrate or Save job while one is running
+            self.job_button = None
+            self.reset_pending = False  # Reset waits for a cancelled job to stop using the G-code
+            self.job_label = ""
+            self.output_cache = output_cache.OutputCache()
+            self.source_digest = None  # Hash of the loaded file, part of the cache key
+            self.printegrated = False  # Set once the loaded G-code has holes injected
+            self.result_key = None  # Cache key of the printegrated G-code shown
+            self.result_placement = None  # (layer index, conductive tool, holes) it was printegrated with
+            self.placement_memo = (None, None)  # Last placement and its cache key
+            self.object_index = None  # M486 objects of the loaded file, if the slicer labelled them
+            self.object_ids = []  # Object id of each entry of the object choice after None
             
             # Create main vertical sizer
             main_sizer = wx.BoxSizer(wx.VERTICAL)
@@ -110,10 +150,29 @@ class PrintegrateFrame(wx.Frame):
             conductive_sizer.Add(self.conductive_choice, 0, wx.ALL, 0)
             browser_sizer.Add(conductive_sizer, 0, wx.ALL, 5)
 
+            # Add selector to centre the active pattern on one object of the plate
+            object_label = wx.StaticText(browser_panel, label="Object:")
+            browser_sizer.Add(object_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+            self.object_choice = wx.Choice(browser_panel, choices=["None"])
+            self.object_choice.SetSelection(0)
+            self.object_choice.Bind(wx.EVT_CHOICE, self.on_object_select)
+            self.object_choice.Disable()  # Until G-code with labelled objects is loaded
+            browser_sizer.Add(self.object_choice, 0, wx.ALL, 5)
+
+            # Add button to step and repeat the active pattern across the plate
+            repeat_btn = wx.Button(browser_panel, label="Repeat...")
+            repeat_btn.Bind(wx.EVT_BUTTON, self.on_repeat)
+            browser_sizer.Add(repeat_btn, 0, wx.ALL, 5)
+
+            # Add button to jump to the layer where the PCB pocket closes
+            self.auto_layer_btn = wx.Button(browser_panel, label="Auto Layer")
+            self.auto_layer_btn.Bind(wx.EVT_BUTTON, self.on_auto_layer)
+            browser_sizer.Add(self.auto_layer_btn, 0, wx.ALL, 5)
+
             # Add Printegrate button
-            printegrate_btn = wx.Button(browser_panel, label="Printegrate")
-            printegrate_btn.Bind(wx.EVT_BUTTON, self.on_printegrate)
-            browser_sizer.Add(printegrate_btn, 0, wx.ALL, 5)
+            self.printegrate_btn = wx.Button(browser_panel, label="Printegrate")
+            self.printegrate_btn.Bind(wx.EVT_BUTTON, self.on_printegrate)
+            browser_sizer.Add(self.printegrate_btn, 0, wx.ALL, 5)
 
             # Add Reset button
             reset_btn = wx.Button(browser_panel, label="Reset")
@@ -121,9 +180,14 @@ class PrintegrateFrame(wx.Frame):
             browser_sizer.Add(reset_btn, 0, wx.ALL, 5)
 
             # Add Save button
-            save_btn = wx.Button(browser_panel, label="Save")
-            save_btn.Bind(wx.EVT_BUTTON, self.on_save)
-            browser_sizer.Add(save_btn, 0, wx.ALL, 5)
+            self.save_btn = wx.Button(browser_panel, label="Save")
+            self.save_btn.Bind(wx.EVT_BUTTON, self.on_save)
+            browser_sizer.Add(self.save_btn, 0, wx.ALL, 5)
+
+            # Add button to stream the G-code straight to a printer instead of saving it
+            self.send_btn = wx.Button(browser_panel, label="Send to Printer")
+            self.send_btn.Bind(wx.EVT_BUTTON, self.on_send)
+            browser_sizer.Add(self.send_btn, 0, wx.ALL, 5)
             
             browser_panel.SetSizer(browser_sizer)
             content_sizer.Add(browser_panel, 0, wx.EXPAND | wx.ALL, 5)
@@ -140,9 +204,39 @@ class PrintegrateFrame(wx.Frame):
             self.marker = MarkerActor(parent_viewer=self.gcview)
             # Add marker after platform but before model
             self.gcview.objects.insert(1, printrun.gcview.GCObject(self.marker))
+            # Add level-of-detail actor for the layers under the current one on large prints
+            self.lod = LodModelActor(parent_viewer=self.gcview)
+            self.gcview.objects.insert(1, printrun.gcview.GCObject(self.lod))
+            # Render the model offscreen once per view so marker drags only redraw the marker
+            self.scene_cache = SceneCache(self.gcview, overlays=[self.marker])
             
             content_sizer.Add(self.gcview.widget, 1, wx.EXPAND | wx.ALL, 5)
             
+            # Add drill library panel listing the drill files of a folder
+            library_panel = wx.Panel(self)
+            library_sizer = wx.BoxSizer(wx.VERTICAL)
+            library_label = wx.StaticText(library_panel, label="Drill Library")
+            library_sizer.Add(library_label, 0, wx.ALL, 5)
+            library_btn = wx.Button(library_panel, label="Folder...")
+            library_btn.Bind(wx.EVT_BUTTON, self.on_library_folder)
+            library_sizer.Add(library_btn, 0, wx.EXPAND | wx.ALL, 5)
+            # Checked files are placed on the print, the selected one is edited
+            self.library_list = wx.CheckListBox(library_panel, size=(200, -1))
+            self.library_list.Bind(wx.EVT_CHECKLISTBOX, self.on_library_check)
+            self.library_list.Bind(wx.EVT_LISTBOX, self.on_library_select)
+            library_sizer.Add(self.library_list, 1, wx.EXPAND | wx.ALL, 5)
+            library_panel.SetSizer(library_sizer)
+            viewer_sizer.Add(library_panel, 0, wx.EXPAND)
+
+            # Poll the library folder so edited drill files are picked up
+            self.library_timer = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER, self.on_library_timer, self.library_timer)
+
+            # Poll the placement so the cache status follows marker drags
+            self.cache_timer = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER, self.on_cache_timer, self.cache_timer)
+            self.cache_timer.Start(CACHE_STATUS_INTERVAL)
+            
             # Add content sizer to viewer sizer
             viewer_sizer.Add(content_sizer, 1, wx.EXPAND)
             
@@ -177,6 +271,20 @@ class PrintegrateFrame(wx.Frame):
             )
             self.movement_slider.Bind(wx.EVT_SLIDER, self.on_movement_change)
             bottom_sizer.Add(self.movement_slider, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+
+            # Progress of sending to a printer
+            self.send_gauge = wx.Gauge(self, range=1000, size=(150, -1))
+            bottom_sizer.Add(self.send_gauge, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 5)
+
+            # Whether a stored result matches the current placement
+            self.cache_text = wx.StaticText(self, label="", size=(200, -1))
+            bottom_sizer.Add(self.cache_text, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 10)
+
+            # Stage and progress of a running Printegrate or Save job
+            self.job_text = wx.StaticText(self, label="", size=(120, -1))
+            bottom_sizer.Add(self.job_text, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 10)
+            self.job_gauge = wx.Gauge(self, range=1000, size=(150, -1))
+            bottom_sizer.Add(self.job_gauge, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 5)
             
             # Add bottom sizer to main sizer
             main_sizer.Add(bottom_sizer, 0, wx.EXPAND | wx.ALL, 5)
@@ -186,6 +294,9 @@ class PrintegrateFrame(wx.Frame):
             # Disable sliders initially
             self.layer_slider.Disable()
             self.movement_slider.Disable()
+
+            if os.path.isdir(DRILL_LIBRARY_DIR):
+                self.set_library_folder(DRILL_LIBRARY_DIR)
             
             # Load G-code if path was provided
             if self.gcode_path:
@@ -197,43 +308,6 @@ class PrintegrateFrame(wx.Frame):
             
             browser_panel.Layout()
 
-        def parse_drill_file(self, filepath):
-            """Parse a drill file and extract tool definitions and coordinates"""
-            tools = {}
-            current_tool = None
-            
-            with open(filepath, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    
-                    # Parse tool definitions (e.g., T1C0.300)
-                    if line.startswith('T') and 'C' in line:
-                        match = re.match(r'T(\d+)C([\d.]+)', line)
-                        if match:
-                            tool_num = match.group(1)
-                            tool_size = float(match.group(2))
-                            tools[f'T{tool_num}'] = {
-                                'size': tool_size,
-                                'points': []
-                            }
-                    
-                    # Parse coordinates
-                    elif line.startswith('X') and 'Y' in line:
-                        if current_tool and current_tool in tools:
-                            match = re.match(r'X([\d.-]+)Y([\d.-]+)', line)
-                            if match:
-                                x = float(match.group(1))
-                                y = float(match.group(2))
-                                # Convert to positive Y coordinates and add current Z height
-                                z = self.marker.get_current_layer_height()
-                                tools[current_tool]['points'].append([x, -y, z])
-                    
-                    # Track current tool
-                    elif line.startswith('T'):
-                        current_tool = f'T{line[1:]}'
-            
-            return tools
-
         def on_tool_select(self, event):
             """Handle tool selection"""
             if event is None:
@@ -246,35 +320,157 @@ class PrintegrateFrame(wx.Frame):
             self.marker.set_current_tool(tool)
 
         def load_drill_file(self, filepath):
-            """Load and parse a drill file"""
+            """Place a drill file on the print and make it the active pattern"""
             try:
-                self.drl_path = filepath
-                self.marker.clear_drill_points()
-                
-                # Reset tool choices
-                self.tool_choice.Clear()
-                self.tool_choice.Append("None")
-                
-                # Parse and load tools
-                tools_data = self.parse_drill_file(filepath)
-                if not tools_data:
-                    return
-                
-                # Add points for each tool
-                for tool_name, data in tools_data.items():
-                    if data['points']:  # Only add tools that have points
-                        self.marker.add_drill_points(tool_name, data['points'], data['size'])
-                        self.tool_choice.Append(f"{tool_name} ({data['size']}mm)")
-                
-                # Select first tool if available
-                self.tool_choice.Enable(True)
-                self.tool_choice.SetSelection(1 if self.tool_choice.GetCount() > 1 else 0)
-                if self.tool_choice.GetSelection() > 0:
-                    self.on_tool_select(None)
-                
+                self.show_pattern(filepath)
+                self.activate_pattern(filepath)
             except Exception as e:
                 wx.MessageBox(f"Error loading drill file: {str(e)}", "Error", wx.OK | wx.ICON_ERROR)
 
+        def show_pattern(self, filepath):
+            """Place a drill file's pattern on the print, or reload it in place
+
+            The pattern is parsed once per file content by the drill library,
+            so switching between boards doesn't parse anything again.
+            """
+            tools_data = self.drill_library.load(filepath)
+            marker = self.pattern_markers.get(filepath)
+            if marker is None:
+                if self.marker in self.pattern_markers.values():
+                    marker = self.add_pattern_marker()
+                else:
+                    marker = self.marker  # The first pattern uses the initial marker
+                self.pattern_markers[filepath] = marker
+
+            # Add points for each tool, keeping the selected tool on reloads
+            current_tool = marker.current_tool
+            marker.clear_drill_points()
+            for tool_name, data in tools_data.items():
+                if data['points']:  # Only add tools that have points
+                    marker.add_drill_points(tool_name, data['points'], data['size'])
+            if current_tool in marker.drill_points:
+                marker.current_tool = current_tool
+
+            self.set_library_checked(filepath, True)
+            return marker
+
+        def hide_pattern(self, filepath):
+            """Take a drill file's pattern off the print"""
+            marker = self.pattern_markers.pop(filepath, None)
+            if marker is None:
+                return
+            self.set_library_checked(filepath, False)
+            if self.pattern_markers:
+                self.remove_pattern_marker(marker)
+                if marker is self.marker:
+                    self.activate_pattern(next(iter(self.pattern_markers)))
+            else:
+                # Keep the last marker for the next pattern
+                marker.clear_drill_points()
+                marker.set_repeat(panel.parse_repeat(""))
+                self.drl_path = None
+                self.file_text.SetLabel("No .drl file selected")
+                self.update_tool_choices()
+
+        def activate_pattern(self, filepath):
+            """Make a placed pattern the one the tool choice and dragging apply to"""
+            self.marker = self.pattern_markers[filepath]
+            self.drl_path = filepath
+            self.file_text.SetLabel(filepath)
+            self.update_tool_choices()
+            if filepath in self.library_paths:
+                self.library_list.SetSelection(self.library_paths.index(filepath))
+
+        def add_pattern_marker(self):
+            """Create another marker so several patterns can be placed at once"""
+            marker = MarkerActor(parent_viewer=self.gcview)
+            self.gcview.objects.insert(1, printrun.gcview.GCObject(marker))
+            self.scene_cache.overlays.append(marker)
+            return marker
+
+        def remove_pattern_marker(self, marker):
+            marker.detach()
+            self.gcview.objects[:] = [obj for obj in self.gcview.objects if obj.model is not marker]
+            self.scene_cache.overlays.remove(marker)
+            self.gcview.Refresh()
+
+        def update_tool_choices(self):
+            """Fill the drill tool choice from the active marker"""
+            self.tool_choice.Clear()
+            self.tool_choice.Append("None")
+            tool_names = list(self.marker.drill_points)
+            for tool_name in tool_names:
+                size = self.marker.drill_points[tool_name]['size']
+                self.tool_choice.Append(f"{tool_name} ({size}mm)")
+
+            # Select the marker's tool, or the first tool if available
+            self.tool_choice.Enable(True)
+            if self.marker.current_tool in tool_names:
+                self.tool_choice.SetSelection(tool_names.index(self.marker.current_tool) + 1)
+            else:
+                self.tool_choice.SetSelection(1 if tool_names else 0)
+            if self.tool_choice.GetSelection() > 0:
+                self.on_tool_select(None)
+
+        def set_library_folder(self, folder):
+            """Index a folder of drill files and start watching it"""
+            self.drill_library.set_folder(folder)
+            self.update_library_list()
+            self.library_timer.Start(drill_library.WATCH_INTERVAL)
+
+        def update_library_list(self):
+            self.library_paths = self.drill_library.paths()
+            self.library_list.Set([os.path.basename(path) for path in self.library_paths])
+            for idx, path in enumerate(self.library_paths):
+                self.library_list.Check(idx, path in self.pattern_markers)
+            if self.drl_path in self.library_paths:
+                self.library_list.SetSelection(self.library_paths.index(self.drl_path))
+
+        def set_library_checked(self, filepath, checked):
+            if filepath in self.library_paths:
+                self.library_list.Check(self.library_paths.index(filepath), checked)
+
+        def on_library_folder(self, event):
+            """Handle library folder button click"""
+            with wx.DirDialog(self, "Choose a folder of drill files",
+                              defaultPath=self.drill_library.folder or os.getcwd()) as dlg:
+                if dlg.ShowModal() == wx.ID_OK:
+                    self.set_library_folder(dlg.GetPath())
+
+        def on_library_check(self, event):
+            """Place or remove a library pattern when its box is toggled"""
+            idx = event.GetInt()
+            filepath = self.library_paths[idx]
+            if self.library_list.IsChecked(idx):
+                self.load_drill_file(filepath)
+            else:
+                self.hide_pattern(filepath)
+
+        def on_library_select(self, event):
+            """Make a library pattern active, placing it if it isn't yet"""
+            idx = event.GetSelection()
+            if 0 <= idx < len(self.library_paths) and self.library_paths[idx] != self.drl_path:
+                self.load_drill_file(self.library_paths[idx])
+
+        def on_library_timer(self, event):
+            """Reload placed patterns whose drill files changed on disk"""
+            changed = self.drill_library.refresh()
+            if not changed:
+                return
+            for filepath in changed:
+                if filepath not in self.pattern_markers:
+                    continue
+                if filepath in self.drill_library.files:
+                    print(f"Drill file changed, reloading: {filepath}")
+                    self.show_pattern(filepath)
+                    if filepath == self.drl_path:
+                        self.update_tool_choices()
+                else:
+                    print(f"Drill file removed: {filepath}")
+                    self.hide_pattern(filepath)
+            self.update_library_list()
+            self.gcview.Refresh()
+
         def create_file_dialog(self):
             """Create a file dialog without showing it"""
             return wx.FileDialog(
@@ -317,9 +513,10 @@ class PrintegrateFrame(wx.Frame):
                 # Check printer compatibility
                 is_compatible, printer_name = self.check_printer_compatibility(path)
                 if not is_compatible:
+                    supported = "\n".join(f"- {name}" for name in profiles.load_profiles())
                     dlg = wx.MessageDialog(self,
                         "This G-code file appears to be for an unsupported printer.\n"
-                        "Currently supported printers:\n- Prusa XL\n\n"
+                        f"Currently supported printers:\n{supported}\n\n"
                         "The file must be generated by PrusaSlicer and contain a printer model comment\n"
                         "(e.g. ; printer_model = XL5).\n"
                         "The file may not work correctly with this application.",
@@ -328,27 +525,29 @@ class PrintegrateFrame(wx.Frame):
                     dlg.ShowModal()
                     dlg.Destroy()
                     exit()
+                self.printer_profile = profiles.get_profile(printer_name)
             
-                # Initialize variables dictionary
-                self.gcode_variables = {}
-                
                 # Parse G-code variables
-                with open(path, 'r') as f:
-                    for line in f:
-                        if line.startswith(';'):  # Comment line
-                            # Remove semicolon and whitespace
-                            comment = line[1:].strip()
-                            if '=' in comment:
-                                # Split on first equals sign
-                                key, value = comment.split('=', 1)
-                                # Clean up key and value
-                                key = key.strip()
-                                value = value.strip()
-                                self.gcode_variables[key] = value
+                self.gcode_variables = injection.read_variables(path)
+                # Hashed in the background once the file is shown, see start_load_job
+                self.source_digest = None
+                self.printegrated = False
+                self.result_key = None
+                self.result_placement = None
         
-                # Load the G-code file into the viewer
-                gcode = GCode([line for line in open(path)])
-                self.gcview.addfile(gcode)
+                # Load the G-code file into the viewer, very large files only have
+                # the layers around the current one parsed
+                if self.lazy_gcode:
+                    self.lazy_gcode.close()
+                    self.lazy_gcode = None
+                if os.path.getsize(path) >= lazy_gcode.LAZY_MIN_BYTES:
+                    self.load_lazy_gcode(lazy_gcode.LazyGCode.open(path))
+                else:
+                    gcode = parallel_parse.parse_gcode(path)
+                    self.gcview.addfile(gcode)
+                    self.scene_cache.invalidate()
+                    self.lod.load(self.gcview.model)
+                self.start_load_job(path)
                 
                 # Update UI elements
                 self.update_layer_slider()
@@ -399,35 +598,81 @@ class PrintegrateFrame(wx.Frame):
             # Wait for model to be initialized before updating colors
             self.update_colors_after_load()
 
+        def load_lazy_gcode(self, gcode):
+            """Show lazily loaded G-code, starting from its first layer"""
+            print(f"Loading G-code lazily: {len(gcode.all_layers)} layers")
+            self.lazy_gcode = gcode
+            self.gcview.clear()
+            self.scene_cache.invalidate()
+            self.show_layers(0)
+
+        def build_model(self, job, gcode):
+            """Build the viewer's model of parsed G-code, off the UI thread"""
+            model = printrun.gcview.create_model(False)
+            model.set_path_size(self.gcview.path_halfwidth, self.gcview.path_halfheight)
+            layer_count = len(gcode.all_layers)
+            for layer_idx in model.load_data(gcode):
+                if layer_idx is None:
+                    break
+                job.progress(layer_idx + 1, layer_count)
+            return model
+
+        def show_model(self, model):
+            """Show a model from build_model, as the viewer's addfile would have"""
+            self.gcview.model = model
+            self.gcview.objects[-1].model = model
+            self.scene_cache.invalidate()
+            self.lod.load(model)
+            self.gcview.Refresh()
+
+        def show_layers(self, layer_idx):
+            """Show the layers up to layer_idx in the viewer
+
+            Lazily loaded G-code is handed to the viewer a window of layers at
+            a time, only rebuilt when the layer moves out of it.
+            """
+            if self.lazy_gcode:
+                model = self.gcview.model
+                first = getattr(model.gcode, 'first_layer', 0) if model else 0
+                count = len(model.gcode.all_layers) - 1 if model else 0
+                if not first <= layer_idx < first + count:
+                    first = max(0, layer_idx - lazy_gcode.VIEW_LAYERS_BELOW)
+                    last = min(len(self.lazy_gcode.all_layers) - 1, layer_idx + lazy_gcode.VIEW_LAYERS_ABOVE)
+                    self.gcview.addfile(self.lazy_gcode.window(first, last))
+                    self.scene_cache.invalidate()
+                    self.lod.load(self.gcview.model)
+                    self.update_colors_after_load()
+                self.gcview.setlayer(layer_idx - first)
+            else:
+                self.gcview.setlayer(layer_idx)
+
+        def get_layer(self, layer_idx):
+            """Get a parsed layer of the loaded G-code
+
+            The viewer's own layer objects are used where it has them, since
+            the movement slider highlights lines by their viewer vertices.
+            """
+            gcode = self.gcview.model.gcode
+            first = getattr(gcode, 'first_layer', 0)
+            if not self.lazy_gcode or 0 <= layer_idx - first < len(gcode.all_layers) - 1:
+                return gcode.all_layers[layer_idx - first]
+            return self.lazy_gcode.all_layers[layer_idx]
+
+        def get_layer_count(self):
+            """Number of layers in the loaded G-code"""
+            if self.lazy_gcode:
+                return len(self.lazy_gcode.all_layers)
+            return len(self.gcview.model.gcode.all_layers)
+
+        def get_gcode(self):
+            """The whole loaded G-code, lazy or parsed"""
+            return self.lazy_gcode or self.gcview.model.gcode
+
         def get_gcode_tools(self):
             """Extract all unique tool numbers from the loaded G-code"""
             if not hasattr(self.gcview, 'model') or not self.gcview.model:
                 return []
-                
-            tools = set()
-            gcode = self.gcview.model.gcode
-            
-            # Look through all lines for tool changes
-            for layer in gcode.all_layers:
-                for line in layer:
-                    if hasattr(line, 'command') and line.command.startswith('T'):
-                        # Extract tool number from T command
-                        try:
-                            tool_num = int(line.command[1:])
-                            tools.add(tool_num)
-                        except ValueError:
-                            continue
-            
-            return sorted(list(tools))
-
-        def get_active_tool_at_layer_start(self, layer_num):
-            if layer_num < 0 or layer_num >= len(self.gcview.model.gcode.all_layers):
-                return None
-            
-            first_line = self.gcview.model.gcode.all_layers[layer_num][0]
-            
-            return getattr(first_line, 'current_tool', None)
-
+            return injection.gcode_tools(self.get_gcode())
 
         def on_movement_change(self, event):
             """Handle movement slider changes"""
@@ -438,12 +683,11 @@ class PrintegrateFrame(wx.Frame):
                 
                 if hasattr(self.gcview.model, 'gcode'):
                     # Get all move commands in current layer
-                    gcode = self.gcview.model.gcode
-                    if current_layer >= len(gcode.all_layers):
+                    if current_layer >= self.get_layer_count():
                         print(f"Invalid layer index: {current_layer}")
                         return
                         
-                    layer = gcode.all_layers[current_layer]
+                    layer = self.get_layer(current_layer)
                     if not layer:
                         print("Empty layer")
                         return
@@ -494,6 +738,64 @@ class PrintegrateFrame(wx.Frame):
             """Move marker to a new position"""
             self.marker.position[0] += 10  # Move 10mm in X
 
+        def start_load_job(self, path):
+            """Hash the loaded file and index its M486 objects in the background
+
+            No stored result is looked up until the file's hash is known and
+            the object choices stay empty until the index is done. Lazily
+            loaded files are indexed from their bytes without parsing them.
+            """
+            self.cache_text.SetLabel("")
+            self.object_index = None
+            self.update_object_choices()
+            gcode = self.get_gcode() if objects.uses_labels(self.gcode_variables) else None
+
+            def digest(job, _):
+                return output_cache.file_digest(path, progress=job.progress)
+
+            def index(job, source_digest):
+                object_index = objects.ObjectIndex.from_gcode(gcode, check=job.check) if gcode else None
+                return source_digest, object_index
+
+            self.start_job("Load", None, [("Hashing", digest), ("Indexing objects", index)], self.on_load_done)
+
+        def on_load_done(self, job):
+            """Take the hash and object index of a start_load_job job"""
+            if job.cancelled:
+                return
+            if job.error:
+                print(f"Error reading G-code: {str(job.error)}")
+                return
+            self.source_digest, self.object_index = job.result
+            self.update_object_choices()
+
+        def update_object_choices(self):
+            """List the indexed M486 objects to centre the pattern on"""
+            self.object_choice.Clear()
+            self.object_choice.Append("None")
+            self.object_ids = []
+            if self.object_index:
+                for obj in sorted(self.object_index.footprints):
+                    self.object_choice.Append(self.object_index.describe(obj))
+                    self.object_ids.append(obj)
+                print(f"Found {len(self.object_ids)} objects")
+            self.object_choice.SetSelection(0)
+            self.object_choice.Enable(bool(self.object_ids))
+
+        def on_object_select(self, event):
+            """Centre the active pattern on the selected object"""
+            selection = self.object_choice.GetSelection()
+            if selection <= 0 or not self.object_index:
+                return
+            if not hasattr(self, 'marker') or not self.marker:
+                wx.MessageBox("Place a drill file first", "Object", wx.OK | wx.ICON_ERROR)
+                self.object_choice.SetSelection(0)
+                return
+            obj = self.object_ids[selection - 1]
+            self.marker.position[0], self.marker.position[1] = self.object_index.centre(obj)
+            print(f"Centred the pattern on {self.object_index.describe(obj)}")
+            self.gcview.widget.Refresh()
+
         def on_conductive_tool_select(self, event):
             """Handle conductive tool selection"""
             selection = self.conductive_choice.GetSelection()
@@ -514,12 +816,127 @@ class PrintegrateFrame(wx.Frame):
                     tool_num = int(tool[1:])  # Extract number from "T1" etc
                     setattr(self.gcview.model, f'color_tool{tool_num}', (0.15, 0.15, 0.15, 1.0))  # Very dark grey
         
-                # Force redraw
-                self.gcview.model.update_colors()
+                # Only the changed palette entries are uploaded on the next frame
+                tool_palette.attach(self.gcview.model)
                 self.gcview.widget.Refresh()
 
+        def get_holes(self):
+            """Print coordinates of the drill points of every placed pattern, with its own selected tool"""
+            holes = []
+            for marker in self.pattern_markers.values():
+                # Every copy of a repeated pattern, injected in the same toolchange
+                holes.extend(marker.placed_points().tolist())
+            return holes
+
+        def get_boards(self):
+            """Holes of each board placed, every copy of every pattern, see pocket.find_pocket_layer"""
+            boards = []
+            for marker in self.pattern_markers.values():
+                boards.extend(marker.placed_boards())
+            return boards
+
+        def get_placement(self):
+            """(layer_idx, conductive_tool, holes, layer_height) to printegrate with
+
+            The conductive tool is None while none is selected.
+            """
+            # Selected conductive tool
+            conductive_tool = self.conductive_choice.GetString(self.conductive_choice.GetSelection())
+            conductive_tool = int(conductive_tool[1:]) if conductive_tool != "None" else None
+            # The marker updates its layer index when it looks up the layer height
+            layer_height = self.marker.get_current_layer_height()
+            layer_idx = self.marker.last_layer_number
+            # Get the coordinates of the drill points to do printegration with
+            holes = self.get_holes()
+            return layer_idx, conductive_tool, holes, layer_height
+
+        def placement_key(self):
+            """Output cache key of printegrating the loaded file as placed, None if incomplete"""
+            if not self.source_digest or not self.printer_profile:
+                return None
+            layer_idx, conductive_tool, holes, layer_height = self.get_placement()
+            if conductive_tool is None or not holes:
+                return None
+            placement = (self.source_digest, layer_idx, conductive_tool, layer_height, str(holes))
+            if placement != self.placement_memo[0]:
+                key = output_cache.placement_key(self.source_digest, self.printer_profile, holes, layer_idx,
+                                                 conductive_tool, layer_height)
+                self.placement_memo = (placement, key)
+            return self.placement_memo[1]
+
+        def on_cache_timer(self, event):
+            """Show whether a stored result matches the current placement"""
+            if self.job or not self.gcview.model:
+                return
+            if self.printegrated:
+                label = "Result stored" if self.output_cache.has(self.result_key) else ""
+            else:
+                label = "Stored result matches this placement" if self.output_cache.has(self.placement_key()) else ""
+            if self.cache_text.GetLabel() != label:
+                self.cache_text.SetLabel(label)
+
+        def on_repeat(self, event):
+            """Ask for the copies of the active pattern to place"""
+            if not self.drl_path:
+                wx.MessageBox("Place a drill file first", "Repeat", wx.OK | wx.ICON_ERROR)
+                return
+            dlg = wx.TextEntryDialog(self,
+                "Copies of the pattern, from where it is placed now:\n"
+                "a grid like \"5x2 @ 40,35\" (columns x rows @ pitch X,Y in mm)\n"
+                "or offsets like \"0,0; 60,0; 60,45\". Leave empty for a single copy.",
+                "Repeat", self.marker.repeat_text)
+            try:
+                if dlg.ShowModal() != wx.ID_OK:
+                    return
+                text = dlg.GetValue()
+            finally:
+                dlg.Destroy()
+            try:
+                offsets = panel.parse_repeat(text)
+            except ValueError as e:
+                wx.MessageBox(str(e), "Repeat", wx.OK | wx.ICON_ERROR)
+                return
+            self.marker.set_repeat(offsets, text.strip())
+            print(f"Placing {len(offsets)} copies of {os.path.basename(self.drl_path)}")
+
+        def on_auto_layer(self, event):
+            """Find the layer where the pocket under the placed patterns closes in the background, or cancel it"""
+            if self.cancel_running_job("Auto Layer"):
+                return
+            boards = self.get_boards()
+            gcode = self.get_gcode()
+            if not boards or not gcode:
+                wx.MessageBox("Load G-code and place a drill file first", "Auto Layer", wx.OK | wx.ICON_ERROR)
+                return
+
+            def scan(job, _):
+                return pocket.find_pocket_layer(gcode, boards, progress=job.progress)
+
+            self.start_job("Auto Layer", self.auto_layer_btn, [("Scanning layers", scan)], self.on_auto_layer_done)
+
+        def on_auto_layer_done(self, job):
+            """Move to the layer found by an Auto Layer job"""
+            if job.cancelled:
+                print("Auto Layer cancelled")
+                return
+            if job.error:
+                wx.MessageBox(f"Error finding the pocket: {str(job.error)}", "Auto Layer", wx.OK | wx.ICON_ERROR)
+                return
+            found = job.result
+            if found['layer'] is None:
+                wx.MessageBox("No pocket found under the drill holes. Pick the layer with the slider instead.",
+                              "Auto Layer", wx.OK | wx.ICON_INFORMATION)
+                return
+
+            print(f"Pocket under the board closes at layer {found['layer']}, {found['depth']} mm deep")
+            self.layer_slider.SetValue(found['layer'])
+            self.on_layer_change(None)
+
         def on_printegrate(self, event):
-            """Handle Printegrate button click - print drill hole coordinates"""
+            """Handle Printegrate button click - inject the holes in the background, or cancel it"""
+            if self.cancel_running_job("Printegrate"):
+                return
+
             print("\n=== Drill Hole Coordinates ===")
 
             # Check if a marker file is loaded
@@ -544,263 +961,97 @@ class PrintegrateFrame(wx.Frame):
                 return
             
                 
-            # Print selected conductive tool
-            conductive_tool = self.conductive_choice.GetString(self.conductive_choice.GetSelection())
-            conductive_tool = int(conductive_tool[1:])  # Make it an int
-           
-            # Get the Layer index of the markers
-            layer_idx = self.marker.last_layer_number
-
-            # Get the coordinates of the drill points to do printegration with
-            holes = []
-            current_tool = self.marker.current_tool
-            if current_tool and current_tool in self.marker.drill_points:
-                data = self.marker.drill_points[current_tool]
-                for point in data['points']:
-                    # Apply any transformations from the marker's position
-                    x = point[0] + self.marker.position[0]
-                    y = point[1] + self.marker.position[1]
-                    holes.append([x, y])
-                    
-
-            
-            active_tool = self.get_active_tool_at_layer_start(layer_idx)
-            if active_tool is not None:
-                print(f"  Active Tool: T{active_tool}")
-            else:
-                print("  No active tool found")
-            
-            print("\n=== End Drill Hole Coordinates ===")
-
-            ## If the active tool is not the same as the conductive tool, then we are going to need to change to
-            ## the tool and perform a wipe
-
-            gcode_to = ""
-            gcode_from = ""
-
-            if active_tool is not None and active_tool != conductive_tool:
-                
-                # Find if the gcode contains a wipe tower
-                ## Search g-code for comment line '; wipe_tower = 1'
-                gcode = self.gcview.model.gcode
-                # Loop though all lines of gcode
-                for idx, line in enumerate(gcode.lines):
-                    if hasattr(line, 'raw') and '; wipe_tower = 1' in line.raw:	
-                        print("Found wipe tower")
-                        break
-                    if idx == len(gcode.lines) - 1:
-                        print("No wipe tower found")
-                        exit()
-            
-                ## Now we know the g-code contains a wipe tower, so we need to work ou tthe parameters needed to populate
-                ## the wipe tower g-code snipet
-
-                ### Things we need to work out
-                ### 1. The current layer height
-                ### 2. The current tool number
-                ### 3. The current tool temperature
-                ### 4. The conductive tool temperature
-                ### 5. The location of the wipe tower (x, y)
-                ### 7. The retract length before a toolchange
-
-                ## Current layer height is easy we can just take the marker's current layer height
-                current_layer_height = self.marker.get_current_layer_height()
-
-                ## Current tool number is easy we can use the model's active_tool
-                current_tool_number = active_tool
-
-                ## Tool temps can be parsed from g-code with the form "; temperature = 205,205,205,230,245" 
-
-                # Loop though all lines of gcode
-                for line in gcode.lines:
-                    if hasattr(line, 'raw') and '; temperature = ' in line.raw:
-                        tool_temps = [int(temp.strip()) for temp in line.raw.split('=')[1].split(',')]
-                        break
-
-                # Convert tool numbers to integers for indexing
-                conductive_tool_idx = int(conductive_tool)
-                current_tool_idx = int(current_tool_number)
-
-                to_temp = tool_temps[conductive_tool_idx]
-                from_temp = tool_temps[current_tool_idx]
-
-                # Lets find the coordinates of the wipe tower
-                # We're looking for a comment line like this:
-                #; wipe_tower_x = 190.747
-                #; wipe_tower_y = 296.1
-
-                wipe_tower_x = None
-                wipe_tower_y = None
-
-                # Loop though all lines of gcode
-                for line in gcode.lines:
-                    if hasattr(line, 'raw') and '; wipe_tower_x = ' in line.raw:
-                        wipe_tower_x = float(line.raw.split('=')[1].strip())
-                    if hasattr(line, 'raw') and '; wipe_tower_y = ' in line.raw:
-                        wipe_tower_y = float(line.raw.split('=')[1].strip())
-
-                # Print everything nicely
-                print(f"Current Layer Height: {current_layer_height}")
-                print(f"Current Tool Number: {current_tool_number}")
-                # print(f"Conductive Tool Temperature: {self.gcview.model.conductive_tool_temp}")
-                print(f"Wipe Tower X: {wipe_tower_x}")
-                print(f"Wipe Tower Y: {wipe_tower_y}")
-
-                ## Fill g-code snippets
-                # Read the template file
-                with open('toolchange.gcode', 'r') as f:
-                    template = f.read()
-
-                # Calculate wipe coordinates (offset from wipe tower center)
-                wipe_x1 = wipe_tower_x - 0.25  # 0.25mm left of wipe tower
-                wipe_x2 = wipe_tower_x - 1.75  # 1.75mm left of wipe tower
-                wipe_y1 = wipe_tower_y + 0.25  # 0.25mm above wipe tower
-                wipe_y2 = wipe_tower_y - 0.75  # 0.75mm below wipe tower
-
-                # Set retract amount
-                retract_amount = 20  # mm
-
-                # Populate the template for changing TO the conductive tool
-                gcode_to = template.replace('[LAYER_HEIGHT]', str(current_layer_height))
-                gcode_to = gcode_to.replace('[RETRACT]', str(retract_amount))
-                gcode_to = gcode_to.replace('[FROM_TOOL]', str(current_tool_number))
-                gcode_to = gcode_to.replace('[TO_TOOL]', str(conductive_tool))
-                gcode_to = gcode_to.replace('[TO_TOOL_TEMP]', str(to_temp))
-                gcode_to = gcode_to.replace('[WIPE_X1]', str(wipe_x1))
-                gcode_to = gcode_to.replace('[WIPE_X2]', str(wipe_x2))
-                gcode_to = gcode_to.replace('[WIPE_Y1]', str(wipe_y1))
-                gcode_to = gcode_to.replace('[WIPE_Y2]', str(wipe_y2))
-                gcode_to = gcode_to.replace('[DE_RETRACT]', str(retract_amount))
-
-                # Populate the template for changing FROM the conductive tool back to the original tool
-                gcode_from = template.replace('[LAYER_HEIGHT]', str(current_layer_height))
-                # gcode_from = gcode_from.replace('[RETRACT]', str(retract_amount))
-                gcode_from = gcode_from.replace('[RETRACT]', str(0))
-                gcode_from = gcode_from.replace('[FROM_TOOL]', str(conductive_tool))
-                gcode_from = gcode_from.replace('[TO_TOOL]', str(current_tool_number))
-                gcode_from = gcode_from.replace('[TO_TOOL_TEMP]', str(from_temp))
-                gcode_from = gcode_from.replace('[WIPE_X1]', str(wipe_x1))
-                gcode_from = gcode_from.replace('[WIPE_X2]', str(wipe_x2))
-                gcode_from = gcode_from.replace('[WIPE_Y1]', str(wipe_y1))
-                gcode_from = gcode_from.replace('[WIPE_Y2]', str(wipe_y2))
-                gcode_from = gcode_from.replace('[DE_RETRACT]', str(retract_amount))
-
-                # Print the generated G-code for verification
-                print("\nGenerated G-code for changing TO conductive tool:")
-                print(gcode_to)
-                print("\nGenerated G-code for changing FROM conductive tool:")
-                print(gcode_from)
-
-            # Generate G-code for drilling holes
-            print("\nGenerating G-code for holes...")
-            # Get the first line of the current layer to get the starting position
-            layer = self.gcview.model.gcode.all_layers[layer_idx]
-            
-            # Find the first move command in the layer to get the starting position
-            first_move = None
-            for line in layer:
-                if hasattr(line, 'is_move') and line.is_move:
-                    first_move = line
-                    break
-            
-            if first_move is None:
-                print("Error: No move commands found in layer")
+            layer_idx, conductive_tool, holes, layer_height = self.get_placement()
+            if conductive_tool is None:
+                wx.MessageBox("Select the conductive tool first", "Printegrate", wx.OK | wx.ICON_ERROR)
+                return
+            gcode = self.get_gcode()
+            lazy = bool(self.lazy_gcode)
+
+            placement = (layer_idx, conductive_tool, holes)
+            # A stored result only applies to G-code that has no holes injected yet
+            key = None if self.printegrated else self.placement_key()
+            if self.output_cache.has(key):
+                print(f"Using the stored result for this placement: {key}")
+                cache = self.output_cache
+
+                def load(job, _):
+                    # Read from a copy, another process may evict the stored result meanwhile
+                    fd, copy_path = tempfile.mkstemp(suffix='.gcode')
+                    os.close(fd)
+                    if cache.get(key, copy_path) is None:
+                        os.remove(copy_path)
+                        raise FileNotFoundError("The stored result was removed before it could be read")
+                    if lazy:
+                        return lazy_gcode.LazyGCode.open(copy_path, temporary=True)
+                    try:
+                        return self.build_model(job, parallel_parse.parse_gcode(copy_path))
+                    finally:
+                        os.remove(copy_path)
+
+                self.start_job("Printegrate", self.printegrate_btn, [("Loading stored result", load)],
+                               lambda job: self.on_printegrate_done(job, key, placement))
                 return
-            
-            layer_start_pos = [first_move.current_x, first_move.current_y, first_move.current_z]
-            print(f"Layer start position: {layer_start_pos}")
-
-            hole_gcode = self.generate_gcode_for_holes(holes, layer_start_pos)
-            print("\nGenerated G-code for holes:")
-            
-            combined_gcode = [line for line in gcode_to.split('\n')]
-            combined_gcode.extend(["M601 \n"])
-            combined_gcode.extend(hole_gcode)
-            combined_gcode.extend([line for line in gcode_from.split('\n')])
 
+            variables = self.gcode_variables
+            profile = self.printer_profile
+            # Printegrated G-code has the holes' labels of its own, so it is indexed again
+            object_index = None if self.printegrated else self.object_index
+
+            def plan(job, _):
+                return injection.plan_injection(gcode, variables, profile, layer_idx, conductive_tool,
+                                                holes, layer_height, check=job.check, object_index=object_index)
+
+            def splice(job, insertions):
+                return planner.splice_lines(gcode, insertions, progress=job.progress)
+
+            def parse(job, gcode_lines):
+                if lazy:
+                    return lazy_gcode.LazyGCode.from_lines(gcode_lines)
+                return self.build_model(job, parallel_parse.parse_lines(gcode_lines))
+
+            self.start_job("Printegrate", self.printegrate_btn,
+                           [("Planning", plan), ("Splicing", splice), ("Parsing", parse)],
+                           lambda job: self.on_printegrate_done(job, key, placement))
+
+        def on_printegrate_done(self, job, key, placement):
+            """Show the printegrated G-code once its job has finished"""
+            if job.cancelled:
+                if isinstance(job.result, lazy_gcode.LazyGCode):
+                    job.result.close()
+                print("Printegrate cancelled")
+                return
+            if job.error:
+                wx.MessageBox(f"Error printegrating: {str(job.error)}", "Error", wx.OK | wx.ICON_ERROR)
+                return
+            self.printegrated = True
+            self.result_key = key
+            self.result_placement = placement
 
-            ## Prepend the gcode to the model
-            self.gcview.model.gcode.prepend_to_layer(combined_gcode, layer_idx)
-            
-            # Get all gcode lines
-            gcode_lines = [line.raw + "\n" for line in self.gcview.model.gcode.all_layers[0]]
-            for layer in self.gcview.model.gcode.all_layers[1:]:
-                gcode_lines.extend(line.raw + "\n" for line in layer)
-            
             # Clear and reload visualization
             self.gcview.clear()
-            self.gcview.addfile(GCode(gcode_lines))
+            self.scene_cache.invalidate()
+            if isinstance(job.result, lazy_gcode.LazyGCode):
+                if self.lazy_gcode:
+                    self.lazy_gcode.close()
+                self.load_lazy_gcode(job.result)
+            else:
+                self.show_model(job.result)
             self.on_layer_change(None)
             
             # Reapply colors after reloading
             self.update_colors_after_load()
 
-        def generate_gcode_for_holes(self, holes, last_pos, extrusion_amount=0.48, retraction_amount=7.5, print_retraction=2.5):
-            """Generate G-code commands for drilling holes
-            
-            Args:
-                holes: List of [x, y] coordinates for holes
-                last_pos: List of [x, y, z] coordinates for starting position
-                extrusion_amount: Amount to extrude for each hole
-                retraction_amount: Amount to retract between holes
-                print_retraction: Amount to retract before returning to print
-            """
-            x_start, y_start, z_start = last_pos
-            gcode = []
-            move_above_height = 5 + z_start  # Move 5mm above the last Z-height
-
-            z_down = round(z_start-0.45, 4)
-
-            # Set the temp a bit higher
-            gcode.append(f"M104 S240")
-            # Retract a bit
-            gcode.append(f"G1 E-{retraction_amount} F4200")
-            # Move up a bit
-            gcode.append(f"G0 Z{move_above_height} F4200")
-            
-            for x, y in holes:
-                x = round(x, 4)
-                y = round(y, 4)
-                # Move above the hole
-                gcode.append(f"G0 X{x} Y{y} Z{move_above_height} F4200")
-                # Lower down to the point
-                gcode.append(f"G0 Z{z_down} F4200")
-                # Un-retract
-                gcode.append(f"G1 E{retraction_amount} F4200")
-                # Extrude some plastic
-                gcode.append(f"G1 E{extrusion_amount} F4200")
-                # Wait for 1 second
-                gcode.append(f"G4 P1000")
-                # Retract a bit
-                gcode.append(f"G1 E-{retraction_amount} F4200")
-                # Wait for 1 second
-                gcode.append(f"G4 P1000")
-                # Move 1mm to the right
-                gcode.append(f"G0 X{x+1} Y{y} F4200")
-                # Move up back to 5mm above before going to the next hole
-                gcode.append(f"G0 Z{move_above_height} F4200")
-            
-            # Move back to the last x, y position
-            gcode.append(f"G0 X{x_start} Y{y_start} F4200")
-            # Move back to the last z position
-            gcode.append(f"G0 Z{z_start} F4200")
-
-            # Set the temp back to 220
-            gcode.append(f"M104 S220")
-            gcode.append(f"G1 E{retraction_amount-print_retraction} F4200")
-
-            return gcode
-
         def on_layer_change(self, event):
             """Handle layer slider changes"""
             try:
                 layer = self.layer_slider.GetValue()
                 if hasattr(self.gcview, 'setlayer'):
-                    self.gcview.setlayer(layer)
+                    self.show_layers(layer)
                     
                     # Update movement slider for new layer
                     if hasattr(self.gcview.model, 'gcode'):
-                        current_layer = self.gcview.model.gcode.all_layers[layer]
+                        current_layer = self.get_layer(layer)
                         moves_count = len([line for line in current_layer if hasattr(line, 'is_move') and line.is_move])
                         self.movement_slider.SetMax(moves_count - 1)
                         self.movement_slider.SetValue(0)
@@ -814,27 +1065,14 @@ class PrintegrateFrame(wx.Frame):
 
         def check_printer_compatibility(self, gcode_path):
             """Check if the loaded G-code is compatible with supported printers"""
-            # List of supported printers and their identifying markers
-            SUPPORTED_PRINTERS = {
-                'Prusa XL': {
-                    'model_markers': ['printer_model = XL', 'printer_model = XL2', 'printer_model = XL5'],
-                    'content_markers': ['generated by PrusaSlicer']
-                }
-            }
-            
             try:
                 with open(gcode_path, 'r') as file:
                     content = file.read()
                     
-                    # Check each supported printer
-                    for printer, markers in SUPPORTED_PRINTERS.items():
-                        # Check printer model markers
-                        model_match = any(marker in content for marker in markers['model_markers'])
-                        # Check content markers
-                        content_match = any(marker in content for marker in markers['content_markers'])
-                        
-                        if model_match and content_match:
-                            return True, printer
+                    # Check each registered printer profile
+                    profile = profiles.match_profile(content)
+                    if profile:
+                        return True, profile.name
                         
                 return False, None
             except Exception as e:
@@ -845,6 +1083,8 @@ class PrintegrateFrame(wx.Frame):
             """Update the layer slider based on loaded G-code"""
             if hasattr(self.gcview, 'model') and self.gcview.model and hasattr(self.gcview.model, 'max_layers'):
                 max_layers = self.gcview.model.max_layers
+                if self.lazy_gcode:
+                    max_layers = len(self.lazy_gcode.all_layers) - 1
                 if max_layers > 0:
                     self.layer_slider.SetMax(max_layers)
                     self.layer_slider.SetValue(0)
@@ -853,7 +1093,7 @@ class PrintegrateFrame(wx.Frame):
         def update_move_slider(self):
             """Update the movement slider based on current layer"""
             if hasattr(self.gcview.model, 'gcode'):
-                current_layer = self.gcview.model.gcode.all_layers[0]
+                current_layer = self.get_layer(0)
                 moves_count = len([line for line in current_layer if hasattr(line, 'is_move') and line.is_move])
                 self.movement_slider.SetMax(moves_count - 1)
                 self.movement_slider.SetValue(0)
@@ -868,32 +1108,218 @@ class PrintegrateFrame(wx.Frame):
             return self.gcode_variables.get(key, default)
 
         def on_save(self, event):
-            """Save the current G-code back to the original file"""
+            """Save the current G-code back to the original file in the background, or cancel saving"""
+            if self.cancel_running_job("Save"):
+                return
+
             if not self.gcode_path:
                 wx.MessageBox("No G-code file loaded to save", "Error", wx.OK | wx.ICON_ERROR)
                 return
             
+            # Get the current gcode from the model
+            if not self.gcview.model or not self.gcview.model.gcode:
+                wx.MessageBox("No G-code model to save", "Error", wx.OK | wx.ICON_ERROR)
+                return
+
+            gcode = self.get_gcode()
+            gcode_path = self.gcode_path
+            tmp_path = gcode_path + '.tmp'
+            key = self.result_key
+            placement = self.result_placement
+            profile = self.printer_profile
+            cache = self.output_cache
+
+            def write(job, _):
+                # A stored result was verified when it was stored, it only needs copying
+                if key and cache.get(key, tmp_path) is not None:
+                    return True
+
+                # Write to a copy first so it can be checked against the original,
+                # which lazily loaded G-code may also still be mapped from
+                if isinstance(gcode, lazy_gcode.LazyGCode):
+                    # Lazily loaded G-code is written straight from its bytes
+                    data = gcode.data
+                    with open(tmp_path, 'wb') as f:
+                        for start in range(0, len(data), SAVE_BLOCK_SIZE):
+                            job.progress(start, len(data))
+                            f.write(data[start:start + SAVE_BLOCK_SIZE])
+                else:
+                    # Write the raw gcode lines a layer at a time, with the blank lines printrun dropped
+                    with open(tmp_path, 'w') as f:
+                        for lines, _ in planner.splice_runs(gcode, [], progress=job.progress):
+                            f.writelines(lines)
+                return False
+
+            def check(job, from_cache):
+                if from_cache:
+                    return None
+                # Only replace the original if nothing but inserted lines changed
+                report = verify.verify_splice(gcode_path, tmp_path)
+                if report['ok'] and key:
+                    job.check()
+                    # Stored with the metadata batch runs report for their results
+                    cache.put(key, tmp_path, meta=output_cache.result_meta(profile, *placement, report))
+                return report
+
+            self.start_job("Save", self.save_btn, [("Writing", write), ("Verifying", check)],
+                           lambda job: self.on_save_done(job, tmp_path))
+
+        def on_save_done(self, job, tmp_path):
+            """Replace the original with the saved copy if it passed verification"""
+            report = job.result
+            if job.cancelled or job.error or (report and not report['ok']):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            if job.cancelled:
+                print("Save cancelled")
+                return
+            if job.error:
+                wx.MessageBox(f"Error saving G-code: {str(job.error)}", "Error", wx.OK | wx.ICON_ERROR)
+                return
+
+            if report is None:
+                print("Saved the stored result for this placement")
+            else:
+                print(verify.format_report(report))
+            if report and not report['ok']:
+                wx.MessageBox("The G-code was not saved, the output does not match the original "
+                              "outside the injected lines:\n\n" + verify.format_report(report),
+                              "Verification Failed", wx.OK | wx.ICON_ERROR)
+                return
+            # G-code that wasn't printegrated is still mapped from the file being
+            # replaced, which Windows doesn't allow
+            mapped = None
+            if self.lazy_gcode and self.lazy_gcode.file and self.lazy_gcode.file.name == self.gcode_path:
+                mapped = self.lazy_gcode
+            if mapped:
+                mapped.close()
             try:
-                # Get the current gcode from the model
-                if not self.gcview.model or not self.gcview.model.gcode:
-                    wx.MessageBox("No G-code model to save", "Error", wx.OK | wx.ICON_ERROR)
-                    return
-                
-                # Get raw gcode lines from all layers
-                gcode_lines = [line.raw + "\n" for line in self.gcview.model.gcode.all_layers[0]]
-                for layer in self.gcview.model.gcode.all_layers[1:]:
-                    gcode_lines.extend(line.raw + "\n" for line in layer)
-                
-                # Save the gcode to the original file
-                with open(self.gcode_path, 'w') as f:
-                    f.writelines(gcode_lines)
-            
-                # wx.MessageBox("G-code saved successfully", "Success", wx.OK | wx.ICON_INFORMATION)
-                # Close the application after successful save
-                self.Close(True)
-            
-            except Exception as e:
+                os.replace(tmp_path, self.gcode_path)
+            except OSError as e:
+                if mapped:
+                    self.lazy_gcode = lazy_gcode.LazyGCode.open(self.gcode_path)
                 wx.MessageBox(f"Error saving G-code: {str(e)}", "Error", wx.OK | wx.ICON_ERROR)
+                return
+            
+            # wx.MessageBox("G-code saved successfully", "Success", wx.OK | wx.ICON_INFORMATION)
+            # Close the application after successful save
+            self.Close(True)
+
+        def on_send(self, event):
+            """Stream the current G-code to a printer over serial, or cancel sending"""
+            if self.printer_stream:
+                if wx.MessageBox("Stop sending to the printer?", "Sending",
+                                 wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
+                    self.printer_stream.cancel()
+                return
+
+            gcode = self.get_gcode()
+            if not gcode:
+                wx.MessageBox("No G-code loaded to send", "Error", wx.OK | wx.ICON_ERROR)
+                return
+
+            dialog = wx.TextEntryDialog(self, "Serial port of the printer:", "Send to Printer", self.printer_port)
+            if dialog.ShowModal() != wx.ID_OK:
+                dialog.Destroy()
+                return
+            self.printer_port = dialog.GetValue().strip()
+            dialog.Destroy()
+
+            stream = printer_stream.PrinterStream(
+                self.printer_port,
+                on_progress=self.on_send_progress,
+                on_pause=lambda index: wx.CallAfter(self.on_send_pause),
+                on_done=lambda: wx.CallAfter(self.on_send_done))
+            try:
+                with wx.BusyCursor():
+                    stream.connect()
+                    # Same lines a save would write, without parsing them again
+                    stream.start(planner.splice_lines(gcode, []))
+            except ConnectionError as e:
+                stream.disconnect()
+                wx.MessageBox(f"Error sending to printer: {str(e)}", "Error", wx.OK | wx.ICON_ERROR)
+                return
+
+            self.printer_stream = stream
+            self.send_permille = 0
+            self.send_gauge.SetValue(0)
+            self.send_btn.SetLabel("Stop Sending")
+
+        def on_send_progress(self, sent, total):
+            """Update the progress gauge, called from the send thread"""
+            permille = sent * 1000 // max(total, 1)
+            if permille != self.send_permille:
+                self.send_permille = permille
+                wx.CallAfter(self.send_gauge.SetValue, permille)
+
+        def on_send_pause(self):
+            """Sending reached the injection's M601, wait for the PCB to be placed"""
+            wx.MessageBox("Place the PCB on the print, then press OK to continue.",
+                          "Printing Paused", wx.OK | wx.ICON_INFORMATION)
+            if self.printer_stream:
+                self.printer_stream.resume()
+
+        def on_send_done(self):
+            stream = self.printer_stream
+            if not stream:
+                return
+            self.printer_stream = None
+            stream.disconnect()
+            self.send_btn.SetLabel("Send to Printer")
+            if stream.cancelled:
+                self.send_gauge.SetValue(0)
+            else:
+                self.send_gauge.SetValue(1000)
+                print(f"Sent {stream.total} lines to {stream.port}")
+
+        def cancel_running_job(self, name):
+            """Cancel the running job if it is a `name` job
+
+            Returns:
+                True if a job was running, so no other should be started
+            """
+            if not self.job:
+                return False
+            if self.job.name == name:
+                self.job.cancel()
+                self.job_text.SetLabel(f"{name}: Cancelling")
+            else:
+                wx.MessageBox(f"Wait for {self.job.name} to finish or cancel it first", "Busy",
+                              wx.OK | wx.ICON_INFORMATION)
+            return True
+
+        def start_job(self, name, button, stages, on_finished):
+            """Run stages as a background job, the button, if any, cancels it until on_finished(job) is called"""
+            job = jobs.Job(name, stages,
+                           on_progress=lambda stage, stage_name, fraction:
+                               wx.CallAfter(self.on_job_progress, job, stage_name, fraction),
+                           on_done=lambda: wx.CallAfter(self.on_job_done, job, on_finished))
+            self.job = job
+            self.job_button = button
+            if button:
+                self.job_label = button.GetLabel()
+                button.SetLabel("Cancel")
+            self.job_gauge.SetValue(0)
+            job.start()
+
+        def on_job_progress(self, job, stage_name, fraction):
+            if job is not self.job:
+                return
+            if not job.cancelled:
+                self.job_text.SetLabel(f"{job.name}: {stage_name}")
+            self.job_gauge.SetValue(int(fraction * 1000))
+
+        def on_job_done(self, job, on_finished):
+            if job is self.job:
+                self.job = None
+                if self.job_button:
+                    self.job_button.SetLabel(self.job_label)
+                self.job_text.SetLabel("")
+                self.job_gauge.SetValue(0)
+            on_finished(job)
+            if self.reset_pending and not self.job:
+                self.reset_pending = False
+                self.on_reset(None)
 
         def update_colors_after_load(self):
             """Update colors after model is loaded"""
@@ -907,6 +1333,14 @@ class PrintegrateFrame(wx.Frame):
 
         def on_reset(self, event):
             """Handle Reset button click - reload original G-code"""
+            # A running job's result would be for the G-code being replaced, and
+            # it may still be reading the file that reloading closes, so the
+            # reload waits until it has stopped
+            if self.job:
+                self.job.cancel()
+                self.job_text.SetLabel(f"{self.job.name}: Cancelling")
+                self.reset_pending = True
+                return
             if self.gcode_path and os.path.exists(self.gcode_path):
                 self.load_gcode(self.gcode_path)
             else:
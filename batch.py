@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import drill_library
+import injection
+import lazy_gcode
+import objects
+import output_cache
+import panel
+import parallel_parse
+import planner
+import pocket
+import profiles
+import verify
+
+DEFAULT_RETRIES = 1  # Extra attempts for a file that failed
+MEMORY_BUDGET = 4 * 1024 * 1024 * 1024  # Bytes the running workers may use between them
+OUTPUT_DIR = 'printegrated'  # Next to the inputs unless given
+MANIFEST_NAME = 'manifest.json'
+SPEC_SUFFIX = '.json'  # A spec for one file sits next to it, e.g. plate.gcode.json
+
+
+def find_gcode_files(sources):
+    """G-code files in directories or matching glob patterns, in order without repeats"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            matches = sorted(os.path.join(source, name) for name in os.listdir(source)
+                             if name.lower().endswith('.gcode'))
+        else:
+            matches = sorted(glob.glob(source))
+        for path in matches:
+            path = os.path.abspath(path)
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+def load_spec(path):
+    """Read a job spec, making its drill file paths absolute
+
+    A spec is a JSON object:
+        layer: Layer index to inject at, or "auto" for where the pocket
+            under the holes closes (the default)
+        conductive_tool: Tool number to inject with, the last tool in the
+            G-code by default as in the GUI
+        patterns: List of placed drill files, each with its 'drill' file,
+            the drill 'tool' (e.g. "T1", the first by default) and the
+            [x, y] 'position' of the centre of its holes on the print. With
+            an 'object', the M486 id or name of one object on the plate,
+            the position is from the centre of that object instead. A
+            'repeat' places copies of the pattern, given as panel.parse_repeat
+            text or a list of [x, y] offsets from the first copy
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for pattern in spec.get('patterns', []):
+        if 'drill' in pattern:
+            pattern['drill'] = os.path.join(base, pattern['drill'])
+    return spec
+
+def spec_for(path, shared):
+    """The shared spec with the file's own spec, if it has one, on top
+
+    Raises:
+        ValueError: If the file has no spec at all
+    """
+    spec = dict(shared or {})
+    own_path = path + SPEC_SUFFIX
+    if os.path.exists(own_path):
+        spec.update(load_spec(own_path))
+    if not spec.get('patterns'):
+        raise ValueError(f"No drill patterns in the spec for {path}")
+    return spec
+
+def estimate_memory(path):
+    """Rough peak memory of a worker processing a file"""
+    size = os.path.getsize(path)
+    if size >= lazy_gcode.LAZY_MIN_BYTES:
+        loaded = lazy_gcode.LAYER_CACHE_BYTES
+    else:
+        loaded = size * lazy_gcode.PARSED_BYTES_PER_BYTE
+    # The file is also read whole to match its printer profile
+    return size + loaded
+
+def printegrate_file(path, spec, output_path, cache=None):
+    """Inject a file's drill patterns as the GUI would, and write the verified result
+
+    With an OutputCache a stored result for the same file and placement,
+    from a batch run or saved in the GUI, is copied instead, and new
+    results are stored.
+
+    Returns:
+        Dict with the 'layer' and 'conductive_tool' used, the number of
+        'holes' and 'inserted_lines', the 'printer' and whether it was
+        'cached'
+
+    Raises:
+        ValueError: If the file can't be printegrated or fails verification
+    """
+    with open(path, 'r') as f:
+        profile = profiles.match_profile(f.read())
+    if profile is None:
+        raise ValueError("The G-code is not for a supported printer")
+    variables = injection.read_variables(path)
+
+    holes = []
+    boards = []  # Holes of each copy of each pattern, sharing the [x, y] lists in holes
+    anchors = []  # (object, first hole, hole count) of patterns placed on an object
+    for pattern in spec['patterns']:
+        if 'position' not in pattern:
+            raise ValueError(f"No position given for {pattern.get('drill')}")
+        with open(pattern['drill'], 'r') as f:
+            tools = drill_library.parse_drill_text(f.read())
+        placed = injection.pattern_holes(tools, pattern.get('tool'), pattern['position'])
+        copies = 1
+        if 'repeat' in pattern:
+            offsets = panel.repeat_offsets(pattern['repeat'])
+            placed = panel.repeat_points(placed, offsets).tolist()
+            copies = len(offsets)
+        per_copy = len(placed) // copies
+        boards.extend(placed[n * per_copy:(n + 1) * per_copy] for n in range(copies))
+        if 'object' in pattern:
+            anchors.append((pattern['object'], len(holes), len(placed)))
+        holes.extend(placed)
+
+    tmp_path = output_path + '.tmp'
+    if os.path.getsize(path) >= lazy_gcode.LAZY_MIN_BYTES:
+        gcode = lazy_gcode.LazyGCode.open(path)
+    else:
+        # One process per file already, so don't start a pool of our own
+        gcode = parallel_parse.parse_gcode(path, workers=1)
+    try:
+        object_index = None
+        if anchors or objects.uses_labels(variables):
+            object_index = objects.ObjectIndex.from_gcode(gcode)
+        for obj, first, count in anchors:
+            if not object_index:
+                raise ValueError("Patterns are placed on objects but the G-code has no M486 object labels")
+            obj = object_index.find(obj)
+            centre_x, centre_y = object_index.centre(obj)
+            print(f"Placing {count} holes on {object_index.describe(obj)} at {centre_x:.3f}, {centre_y:.3f}")
+            for hole in holes[first:first + count]:
+                hole[0] += centre_x
+                hole[1] += centre_y
+
+        layer_idx = pocket.resolve_layer(gcode, boards, spec.get('layer', 'auto'))
+        conductive_tool = spec.get('conductive_tool')
+        if conductive_tool is None:
+            tools = injection.gcode_tools(gcode)
+            if not tools:
+                raise ValueError("No tools found in the G-code")
+            conductive_tool = tools[-1]
+        conductive_tool = int(conductive_tool)
+        layer_height = injection.layer_z(gcode, layer_idx)
+
+        # Keyed by the placement it resolves to, like the GUI, so either can use the other's results
+        key = None
+        if cache:
+            key = output_cache.placement_key(output_cache.file_digest(path), profile, holes, layer_idx,
+                                             conductive_tool, layer_height)
+            meta = cache.get(key, tmp_path)
+            if meta is not None:
+                print(f"Copied stored result {key}")
+                os.replace(tmp_path, output_path)
+                return {**meta, 'cached': True}
+
+        insertions = injection.plan_injection(gcode, variables, profile, layer_idx, conductive_tool, holes,
+                                              layer_height, object_index=object_index)
+        # Written as it is spliced, the output is never held whole
+        with open(tmp_path, 'w') as f:
+            f.writelines(planner.iter_splice(gcode, insertions))
+    finally:
+        if isinstance(gcode, lazy_gcode.LazyGCode):
+            gcode.close()
+
+    # Same checks as saving in the GUI before the output is put in place
+    report = verify.verify_splice(path, tmp_path)
+    print(verify.format_report(report))
+    if not report['ok']:
+        os.remove(tmp_path)
+        raise ValueError("Output does not match the original outside the injected lines")
+    result = output_cache.result_meta(profile, layer_idx, conductive_tool, holes, report)
+    if cache:
+        cache.put(key, tmp_path, meta=result)
+    os.replace(tmp_path, output_path)
+    return {**result, 'cached': False}
+
+def run_file(path, spec, output_path, log_path, use_cache=True):
+    """Worker entry point, printegrates one file with its output logged to log_path"""
+    start = time.monotonic()
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+        print(f"Printegrating {path}")
+        cache = output_cache.OutputCache() if use_cache else None
+        result = printegrate_file(path, spec, output_path, cache)
+    result['seconds'] = round(time.monotonic() - start, 2)
+    return result
+
+def write_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def run_batch(paths, shared_spec, output_dir, workers=None, retries=DEFAULT_RETRIES,
+              memory_budget=MEMORY_BUDGET, use_cache=True, on_result=None):
+    """Printegrate files in a pool of processes, each file in a fresh process
+
+    Files are started while fewer than `workers` are running and their
+    estimated memory fits the budget, at least one always runs. A file
+    that fails, or whose process dies, is tried again up to `retries`
+    more times. The manifest in output_dir is rewritten as each file
+    finishes.
+
+    Args:
+        use_cache: Reuse and store results in the shared output cache
+        on_result: Called with each file's manifest entry when it is done
+
+    Returns:
+        The manifest dict
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {'started': datetime.datetime.now().isoformat(timespec='seconds'),
+                'finished': None, 'workers': workers, 'files': []}
+
+    def finish(entry):
+        manifest['files'].append(entry)
+        write_manifest(manifest_path, manifest)
+        if on_result:
+            on_result(entry)
+
+    pending = deque()
+    for path in paths:
+        name = os.path.basename(path)
+        entry = {'path': path, 'output': os.path.join(output_dir, name),
+                 'log': os.path.join(output_dir, name + '.log'), 'status': None, 'attempts': 0}
+        if os.path.abspath(entry['output']) == path:
+            entry.update(status='failed', error="Output would replace the input, pick another output folder")
+            finish(entry)
+            continue
+        try:
+            spec = spec_for(path, shared_spec)
+        except (OSError, ValueError) as e:
+            entry.update(status='failed', error=str(e))
+            finish(entry)
+            continue
+        pending.append((entry, spec, estimate_memory(path)))
+
+    pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1)
+    running = {}  # Future of each running file
+    used = 0
+    try:
+        while pending or running:
+            while pending and len(running) < workers and (not running or used + pending[0][2] <= memory_budget):
+                entry, spec, memory = pending.popleft()
+                entry['attempts'] += 1
+                future = pool.submit(run_file, entry['path'], spec, entry['output'], entry['log'], use_cache)
+                running[future] = (entry, spec, memory)
+                used += memory
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                entry, spec, memory = running.pop(future)
+                used -= memory
+                try:
+                    entry.update(future.result(), status='ok')
+                    entry.pop('error', None)
+                    finish(entry)
+                    continue
+                except BrokenProcessPool:
+                    broken = True
+                    entry['error'] = "Worker process died, e.g. out of memory"
+                except Exception as e:
+                    entry['error'] = f"{type(e).__name__}: {str(e)}"
+                if entry['attempts'] <= retries:
+                    pending.append((entry, spec, memory))
+                else:
+                    entry['status'] = 'failed'
+                    finish(entry)
+
+            if broken:
+                # Every file still in the pool went down with it
+                for entry, spec, memory in running.values():
+                    entry['attempts'] -= 1  # Not this file's fault as far as we know
+                    pending.append((entry, spec, memory))
+                running.clear()
+                used = 0
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    manifest['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+    write_manifest(manifest_path, manifest)
+    return manifest
+
+def print_entry(entry):
+    name = os.path.basename(entry['path'])
+    if entry['status'] != 'ok':
+        print(f"failed  {name}  {entry.get('error')}")
+        return
+    cached = ", stored result" if entry['cached'] else ""
+    print(f"    ok  {name}  layer {entry['layer']}, {entry['holes']} holes, {entry['seconds']} s{cached}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Printegrate many G-code files with the same drill patterns")
+    parser.add_argument('sources', nargs='+', help="G-code files, folders or glob patterns")
+    parser.add_argument('--spec', help="Job spec shared by all files, a file's own <name>.gcode.json overrides it")
+    parser.add_argument('--output', help=f"Folder for the results and manifest, default {OUTPUT_DIR} next to the first file")
+    parser.add_argument('--workers', type=int, help="Files processed at once, default one per CPU")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help="Extra attempts for a failed file")
+    parser.add_argument('--memory', type=float, default=MEMORY_BUDGET / 2**30,
+                        help="GiB the workers may use between them")
+    parser.add_argument('--no-cache', action='store_true', help="Don't reuse or store results in the output cache")
+    args = parser.parse_args()
+
+    paths = find_gcode_files(args.sources)
+    if not paths:
+        print("No G-code files found")
+        sys.exit(1)
+    shared_spec = load_spec(args.spec) if args.spec else None
+    output_dir = args.output or os.path.join(os.path.dirname(paths[0]), OUTPUT_DIR)
+
+    print(f"Printegrating {len(paths)} files into {output_dir}")
+    manifest = run_batch(paths, shared_spec, output_dir, workers=args.workers, retries=args.retries,
+                         memory_budget=int(args.memory * 2**30), use_cache=not args.no_cache,
+                         on_result=print_entry)
+    failed = sum(entry['status'] != 'ok' for entry in manifest['files'])
+    print(f"{len(paths) - failed} of {len(paths)} files printegrated, manifest in "
+          f"{os.path.join(output_dir, MANIFEST_NAME)}")
+    sys.exit(1 if failed else 0)
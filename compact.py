@@ -0,0 +1,261 @@
+import argparse
+import os
+import re
+import sys
+
+COORD_DIGITS = 3  # Decimals kept for X, Y, Z, I, J and R, 1 um is well under a motor step
+EXTRUDE_DIGITS = 5  # Decimals kept for E, as PrusaSlicer writes it
+FEED_DIGITS = 0  # Decimals kept for F in mm/min
+
+MOVE_COMMANDS = ('G0', 'G1', 'G2', 'G3')
+AXES = ('X', 'Y', 'Z')
+# Commands after which the nozzle position and feedrate are no longer known,
+# e.g. homing, probing, parking and pauses where the printer moves on its own
+UNTRACKED_COMMANDS = {'G27', 'G28', 'G29', 'G30', 'G60', 'G61', 'G75', 'G80',
+                      'M0', 'M1', 'M125', 'M600', 'M601'}
+
+WORD_RE = re.compile(r'([A-Za-z])\s*([-+]?[0-9]*\.?[0-9]+)?\s*')
+
+
+def format_number(value, digits):
+    """Shortest text of a value rounded to digits decimals, e.g. 190.49699 -> "190.497" """
+    text = f"{value:.{digits}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text in ('-0', '') else text
+
+def split_line(raw):
+    """Split a raw line into its code and comment, the comment keeping its ';'"""
+    code, sep, comment = raw.partition(';')
+    return code.strip(), sep + comment.rstrip('\r\n')
+
+def parse_code(code):
+    """Command and ordered (letter, value text) words of a line's code
+
+    Returns:
+        (command, words) with None for words without a value, e.g. M220 B,
+        or (None, None) if the code has anything else, e.g. M117 text,
+        which is then left as it is
+    """
+    words = []
+    pos = 0
+    while pos < len(code):
+        match = WORD_RE.match(code, pos)
+        if not match:
+            return None, None
+        words.append((match.group(1).upper(), match.group(2)))
+        pos = match.end()
+    if not words:
+        return None, None
+    letter, number = words[0]
+    if number is None:
+        return None, None
+    return letter + str(int(float(number))), words[1:]
+
+
+class ModalState:
+    """What the printer is known to be doing between lines, None where unknown
+
+    Compaction starts with everything unknown, so it is correct wherever a
+    block is inserted, and only drops words once a line has set them. The
+    positioning modes can be given for blocks that are always inserted
+    into files using them.
+    """
+
+    def __init__(self, absolute=None, relative_e=None):
+        self.position = dict.fromkeys(AXES)  # As last written in absolute mode
+        self.feedrate = None
+        self.absolute = absolute  # G90 or G91
+        self.relative_e = relative_e  # M83 or M82
+        self.speed_factor = None  # M220 S
+        self.speed_backup = None  # M220 B
+        self.acceleration = {}  # M204 words
+        self.synced = False  # No moves since the last G4 or M400
+
+    def forget_motion(self):
+        self.position = dict.fromkeys(AXES)
+        self.feedrate = None
+        self.synced = False
+
+
+def compact_move(command, words, state, coord_digits, extrude_digits):
+    """Rewrite a move's words, dropping those that don't change anything
+
+    Returns:
+        The compacted code, or None if the move does nothing
+    """
+    arc = command in ('G2', 'G3')
+    kept = []
+    moved = False
+    for letter, number in words:
+        if number is None:
+            kept.append(letter)
+            continue
+        value = float(number)
+        if letter == 'F':
+            text = format_number(value, FEED_DIGITS)
+            if state.feedrate == text:
+                continue
+            state.feedrate = text
+        elif letter in AXES:
+            text = format_number(value, coord_digits)
+            if not arc:
+                if state.absolute and state.position[letter] == text:
+                    continue
+                if state.absolute is False and float(text) == 0:
+                    continue
+            state.position[letter] = text if state.absolute else None
+            moved = True
+        elif letter == 'E':
+            text = format_number(value, extrude_digits)
+            if state.relative_e and float(text) == 0 and not arc:
+                continue
+            moved = True
+        elif letter in ('I', 'J', 'R'):
+            text = format_number(value, coord_digits)
+        else:
+            text = number
+        kept.append(letter + text)
+    if arc:
+        moved = True
+    if not kept:
+        return None
+    if moved:
+        state.synced = False
+    return ' '.join([command] + kept)
+
+def compact_command(command, words, state):
+    """Track a non-move command, returning False if it changes nothing"""
+    params = {letter: float(number) if number is not None else None for letter, number in words}
+    if command == 'G4':
+        # A zero dwell only waits for the moves before it to finish
+        noop = state.synced and not any(params.values())
+        state.synced = True
+        return not noop
+    if command == 'M400':
+        noop = state.synced
+        state.synced = True
+        return not noop
+    if command in ('G90', 'G91'):
+        absolute = command == 'G90'
+        if state.absolute == absolute:
+            return False
+        state.absolute = absolute
+        state.position = dict.fromkeys(AXES)
+        # G91 makes E relative too, G90 leaves it to M82/M83 in some firmware
+        state.relative_e = True if not absolute else None
+        return True
+    if command in ('M82', 'M83'):
+        relative_e = command == 'M83'
+        if state.relative_e == relative_e:
+            return False
+        state.relative_e = relative_e
+        return True
+    if command == 'G92':
+        for axis in AXES:
+            if axis in params or not params:
+                state.position[axis] = None
+        return True
+    if command == 'M220':
+        if 'B' in params:
+            state.speed_backup = state.speed_factor
+        if 'R' in params:
+            state.speed_factor = state.speed_backup
+        if 'S' in params:
+            if state.speed_factor == params['S'] and len(params) == 1:
+                return False
+            state.speed_factor = params['S']
+        return True
+    if command == 'M204':
+        if 'S' in params:
+            # S sets the printing and travel accelerations at once
+            params.update(P=params['S'], T=params['S'])
+        if params and all(state.acceleration.get(letter) == value for letter, value in params.items()):
+            return False
+        state.acceleration.update(params)
+        return True
+    if command in UNTRACKED_COMMANDS or command[0] in 'TP' or (command[0] == 'G' and command not in ('G21',)):
+        state.forget_motion()
+    return True
+
+def compact_lines(lines, state=None, coord_digits=COORD_DIGITS, extrude_digits=EXTRUDE_DIGITS):
+    """Drop redundant words and no-op commands from raw G-code lines
+
+    Moves have their numbers rounded to the given decimals, with feedrates
+    and absolute axes that are already in effect left out. Repeated zero
+    dwells, M400s, mode switches and M204/M220 settings are dropped.
+    Comments and lines that aren't understood are kept as they are, and
+    anything that may move the printer on its own, like homing, tool
+    changes and pauses, forgets the known position and feedrate.
+
+    Args:
+        lines: Raw lines, with or without newlines
+        state: ModalState to start from and update, to compact a file in
+            several pieces
+
+    Yields:
+        Compacted lines, ending in a newline if the line they came from did
+    """
+    if state is None:
+        state = ModalState()
+    for raw in lines:
+        newline = "\n" if raw.endswith("\n") else ""
+        code, comment = split_line(raw)
+        command, words = parse_code(code) if code else (None, None)
+        if command is None:
+            if code:
+                state.forget_motion()  # Unknown command, e.g. M117 text
+            yield raw
+            continue
+
+        if command in MOVE_COMMANDS:
+            compacted = compact_move(command, words, state, coord_digits, extrude_digits)
+        else:
+            compacted = code if compact_command(command, words, state) else None
+        if compacted is None:
+            # Nothing left but the comment, if there was one
+            if comment:
+                yield comment + newline
+            continue
+        if compacted == code:
+            yield raw
+        else:
+            yield (f"{compacted} {comment}" if comment else compacted) + newline
+
+def compact_file(source_path, output_path, coord_digits=COORD_DIGITS, extrude_digits=EXTRUDE_DIGITS):
+    """Compact a whole G-code file a line at a time
+
+    Returns:
+        Dict of the 'lines' and 'bytes' before and after
+    """
+    stats = {'lines': [0, 0], 'bytes': [0, 0]}
+    tmp_path = output_path + '.tmp'
+    with open(source_path, 'r') as source, open(tmp_path, 'w') as output:
+        def counted(lines):
+            for raw in lines:
+                stats['lines'][0] += 1
+                stats['bytes'][0] += len(raw)
+                yield raw
+        for raw in compact_lines(counted(source), coord_digits=coord_digits, extrude_digits=extrude_digits):
+            stats['lines'][1] += 1
+            stats['bytes'][1] += len(raw)
+            output.write(raw)
+    os.replace(tmp_path, output_path)
+    return {'lines': tuple(stats['lines']), 'bytes': tuple(stats['bytes'])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop redundant words and commands from a G-code file")
+    parser.add_argument('source', help="G-code file to compact")
+    parser.add_argument('output', help="Where to write the compacted G-code")
+    parser.add_argument('--digits', type=int, default=COORD_DIGITS, help="Decimals kept for coordinates")
+    parser.add_argument('--e-digits', type=int, default=EXTRUDE_DIGITS, help="Decimals kept for extrusion")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.source) == os.path.abspath(args.output):
+        print("The output would replace the input, pick another output file")
+        sys.exit(2)
+    stats = compact_file(args.source, args.output, args.digits, args.e_digits)
+    (lines_in, lines_out), (bytes_in, bytes_out) = stats['lines'], stats['bytes']
+    print(f"{lines_in} -> {lines_out} lines, {bytes_in} -> {bytes_out} bytes "
+          f"({100 * (1 - bytes_out / max(bytes_in, 1)):.1f}% smaller)")
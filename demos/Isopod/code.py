@@ -15,6 +15,7 @@ from adafruit_hid.keyboard import Keyboard, find_device
 from adafruit_hid.keycode import Keycode
 from adafruit_hid.keyboard import Keyboard
 from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+from touch import TouchChannel, TOUCH
 
 ## We need to set this manually because the PIO state machine setup in Circuit Python doesn't
 ## want users to set the pins as outputs as well as setting a pullup... but we need to do this
@@ -73,7 +74,8 @@ def read_cap_val(pin_val, pin):
     sm.write(bytes((1,)))
     sm.readinto(buffer, end=4)
     sm.deinit()
-    return(buffer[0])
+    # X counts down while the pin charges, so more capacitance gives a lower value
+    return 0xFFFFFFFF - buffer[0]
 
 pin_vals = [6, 9, 10, 19]
 pins = [board.GP6, board.GP9, board.GP10, board.GP19]
@@ -87,18 +89,14 @@ drv.use_LRM()
 keyboard = Keyboard(usb_hid.devices)
 keyboard_layout = KeyboardLayoutUS(keyboard)
 
-initial_vals = [0] * len(pins)
+# Touch state of each pin, calibrated from its first readings
+channels = [TouchChannel(10) for _ in pins]
 # Track the sequence of touches
 touch_sequence = []
 
 
-
-for i, pin in enumerate(pins):
-    initial_vals[i] = read_cap_val(pin_vals[i], pin)
-
 while True:
     current_time = time.monotonic()
     for i, pin in enumerate(pins):
-        val = read_cap_val(pin_vals[i], pin)
-        if initial_vals[i] - val > 10:  # Touch detected
+        if channels[i].update(read_cap_val(pin_vals[i], pin)) == TOUCH:
             print("Touch")
\ No newline at end of file
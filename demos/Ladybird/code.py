@@ -12,6 +12,7 @@ from adafruit_hid.keycode import Keycode
 from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
 from adafruit_hid.consumer_control import ConsumerControl
 from adafruit_hid.consumer_control_code import ConsumerControlCode
+from touch import TouchChannel
 
 # Enable pull-up resistor manually
 def enable_pullup_gpio(pin_number):
@@ -57,7 +58,8 @@ def read_cap_val(pin_val, pin):
     sm.write(bytes((1,)))
     sm.readinto(buffer, end=4)
     sm.deinit()
-    return buffer[0]
+    # X counts down while the pin charges, so more capacitance gives a lower value
+    return 0xFFFFFFFF - buffer[0]
 
 # Pin configuration: (GPIO Number, board Pin, Label, Action Type, Action Code(s))
 # 'type': either "keyboard" or "consumer"
@@ -81,14 +83,14 @@ keyboard = Keyboard(usb_hid.devices)
 keyboard_layout = KeyboardLayoutUS(keyboard)
 consumer_control = ConsumerControl(usb_hid.devices)
 
-# Get baseline values
-initial_vals = [read_cap_val(pin_val, pin) for pin_val, pin, _, _, _ in pin_info]
+# Touch state of each pin, calibrated from its first readings
+channels = [TouchChannel(10) for _ in pin_info]
 
 # Touch detection loop
 while True:
     for i, (pin_val, pin, name, action_type, action_data) in enumerate(pin_info):
-        val = read_cap_val(pin_val, pin)
-        if initial_vals[i] - val > 10:
+        channels[i].update(read_cap_val(pin_val, pin))
+        if channels[i].touched:
             print(f"Touched: {name}")
             if action_type == "keyboard":
                 keyboard.send(*action_data)
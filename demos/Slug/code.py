@@ -4,12 +4,9 @@ import touchio
 
 touch_pins = [touchio.TouchIn(getattr(board, f"IO{i}")) for i in [10,9]]
 
-for pin in touch_pins:
-    pin.threshold = 30000
-
-    
+# Print a trace of the raw readings, one comma separated line per sample,
+# to replay on a computer with touch_replay.py
 while True:
-    for pin in touch_pins:
-        print(pin.raw_value)
-    time.sleep(0.1)
+    print(",".join(str(pin.raw_value) for pin in touch_pins))
+    time.sleep(0.01)
         
\ No newline at end of file
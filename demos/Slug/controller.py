@@ -2,6 +2,9 @@
 import time
 import board
 import touchio
+import supervisor
+from touch import TouchChannel, TOUCH
+from events import Encoder
 from adafruit_ble import BLERadio
 from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
 from adafruit_ble.services.nordic import UARTService
@@ -12,12 +15,14 @@ ble = BLERadio()
 # Touch sensors
 touch_up = touchio.TouchIn(board.IO7)
 touch_down = touchio.TouchIn(board.IO6)
-touch_up.threshold = 40000
-touch_down.threshold = 40000
+# Touched above an absolute reading of 40000, released below 39000
+channel_up = TouchChannel(40000, release=39000, baseline=0)
+channel_down = TouchChannel(40000, release=39000, baseline=0)
 
-# Track previous touch state
-was_touched_up = False
-was_touched_down = False
+# Channel ids in the event packets, the dongle maps them to keys
+UP = 0
+DOWN = 1
+encoder = Encoder()
 
 def connect_to_dongle():
     print("Scanning for dongle...")
@@ -46,23 +51,16 @@ while True:
             time.sleep(1)
             continue
 
-    # If we get here, we're connected and ready to send
-    now_up = touch_up.value
-    if now_up and not was_touched_up:
-        uart.write("UP\n")
-        print("Sent: UP")
-    elif not now_up and was_touched_up:
-        uart.write("RELEASE_UP\n")
-        print("Sent: RELEASE_UP")
-    was_touched_up = now_up
-
-    now_down = touch_down.value
-    if now_down and not was_touched_down:
-        uart.write("DOWN\n")
-        print("Sent: DOWN")
-    elif not now_down and was_touched_down:
-        uart.write("RELEASE_DOWN\n")
-        print("Sent: RELEASE_DOWN")
-    was_touched_down = now_down
+    # If we get here, we're connected and ready to send. Changes of both pads
+    # go out together in one packet
+    now = supervisor.ticks_ms()
+    event = channel_up.update(touch_up.raw_value)
+    if event:
+        encoder.add(UP, event == TOUCH, now)
+    event = channel_down.update(touch_down.raw_value)
+    if event:
+        encoder.add(DOWN, event == TOUCH, now)
+    if encoder.due(now):
+        encoder.send(uart, now)
 
     time.sleep(0.01)
\ No newline at end of file
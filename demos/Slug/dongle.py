@@ -7,30 +7,52 @@ from adafruit_ble.services.nordic import UARTService
 from adafruit_hid.keyboard import Keyboard
 from adafruit_hid.keycode import Keycode
 
+from events import Decoder
+
 ble = BLERadio()
 uart = UARTService()
 advertisement = ProvideServicesAdvertisement(uart)
 
 kbd = Keyboard(usb_hid.devices)
 
+# Keys of the controller's channel ids
+KEYS = (Keycode.UP_ARROW, Keycode.DOWN_ARROW)
+held = [False] * len(KEYS)
+
+def set_key(channel, pressed):
+    if channel >= len(KEYS) or held[channel] == pressed:
+        return
+    held[channel] = pressed
+    if pressed:
+        kbd.press(KEYS[channel])
+    else:
+        kbd.release(KEYS[channel])
+
+def on_event(channel, pressed, age_ms):
+    set_key(channel, pressed)
+
+def on_sync(pressed_bits):
+    # Every packet carries the pressed channels, so a lost packet can't leave a key stuck
+    for channel in range(len(KEYS)):
+        set_key(channel, pressed_bits & (1 << channel) != 0)
+
+decoder = Decoder(on_event, on_sync)
+buffer = bytearray(64)
+
 ble.start_advertising(advertisement)
 print("Advertising as BLE dongle...")
 
 while True:
     if not ble.connected:
+        for channel in range(len(KEYS)):
+            set_key(channel, False)
+        if not ble.advertising:
+            ble.start_advertising(advertisement)
+        time.sleep(0.1)
         continue
 
-    while ble.connected:
-        if uart.in_waiting:
-            command = uart.readline().decode("utf-8").strip()
-            print(f"Received: {command}")
-
-            if command == "UP":
-                kbd.press(Keycode.UP_ARROW)
-            elif command == "RELEASE_UP":
-                kbd.release(Keycode.UP_ARROW)
-            elif command == "DOWN":
-                kbd.press(Keycode.DOWN_ARROW)
-            elif command == "RELEASE_DOWN":
-                kbd.release(Keycode.DOWN_ARROW)
-        time.sleep(0.01)
+    count = uart.in_waiting
+    if count:
+        decoder.feed(buffer, uart.readinto(buffer, min(count, len(buffer))))
+    else:
+        time.sleep(0.001)
@@ -0,0 +1,146 @@
+# Binary touch event packets between the Slug controller and dongle. Copy this
+# file to the lib folder of both boards. It also runs on CPython, see loopback.py.
+#
+# Packet layout, all single bytes unless noted:
+#   0      SYNC
+#   1      Sequence number, wraps at 256
+#   2      Number of events N, at most MAX_EVENTS
+#   3-4    Sender's clock in ms when sent, little endian, wraps at 65536
+#   5      Channels currently pressed, one bit per channel
+#   6..    N events of two bytes: channel id with PRESSED_BIT set for a press,
+#          then how many ms before the packet was sent it happened
+#   last   Sum of all bytes after SYNC, modulo 256
+#
+# The pressed bits let the dongle put its keys right even if packets were lost.
+SYNC = 0xA5
+HEADER_SIZE = 6
+MAX_EVENTS = 6  # So a packet fits the 20 bytes of a default BLE notification
+MAX_PACKET = HEADER_SIZE + 2 * MAX_EVENTS + 1
+PRESSED_BIT = 0x80
+CHANNEL_MASK = 0x7F
+KEEPALIVE_MS = 1000  # Resend the pressed channels this often when nothing changes
+
+
+class Encoder:
+    """Batches state changes of up to 8 channels into packets"""
+
+    def __init__(self):
+        self.packet = bytearray(MAX_PACKET)
+        self.times = [0] * MAX_EVENTS
+        self.count = 0
+        self.sequence = 0
+        self.pressed = 0
+        self.last_sent = None
+
+    def add(self, channel, pressed, now_ms):
+        """Queue a state change, returning False if the packet is full"""
+        if self.count == MAX_EVENTS:
+            return False
+        offset = HEADER_SIZE + 2 * self.count
+        self.packet[offset] = channel | PRESSED_BIT if pressed else channel
+        self.times[self.count] = now_ms
+        self.count += 1
+        if pressed:
+            self.pressed |= 1 << channel
+        else:
+            self.pressed &= ~(1 << channel)
+        return True
+
+    def due(self, now_ms):
+        """Whether there are events to send or a keepalive is due"""
+        return (self.count > 0 or self.last_sent is None
+                or (now_ms - self.last_sent) & 0xFFFF >= KEEPALIVE_MS)
+
+    def send(self, uart, now_ms):
+        """Write a packet of the queued events, which may be none
+
+        Clocks only need to count ms, e.g. supervisor.ticks_ms(), wrapping
+        is fine.
+        """
+        packet = self.packet
+        count = self.count
+        packet[0] = SYNC
+        packet[1] = self.sequence
+        packet[2] = count
+        packet[3] = now_ms & 0xFF
+        packet[4] = (now_ms >> 8) & 0xFF
+        packet[5] = self.pressed
+        for i in range(count):
+            packet[HEADER_SIZE + 2 * i + 1] = min(255, (now_ms - self.times[i]) & 0xFFFF)
+        end = HEADER_SIZE + 2 * count
+        total = 0
+        for i in range(1, end):
+            total += packet[i]
+        packet[end] = total & 0xFF
+        uart.write(packet[:end + 1])
+        self.sequence = (self.sequence + 1) & 0xFF
+        self.count = 0
+        self.last_sent = now_ms
+
+
+class Decoder:
+    """Parses packets a byte at a time without allocating
+
+    Bytes may arrive split across reads in any way. Complete packets with a
+    good checksum call handler(channel, pressed, age_ms) for each event, and
+    then sync(pressed) with the pressed bits of all channels if given.
+    """
+
+    def __init__(self, handler, sync=None):
+        self.handler = handler
+        self.sync = sync
+        self.packet = bytearray(MAX_PACKET)
+        self.length = 0
+        self.expected = HEADER_SIZE + 1
+        self.total = 0  # Running checksum of the packet so far
+        self.sequence = -1
+        self.packets = 0
+        self.lost = 0  # Packets missing from the sequence
+        self.errors = 0  # Packets dropped for bad checksums or lengths
+        self.sent_ms = 0  # Sender's clock of the last packet
+
+    def feed(self, data, count):
+        """Parse the first count bytes of data"""
+        packet = self.packet
+        length = self.length
+        expected = self.expected
+        total = self.total
+        for i in range(count):
+            byte = data[i]
+            if length == 0:
+                if byte != SYNC:
+                    continue
+                total = 0
+            elif length == 2:
+                if byte > MAX_EVENTS:
+                    self.errors += 1
+                    length = 0
+                    continue
+                expected = HEADER_SIZE + 2 * byte + 1
+            packet[length] = byte
+            length += 1
+            if length == expected:
+                length = 0
+                if total & 0xFF == byte:
+                    self.dispatch(expected - 1)
+                else:
+                    self.errors += 1
+            elif length > 1:
+                total += byte
+        self.length = length
+        self.expected = expected
+        self.total = total
+
+    def dispatch(self, end):
+        packet = self.packet
+        sequence = packet[1]
+        if self.sequence >= 0:
+            self.lost += (sequence - self.sequence - 1) & 0xFF
+        self.sequence = sequence
+        self.packets += 1
+        self.sent_ms = packet[3] | (packet[4] << 8)
+        for i in range(HEADER_SIZE, end, 2):
+            event = packet[i]
+            self.handler(event & CHANNEL_MASK, event & PRESSED_BIT != 0, packet[i + 1])
+        if self.sync:
+            self.sync(packet[5])
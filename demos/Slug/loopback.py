@@ -0,0 +1,204 @@
+# Host stand-in for the BLE UART between the Slug controller and dongle, to
+# compare the old text lines with the event packets of events.py without radios.
+#
+#   python loopback.py
+#
+# Time is simulated in 1 ms steps, so results are repeatable and only depend on
+# the BLE connection settings below and how often each side polls.
+import random
+import time
+from collections import deque
+
+import events
+
+CONNECTION_INTERVAL = 15  # ms between BLE connection events
+NOTIFICATIONS_PER_INTERVAL = 4  # Notifications delivered at each connection event
+NOTIFICATION_SIZE = 20  # Bytes per notification
+CONTROLLER_POLL = 10  # ms between touch readings on the controller
+TEXT_POLL = 10  # ms the old dongle slept between lines
+PACKET_POLL = 1  # ms the dongle sleeps when nothing has arrived
+
+
+class LoopbackUART:
+    """In-memory stand-in for adafruit_ble's UARTService on a simulated clock
+
+    Each write is sent as notifications of up to NOTIFICATION_SIZE bytes,
+    and each notification arrives at the first connection event after it
+    was written that has room for it.
+    """
+
+    def __init__(self, interval=CONNECTION_INTERVAL, per_interval=NOTIFICATIONS_PER_INTERVAL):
+        self.interval = interval
+        self.per_interval = per_interval
+        self.now = 0
+        self.in_flight = deque()  # (arrival ms, bytes)
+        self.booked = {}  # Notifications booked for each connection event
+        self.received = bytearray()
+        self.notifications = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")  # CircuitPython writes str as its bytes
+        for start in range(0, len(data), NOTIFICATION_SIZE):
+            event = self.now // self.interval + 1
+            if self.in_flight:
+                event = max(event, self.in_flight[-1][0] // self.interval)
+            while self.booked.get(event, 0) >= self.per_interval:
+                event += 1
+            self.booked[event] = self.booked.get(event, 0) + 1
+            self.in_flight.append((event * self.interval, bytes(data[start:start + NOTIFICATION_SIZE])))
+            self.notifications += 1
+
+    def advance(self, ms):
+        self.now += ms
+        while self.in_flight and self.in_flight[0][0] <= self.now:
+            self.received += self.in_flight.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        return len(self.received)
+
+    def readinto(self, buf, nbytes=None):
+        count = min(len(buf), len(self.received), nbytes or len(buf))
+        buf[:count] = self.received[:count]
+        del self.received[:count]
+        return count
+
+    def readline(self):
+        end = self.received.find(b"\n") + 1 or len(self.received)
+        line = bytes(self.received[:end])
+        del self.received[:end]
+        return line
+
+
+def touch_changes(seconds=60, channels=2, rate=2.0, seed=0):
+    """Random presses and releases, sometimes on several channels at once
+
+    Returns:
+        Sorted list of (ms, channel, pressed)
+    """
+    rng = random.Random(seed)
+    changes = []
+    for channel in range(channels):
+        t = 0
+        pressed = False
+        while True:
+            t += int(rng.expovariate(rate) * 1000) + 20
+            if t >= seconds * 1000:
+                break
+            pressed = not pressed
+            changes.append((t, channel, pressed))
+        if pressed:
+            changes.append((seconds * 1000, channel, False))
+    # Chords: copy some changes onto the other channels
+    for t, channel, pressed in list(changes):
+        if rng.random() < 0.2:
+            changes.append((t, (channel + 1) % channels, pressed))
+    return sorted(changes)
+
+def run_text(changes, uart):
+    """The old protocol: a line per change, one line read per poll
+
+    Returns:
+        List of latencies in ms from each change to the dongle acting on it
+    """
+    names = ["UP", "DOWN"]
+    latencies = []
+    pending = deque()  # Changes sent but not handled yet, in order
+    idx = 0
+    next_read = next_poll = 0
+    end = changes[-1][0] + 5000
+    while uart.now < end and (idx < len(changes) or pending):
+        if uart.now >= next_poll:
+            next_poll += CONTROLLER_POLL
+            while idx < len(changes) and changes[idx][0] <= uart.now:
+                t, channel, pressed = changes[idx]
+                uart.write((names[channel] if pressed else "RELEASE_" + names[channel]) + "\n")
+                pending.append(t)
+                idx += 1
+        if uart.now >= next_read:
+            next_read = uart.now + 1
+            if uart.in_waiting:
+                line = uart.readline()
+                if line.endswith(b"\n"):
+                    line.decode("utf-8").strip()
+                    latencies.append(uart.now - pending.popleft())
+                    next_read = uart.now + TEXT_POLL
+        uart.advance(1)
+    return latencies
+
+def run_packets(changes, uart):
+    """Event packets, batched per controller poll and decoded as they arrive"""
+    latencies = []
+    sent_at = deque()
+    decoder = events.Decoder(lambda channel, pressed, age: latencies.append(uart.now - sent_at.popleft()))
+    encoder = events.Encoder()
+    buffer = bytearray(64)
+    idx = 0
+    next_poll = next_read = 0
+    end = changes[-1][0] + 5000
+    while uart.now < end and (idx < len(changes) or sent_at):
+        if uart.now >= next_poll:
+            next_poll += CONTROLLER_POLL
+            while idx < len(changes) and changes[idx][0] <= uart.now:
+                t, channel, pressed = changes[idx]
+                if not encoder.add(channel, pressed, t):
+                    break  # Full, the rest go in the next packet
+                sent_at.append(t)
+                idx += 1
+            if encoder.count:
+                encoder.send(uart, uart.now)
+        if uart.now >= next_read:
+            next_read = uart.now + PACKET_POLL
+            if uart.in_waiting:
+                decoder.feed(buffer, uart.readinto(buffer))
+                next_read = uart.now
+        uart.advance(1)
+    return latencies
+
+def decode_cost(count=20000):
+    """Host CPU time per event to decode packets, one event per packet"""
+
+    class Sink:
+        def __init__(self):
+            self.data = bytearray()
+
+        def write(self, data):
+            self.data += data
+
+    sink = Sink()
+    encoder = events.Encoder()
+    for i in range(count):
+        encoder.add(i % 2, i % 4 < 2, i)
+        encoder.send(sink, i)
+    decoder = events.Decoder(lambda channel, pressed, age: None)
+    start = time.perf_counter()
+    decoder.feed(sink.data, len(sink.data))
+    return (time.perf_counter() - start) / count
+
+def summarise(name, latencies, uart):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(f"{name:>8}: mean {mean:5.1f} ms, 95th percentile {p95:4d} ms, worst {latencies[-1]:4d} ms, "
+          f"{uart.notifications} notifications for {len(latencies)} events")
+
+
+if __name__ == "__main__":
+    changes = touch_changes()
+    print(f"{len(changes)} touch changes over 60 s, {CONNECTION_INTERVAL} ms connection interval")
+    uart = LoopbackUART()
+    summarise("text", run_text(changes, uart), uart)
+    uart = LoopbackUART()
+    summarise("packets", run_packets(changes, uart), uart)
+
+    # Throughput: a change on every channel at every controller poll
+    burst = [(t, channel, (t // CONTROLLER_POLL) % 2 == 0)
+             for t in range(0, 2000, CONTROLLER_POLL) for channel in range(2)]
+    print(f"\nBurst of {len(burst)} changes in 2 s")
+    for name, run in (("text", run_text), ("packets", run_packets)):
+        uart = LoopbackUART()
+        latencies = run(burst, uart)
+        print(f"{name:>8}: {len(latencies) * 1000 / uart.now:6.0f} events/s, worst latency {max(latencies)} ms")
+
+    print(f"\nDecoding a packet: {decode_cost() * 1e6:.2f} us of host CPU, nothing allocated")
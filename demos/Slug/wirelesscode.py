@@ -1,6 +1,7 @@
 import time
 import board
 import touchio
+from touch import TouchChannel
 
 from adafruit_ble import BLERadio
 from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
@@ -17,8 +18,9 @@ keyboard = Keyboard(hid.devices)
 # Touch pins setup
 touch_up = touchio.TouchIn(board.IO7)
 touch_down = touchio.TouchIn(board.IO6)
-touch_up.threshold = 40000
-touch_down.threshold = 40000
+# Touched above an absolute reading of 40000, released below 39000
+channel_up = TouchChannel(40000, release=39000, baseline=0)
+channel_down = TouchChannel(40000, release=39000, baseline=0)
 
 # Track previous touch states
 was_touched_up = False
@@ -38,7 +40,8 @@ while True:
     # Main loop
     while ble.connected:
         # Check UP pin
-        now_up = touch_up.value
+        channel_up.update(touch_up.raw_value)
+        now_up = channel_up.touched
         if now_up and not was_touched_up:
             print("UP touched")
             keyboard.press(Keycode.UP_ARROW)
@@ -48,7 +51,8 @@ while True:
         was_touched_up = now_up
 
         # Check DOWN pin
-        now_down = touch_down.value
+        channel_down.update(touch_down.raw_value)
+        now_down = channel_down.touched
         if now_down and not was_touched_down:
             print("DOWN touched")
             keyboard.press(Keycode.DOWN_ARROW)
@@ -16,6 +16,8 @@ from adafruit_midi.note_off import NoteOff
 from adafruit_midi.note_on import NoteOn
 from adafruit_midi.pitch_bend import PitchBend
 
+from touch import TouchChannel
+
 print(usb_midi.ports)
 midi = adafruit_midi.MIDI(
     midi_in=usb_midi.ports[0], in_channel=0, midi_out=usb_midi.ports[1], out_channel=0
@@ -28,9 +30,9 @@ print("Listening on input channel:", midi.in_channel + 1)
 
 touch_pins = [touchio.TouchIn(getattr(board, f"IO{i}")) for i in range(1, 10)]
 
-for pin in touch_pins:
-    pin.threshold = 40000
-    
+# Touched above an absolute reading of 40000, released below 39000
+channels = [TouchChannel(40000, release=39000, baseline=0) for pin in touch_pins]
+
 touch_states = [False for pin in touch_pins]
 note_states = [False for pin in touch_pins]
 note_last_registered = [0 for pin in touch_pins]
@@ -46,7 +48,8 @@ while True:
                 midi.send(NoteOff(midi_map[i-1], 120))
                 note_states[i] = False
     for i, touch in enumerate(touch_pins):
-        if touch.value:
+        channels[i].update(touch.raw_value)
+        if channels[i].touched:
             if not touch_states[i]:
                 print(f"Pin {i+1} touched!")
                 touch_states[i] = True
@@ -0,0 +1,158 @@
+# Touch processing shared by the demos. Copy this file to the lib folder on the
+# CIRCUITPY drive next to the demo's code.py. It also runs on CPython so
+# recorded traces can be replayed on a computer with touch_replay.py.
+#
+# Readings are integers that rise when a sensor is touched, e.g. touchio's
+# raw_value. Only integer maths and preallocated arrays are used so nothing is
+# allocated per sample, keep readings below 2**24 so sums stay small ints.
+import array
+
+NO_EVENT = 0
+TOUCH = 1
+RELEASE = 2
+
+FILTER_SHIFT = 1  # Each reading moves the filtered value 1/2**shift of the way towards it
+CALIBRATION_SAMPLES = 8  # Untouched readings averaged into the baseline
+BASELINE_SHIFT = 7  # The baseline follows untouched readings over about 2**shift samples
+DEBOUNCE_SAMPLES = 2  # Readings in a row past a threshold before the state changes
+MAX_TOUCH_SAMPLES = 3000  # A touch this long is taken as drift and becomes the baseline
+
+
+class RingBuffer:
+    """The last `size` readings and their running sum"""
+
+    def __init__(self, size):
+        self.values = array.array('l', [0] * size)
+        self.size = size
+        self.index = 0
+        self.count = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        """The i-th oldest reading"""
+        if not 0 <= i < self.count:
+            raise IndexError("ring buffer index out of range")
+        return self.values[(self.index - self.count + i) % self.size]
+
+    def push(self, value):
+        if self.count == self.size:
+            self.total -= self.values[self.index]
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.index = (self.index + 1) % self.size
+
+    def mean(self):
+        return self.total // self.count if self.count else 0
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+        self.total = 0
+
+
+class TouchChannel:
+    """Touch state of one sensor from its raw readings
+
+    Readings are smoothed with an integer low-pass filter and compared to
+    a baseline. Without a fixed baseline the first CALIBRATION_SAMPLES
+    readings are averaged into one, so the sensor must not be touched
+    while starting up. The baseline then follows slow drift from
+    temperature and humidity with an exponential average of untouched
+    readings, which is frozen while the sensor is touched.
+
+    A touch starts when the reading rises more than `threshold` above the
+    baseline and ends when it falls below `release`, in both cases only
+    after `debounce` readings in a row.
+
+    Args:
+        threshold: How far the filtered reading must rise above the
+            baseline to count as a touch
+        release: How far above the baseline a touch ends, 3/4 of
+            threshold by default
+        baseline: Fixed baseline, e.g. 0 for an absolute threshold, which
+            is not tracked
+        shift: Filter strength, 0 to use readings as they are
+        baseline_shift: How slowly the baseline follows, 0 to keep the
+            calibrated one
+    """
+
+    def __init__(self, threshold, release=None, baseline=None, shift=FILTER_SHIFT,
+                 baseline_shift=BASELINE_SHIFT, debounce=DEBOUNCE_SAMPLES,
+                 max_touch=MAX_TOUCH_SAMPLES, calibration=CALIBRATION_SAMPLES):
+        self.threshold = threshold
+        self.release = threshold * 3 // 4 if release is None else release
+        self.shift = shift
+        self.fixed_baseline = baseline
+        self.baseline_shift = baseline_shift if baseline is None else 0
+        self.debounce = max(1, debounce)
+        self.max_touch = max_touch
+        self.calibration = RingBuffer(calibration)
+        self.reset()
+
+    def reset(self):
+        """Forget the state and calibrate again"""
+        self.baseline = self.fixed_baseline
+        self.baseline_sum = 0  # Baseline scaled by 2**baseline_shift
+        self.filtered = -1  # Scaled by 2**shift, -1 until the first reading
+        self.delta = 0
+        self.touched = False
+        self.pending = 0  # Readings in a row towards the other state
+        self.touch_samples = 0
+        self.calibration.clear()
+
+    def value(self):
+        """Filtered reading"""
+        return self.filtered >> self.shift
+
+    def set_baseline(self, value):
+        self.baseline = value
+        self.baseline_sum = value << self.baseline_shift
+
+    def update(self, raw):
+        """Process a reading
+
+        Returns:
+            TOUCH or RELEASE when the state changes, otherwise NO_EVENT
+        """
+        if self.filtered < 0:
+            self.filtered = raw << self.shift
+        else:
+            self.filtered += raw - (self.filtered >> self.shift)
+        value = self.filtered >> self.shift
+
+        if self.baseline is None:
+            self.calibration.push(raw)
+            if len(self.calibration) < self.calibration.size:
+                return NO_EVENT
+            self.set_baseline(self.calibration.mean())
+
+        self.delta = value - self.baseline
+        if self.touched:
+            crossing = self.delta < self.release
+        else:
+            crossing = self.delta > self.threshold
+        self.pending = self.pending + 1 if crossing else 0
+
+        event = NO_EVENT
+        if self.pending >= self.debounce:
+            self.pending = 0
+            self.touched = not self.touched
+            self.touch_samples = 0
+            event = TOUCH if self.touched else RELEASE
+
+        if self.touched:
+            self.touch_samples += 1
+            if self.baseline_shift and self.max_touch and self.touch_samples > self.max_touch:
+                # Nobody holds a sensor this long, the baseline drifted while frozen
+                self.set_baseline(value)
+                self.touched = False
+                event = RELEASE
+        elif self.baseline_shift and not self.pending:
+            self.baseline_sum += value - (self.baseline_sum >> self.baseline_shift)
+            self.baseline = self.baseline_sum >> self.baseline_shift
+        return event
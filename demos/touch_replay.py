@@ -0,0 +1,146 @@
+# Replay touch sensor traces through touch.py on a computer, to compare
+# detection settings without a board.
+#
+#   python touch_replay.py                      Synthetic drifting trace with known touches
+#   python touch_replay.py trace.csv [threshold] [rate_hz]
+#
+# A trace has one line per sample with a comma separated reading per channel,
+# as printed by Slug/code.py. Other lines, e.g. console messages, are skipped.
+import random
+import sys
+import time
+
+import touch
+
+SAMPLE_RATE = 100  # Hz, samples per second of a trace
+DEFAULT_THRESHOLD = 300  # Counts above the baseline for the synthetic trace
+MATCH_WINDOW = 0.2  # s after a touch ends that a late detection still counts
+SYNTHETIC_DRIFT = 5  # Counts per second the synthetic trace drifts by
+
+# Detection settings compared on synthetic traces
+SETTINGS = {
+    # A baseline taken once at startup and a single threshold, as the demos used to
+    'fixed': lambda threshold: touch.TouchChannel(threshold, release=threshold, shift=2,
+                                                  baseline_shift=0, debounce=1, max_touch=0),
+    'adaptive': lambda threshold: touch.TouchChannel(threshold),
+}
+
+
+def synthetic_trace(channels=2, seconds=60, rate=SAMPLE_RATE, baseline=30000, noise=60,
+                    touch_delta=600, touch_rate=0.5, drift=0, seed=0):
+    """Readings with randomly placed touches
+
+    Args:
+        noise: Standard deviation of the reading noise
+        touch_delta: How much a touch raises the reading
+        touch_rate: Touches per second per channel
+        drift: Change of the untouched reading per second, e.g. from warming up
+
+    Returns:
+        (rows, touches) with a list of readings per sample and a list of
+        (channel, first sample, last sample) of each touch
+    """
+    rng = random.Random(seed)
+    samples = seconds * rate
+    touched = [[False] * samples for _ in range(channels)]
+    touches = []
+    for channel in range(channels):
+        sample = int(rng.expovariate(touch_rate) * rate)
+        while sample < samples:
+            length = int(rng.uniform(0.1, 0.6) * rate)
+            end = min(samples, sample + length)
+            touches.append((channel, sample, end - 1))
+            for i in range(sample, end):
+                touched[channel][i] = True
+            sample = end + int(rng.expovariate(touch_rate) * rate) + rate // 2
+
+    rows = []
+    for i in range(samples):
+        level = baseline + drift * i // rate
+        rows.append([int(level + rng.gauss(0, noise) + (touch_delta if touched[channel][i] else 0))
+                     for channel in range(channels)])
+    return rows, sorted(touches, key=lambda t: t[1])
+
+def load_trace(path):
+    """Rows of integer readings from a trace file"""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            try:
+                row = [int(value) for value in line.replace(' ', '').split(',')]
+            except ValueError:
+                continue
+            if rows and len(row) != len(rows[0]):
+                continue
+            rows.append(row)
+    return rows
+
+def replay(rows, make_channel):
+    """Feed every sample of a trace through a channel per column
+
+    Returns:
+        (events, ns_per_sample) with (sample, channel, event) of every touch
+        and release, and the processing time per reading
+    """
+    channels = [make_channel(i) for i in range(len(rows[0]))]
+    events = []
+    start = time.perf_counter_ns()
+    for i, row in enumerate(rows):
+        for c, channel in enumerate(channels):
+            event = channel.update(row[c])
+            if event:
+                events.append((i, c, event))
+    elapsed = time.perf_counter_ns() - start
+    return events, elapsed / (len(rows) * len(channels))
+
+def score(events, touches, rate=SAMPLE_RATE):
+    """Match detected touches to the known ones
+
+    Returns:
+        Dict of 'latencies' in ms of each detected touch, 'missed' touches
+        and 'false' touch events that match no touch
+    """
+    window = int(MATCH_WINDOW * rate)
+    detections = [(i, c) for i, c, event in events if event == touch.TOUCH]
+    used = set()
+    latencies = []
+    missed = 0
+    for channel, first, last in touches:
+        match = None
+        for n, (i, c) in enumerate(detections):
+            if c == channel and n not in used and first <= i <= last + window:
+                match = n
+                break
+        if match is None:
+            missed += 1
+            continue
+        used.add(match)
+        latencies.append((detections[match][0] - first) * 1000 / rate)
+    return {'latencies': latencies, 'missed': missed, 'false': len(detections) - len(used)}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        rows = load_trace(sys.argv[1])
+        threshold = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD
+        rate = int(sys.argv[3]) if len(sys.argv) > 3 else SAMPLE_RATE
+        if not rows:
+            print(f"No readings in {sys.argv[1]}")
+            sys.exit(1)
+        events, ns_per_sample = replay(rows, lambda i: SETTINGS['adaptive'](threshold))
+        print(f"{len(rows)} samples of {len(rows[0])} channels, {ns_per_sample / 1000:.2f} us per reading")
+        for i, c, event in events:
+            print(f"{i * 1000 / rate:9.0f} ms  channel {c}  {'touch' if event == touch.TOUCH else 'release'}")
+        sys.exit(0)
+
+    rows, touches = synthetic_trace(drift=SYNTHETIC_DRIFT)
+    print(f"{len(rows)} samples of {len(rows[0])} channels with {len(touches)} touches, "
+          f"drifting {SYNTHETIC_DRIFT} per second")
+    for name, make_channel in SETTINGS.items():
+        events, ns_per_sample = replay(rows, lambda i: make_channel(DEFAULT_THRESHOLD))
+        result = score(events, touches)
+        latencies = sorted(result['latencies'])
+        latency = (f"mean {sum(latencies) / len(latencies):.1f} ms, worst {latencies[-1]:.1f} ms"
+                   if latencies else "no touches detected")
+        print(f"{name:>9}: latency {latency}, missed {result['missed']}, "
+              f"false touches {result['false']}, {ns_per_sample / 1000:.2f} us per reading")
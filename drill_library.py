@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import re
+
+from platformdirs import user_cache_dir
+
+CACHE_DIR = os.path.join(user_cache_dir('printegration'), 'drill')
+CACHE_VERSION = 1  # Bump when the parsed format changes so old cache files are ignored
+WATCH_INTERVAL = 1000  # ms between checks of the library folder for changes
+
+TOOL_DEF_RE = re.compile(r'T(\d+)C([\d.]+)')
+COORD_RE = re.compile(r'X([\d.-]+)Y([\d.-]+)')
+
+
+def parse_drill_text(text):
+    """Parse drill file contents into tool definitions and coordinates
+
+    Returns:
+        Dict of tool name (e.g. "T1") to {'size': mm, 'points': [[x, y], ...]}
+        with Y flipped to positive print coordinates
+    """
+    tools = {}
+    current_tool = None
+    for line in text.splitlines():
+        line = line.strip()
+
+        # Tool definitions (e.g., T1C0.300)
+        if line.startswith('T') and 'C' in line:
+            match = TOOL_DEF_RE.match(line)
+            if match:
+                tools[f'T{match.group(1)}'] = {
+                    'size': float(match.group(2)),
+                    'points': []
+                }
+
+        # Coordinates
+        elif line.startswith('X') and 'Y' in line:
+            if current_tool and current_tool in tools:
+                match = COORD_RE.match(line)
+                if match:
+                    tools[current_tool]['points'].append([float(match.group(1)), -float(match.group(2))])
+
+        # Track current tool
+        elif line.startswith('T'):
+            current_tool = f'T{line[1:]}'
+
+    return tools
+
+
+class DrillLibrary:
+    """Folder of drill files with their parsed patterns cached
+
+    Patterns are keyed by a hash of the file contents, so identical boards
+    share one entry and an edited file is parsed again. Parsed patterns are
+    kept in memory for the session and as JSON on disk between sessions.
+    """
+
+    def __init__(self, folder=None, cache_dir=CACHE_DIR):
+        self.folder = None
+        self.cache_dir = cache_dir
+        self.patterns = {}  # Parsed tools by content hash
+        self.files = {}  # (mtime, size) of each indexed file by path
+        if folder:
+            self.set_folder(folder)
+
+    def set_folder(self, folder):
+        """Index a folder of drill files, parsing only ones not seen before"""
+        self.folder = os.path.abspath(folder)
+        self.files = {}
+        self.refresh()
+
+    def paths(self):
+        """Drill files in the library, sorted by name"""
+        return sorted(self.files, key=lambda path: os.path.basename(path).lower())
+
+    def scan(self):
+        if not self.folder or not os.path.isdir(self.folder):
+            return {}
+        found = {}
+        for name in os.listdir(self.folder):
+            if name.lower().endswith('.drl'):
+                path = os.path.join(self.folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Removed while scanning
+                found[path] = (stat.st_mtime, stat.st_size)
+        return found
+
+    def refresh(self):
+        """Pick up added, removed and modified files in the library folder
+
+        Returns:
+            List of paths that were added, removed or modified
+        """
+        found = self.scan()
+        changed = [path for path in self.files if path not in found]
+        for path in changed:
+            del self.files[path]
+        for path, stamp in found.items():
+            if self.files.get(path) == stamp:
+                continue
+            try:
+                self.load(path)
+                self.files[path] = stamp
+                changed.append(path)
+            except OSError as e:
+                print(f"Error reading drill file {path}: {str(e)}")
+        return changed
+
+    def cache_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.v{CACHE_VERSION}.json")
+
+    def load(self, path):
+        """Get the parsed pattern of a drill file, from cache where possible
+
+        Returns:
+            Tools dict as returned by parse_drill_text, shared with the cache
+            so callers must not modify it
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+
+        if digest in self.patterns:
+            return self.patterns[digest]
+
+        tools = None
+        cache_path = self.cache_path(digest)
+        try:
+            with open(cache_path, 'r') as f:
+                tools = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if tools is None:
+            tools = parse_drill_text(data.decode('utf-8', errors='replace'))
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(cache_path, 'w') as f:
+                    json.dump(tools, f)
+            except OSError as e:
+                print(f"Could not write drill cache {cache_path}: {str(e)}")
+
+        self.patterns[digest] = tools
+        return tools
@@ -0,0 +1,115 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tty
+
+LINE_RE = re.compile(r'N(-?\d+)\s+(.*)\*(\d+)$')
+TEMPERATURE_REPORT = "T:215.0 /215.0 B:60.0 /60.0 T0:215.0 /215.0 @:0 B@:0"
+
+
+def checksum(text):
+    result = 0
+    for char in text:
+        result ^= ord(char)
+    return result
+
+
+class FakePrinter:
+    """Pseudo-terminal that answers like Marlin firmware, for testing without hardware
+
+    Open `port` like any serial port. Numbered lines are checked the way
+    Marlin checks them, so a bad checksum or a line out of sequence gets
+    an error and a resend request. Each command is acknowledged after
+    `command_time` seconds, roughly how long a short move takes.
+
+    Only available where the os module supports pseudo-terminals (Linux, macOS).
+    """
+
+    def __init__(self, command_time=0.0, error_rate=0.0, seed=None):
+        self.command_time = command_time
+        self.error_rate = error_rate  # Chance of pretending a line arrived corrupted
+        self.random = random.Random(seed)
+        self.last_line = 0
+        self.received = []  # Commands accepted, in order
+        self.resends = 0
+        self.running = False
+        self.thread = None
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # No echo or newline translation
+        self.port = os.ttyname(self.slave)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='fake printer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
+
+    def write(self, *lines):
+        os.write(self.master, "".join(line + "\n" for line in lines).encode('ascii'))
+
+    def run(self):
+        self.write("start")
+        buf = b""
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break  # Closed
+            buf += data
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                self.handle(line.decode('ascii', errors='replace').strip())
+
+    def request_resend(self, error):
+        self.resends += 1
+        self.write(f"Error:{error}, Last Line: {self.last_line}",
+                   f"Resend: {self.last_line + 1}", "ok")
+
+    def handle(self, line):
+        if not line:
+            return
+        match = LINE_RE.match(line)
+        if match:
+            number, command = int(match.group(1)), match.group(2).strip()
+            prefix = line[:line.rindex('*')]
+            if checksum(prefix) != int(match.group(3)) or self.random.random() < self.error_rate:
+                self.request_resend("checksum mismatch")
+                return
+            if command.startswith('M110'):
+                new_number = re.search(r'N(-?\d+)', command)
+                self.last_line = int(new_number.group(1)) if new_number else number
+            elif number != self.last_line + 1:
+                self.request_resend("Line Number is not Last Line Number+1")
+                return
+            else:
+                self.last_line = number
+        else:
+            command = line
+
+        self.received.append(command)
+        if self.command_time:
+            time.sleep(self.command_time)
+        if command.startswith('M105'):
+            self.write(f"ok {TEMPERATURE_REPORT}")
+        else:
+            self.write("ok")
+
+
+if __name__ == "__main__":
+    error_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 0.0
+    printer = FakePrinter(command_time=0.005, error_rate=error_rate).start()
+    print(f"Fake printer listening on {printer.port}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"{len(printer.received)} commands received, {printer.resends} resends requested")
+        printer.stop()
@@ -0,0 +1,155 @@
+import numpy as np
+
+CELL_SIZE = 0.5  # mm per height map cell
+NOZZLE_RADIUS = 1.5  # mm around the nozzle tip that must clear printed material
+TRAVEL_CLEARANCE = 0.6  # mm kept between the nozzle and printed material when travelling
+SAMPLE_STEP = 0.25  # mm between height checks along a travel move
+
+
+class HeightMap:
+    """Highest printed Z in each cell of a grid over the printed segments
+
+    Queries return the highest Z within NOZZLE_RADIUS of a point, so a
+    travel checked against the map keeps the whole nozzle tip clear.
+    Outside the printed area the height is -inf.
+    """
+
+    def __init__(self, starts, ends, cell_size=CELL_SIZE, radius=NOZZLE_RADIUS):
+        self.cell_size = cell_size
+        self.radius = radius
+        if len(starts):
+            points = np.concatenate([starts, ends])
+            self.x0, self.y0 = points[:, :2].min(axis=0) - radius
+            x1, y1 = points[:, :2].max(axis=0) + radius
+        else:
+            self.x0 = self.y0 = x1 = y1 = 0
+        nx = int(np.ceil((x1 - self.x0) / cell_size)) + 1
+        ny = int(np.ceil((y1 - self.y0) / cell_size)) + 1
+        self.heights = np.full((ny, nx), -np.inf, dtype=np.float32)
+        self.add_segments(starts, ends)
+
+    def cells(self, x, y):
+        """Grid indices of points, and whether each point is on the grid"""
+        ix = np.floor((np.asarray(x) - self.x0) / self.cell_size).astype(np.int64)
+        iy = np.floor((np.asarray(y) - self.y0) / self.cell_size).astype(np.int64)
+        ny, nx = self.heights.shape
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        return np.clip(ix, 0, nx - 1), np.clip(iy, 0, ny - 1), inside
+
+    def add_segments(self, starts, ends):
+        """Raise the map under a set of extruded segments"""
+        if not len(starts):
+            self.clear_heights = self.heights
+            return
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+
+        # Sample every segment at least twice per cell
+        lengths = np.hypot(*(ends[:, :2] - starts[:, :2]).T)
+        counts = np.maximum(1, np.ceil(lengths / (self.cell_size / 2))).astype(np.int64) + 1
+        seg = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+        t = offsets / np.repeat(counts - 1, counts).clip(min=1)
+        points = starts[seg] + (ends[seg] - starts[seg]) * t[:, None]
+
+        ix, iy, inside = self.cells(points[:, 0], points[:, 1])
+        np.maximum.at(self.heights, (iy[inside], ix[inside]), points[inside, 2].astype(np.float32))
+
+        # Spread each cell's height over the nozzle radius once, so queries are lookups
+        r = int(np.ceil(self.radius / self.cell_size))
+        padded = np.pad(self.heights, r, constant_values=-np.inf)
+        ny, nx = self.heights.shape
+        clear = self.heights.copy()
+        for dy in range(-r, r + 1):
+            for dx in range(-r, r + 1):
+                if dx * dx + dy * dy <= r * r:
+                    np.maximum(clear, padded[r + dy:r + dy + ny, r + dx:r + dx + nx], out=clear)
+        self.clear_heights = clear
+
+    def profile(self, start, end):
+        """Heights the nozzle has to clear along a straight XY move
+
+        Returns:
+            (t, heights) with t running from 0 at start to 1 at end
+        """
+        length = np.hypot(end[0] - start[0], end[1] - start[1])
+        t = np.linspace(0, 1, max(2, int(np.ceil(length / SAMPLE_STEP)) + 1))
+        ix, iy, inside = self.cells(start[0] + (end[0] - start[0]) * t,
+                                    start[1] + (end[1] - start[1]) * t)
+        heights = np.where(inside, self.clear_heights[iy, ix], -np.inf)
+        return t, heights
+
+
+def build_height_map(gcode, layer_idx, line_idx, min_z):
+    """Height map of everything printed before a point in the G-code
+
+    Only layers that reach min_z are read, since lower material can't be
+    in the way of a nozzle that never goes below it.
+
+    Args:
+        gcode: printrun GCode or LazyGCode
+        layer_idx, line_idx: The point printing has reached
+        min_z: Lowest Z the nozzle will travel at
+    """
+    first = layer_idx
+    while first > 0:
+        z = gcode.all_layers[first - 1].z
+        if z is not None and z < min_z:
+            break
+        first -= 1
+
+    # Start from where the nozzle was when the first layer began
+    prev = None
+    if first > 0:
+        for line in reversed(gcode.all_layers[first - 1]):
+            if line.is_move:
+                prev = (line.current_x, line.current_y, line.current_z)
+                break
+
+    starts, ends = [], []
+    for idx in range(first, layer_idx + 1):
+        layer = gcode.all_layers[idx]
+        for line in (layer[:line_idx] if idx == layer_idx else layer):
+            if not line.is_move:
+                continue
+            pos = (line.current_x, line.current_y, line.current_z)
+            if line.extruding and prev is not None and pos[2] >= min_z:
+                starts.append(prev)
+                ends.append(pos)
+            prev = pos
+    return HeightMap(np.array(starts, dtype=np.float64).reshape(-1, 3),
+                     np.array(ends, dtype=np.float64).reshape(-1, 3))
+
+def plan_hop(height_map, start, end, clearance=TRAVEL_CLEARANCE, floor=-np.inf):
+    """Plan the lowest safe travel between two nozzle positions
+
+    The nozzle rises straight up until it clears the material around it,
+    then moves in a single XYZ line to above the end point if that line
+    stays clear, otherwise travels level at the highest point in the way.
+    It finally drops straight down to the end point.
+
+    Args:
+        height_map: HeightMap of the printed material
+        start, end: (x, y, z) nozzle positions, e.g. inside holes
+        floor: Z of anything in the way that isn't printed, e.g. the top
+            of a board placed in a pocket, which the map shows as empty
+
+    Returns:
+        List of (x, y, z) waypoints after start, the last one being end
+    """
+    t, heights = height_map.profile(start, end)
+    needed = np.maximum(heights, floor) + clearance
+    exit_z = max(start[2], float(needed[0]))
+    entry_z = max(end[2], float(needed[-1]))
+
+    if np.all(exit_z + (entry_z - exit_z) * t >= needed):
+        travel = [(start[0], start[1], exit_z), (end[0], end[1], entry_z)]
+    else:
+        travel_z = max(exit_z, entry_z, float(needed.max()))
+        travel = [(start[0], start[1], travel_z), (end[0], end[1], travel_z)]
+
+    waypoints = [travel[0]] if travel[0][2] > start[2] else []
+    waypoints.append(travel[1])
+    if travel[1][2] > end[2]:
+        waypoints.append(tuple(end))
+    return waypoints
@@ -0,0 +1,417 @@
+import compact
+import heightmap
+import motion
+import objects
+import planner
+import timing
+
+INJECTION_TEMPERATURE = 240  # Conductive tool temperature while injecting
+INJECTION_DEPTH = 0.45  # mm below the current layer that holes are injected at
+
+
+def read_variables(path):
+    """Slicer settings written as '; key = value' comments in a G-code file"""
+    variables = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith(';'):  # Comment line
+                # Remove semicolon and whitespace
+                comment = line[1:].strip()
+                if '=' in comment:
+                    # Split on first equals sign
+                    key, value = comment.split('=', 1)
+                    variables[key.strip()] = value.strip()
+    return variables
+
+def active_tool_at(gcode, layer_idx):
+    """Tool active at the start of a layer, None if unknown"""
+    if layer_idx < 0 or layer_idx >= len(gcode.all_layers):
+        return None
+    # Only moves know their tool, a layer starts with the slicer's comments
+    for line in gcode.all_layers[layer_idx]:
+        tool = getattr(line, 'current_tool', None)
+        if tool is not None:
+            return tool
+    return None
+
+def gcode_tools(gcode):
+    """Tool numbers used anywhere in parsed or lazily loaded G-code"""
+    if hasattr(gcode, 'tools'):
+        return gcode.tools()
+
+    tools = set()
+    # Look through all lines for tool changes
+    for layer in gcode.all_layers:
+        for line in layer:
+            if hasattr(line, 'command') and line.command.startswith('T'):
+                # Extract tool number from T command
+                try:
+                    tools.add(int(line.command[1:]))
+                except ValueError:
+                    continue
+    return sorted(tools)
+
+def layer_z(gcode, layer_idx):
+    """Z of the first move in a layer, as the marker shows it"""
+    for line in gcode.all_layers[layer_idx]:
+        if getattr(line, 'current_z', None) is not None:
+            return line.current_z
+    return 0
+
+def pattern_holes(tools, tool, position):
+    """Print coordinates of a drill pattern placed as the GUI's marker places it
+
+    Args:
+        tools: Tools dict from drill_library.parse_drill_text
+        tool: Drill tool name, e.g. "T1", None for the first one with points
+        position: [x, y] print coordinates of the centre of the tool's holes
+
+    Raises:
+        ValueError: If the drill file has no holes for the tool
+    """
+    if tool is None:
+        tool = next((name for name, data in tools.items() if data['points']), None)
+    if tool not in tools or not tools[tool]['points']:
+        raise ValueError(f"No holes for drill tool {tool}")
+    points = tools[tool]['points']
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    # The marker keeps points relative to the centre of their bounding box
+    center_x = (min(xs) + max(xs)) / 2
+    center_y = (min(ys) + max(ys)) / 2
+    return [[x - center_x + position[0], y - center_y + position[1]] for x, y in points]
+
+def plan_injection(gcode, variables, profile, layer_idx, conductive_tool, holes, layer_height, check=None,
+                   object_index=None):
+    """Work out the commands to inject holes at a layer
+
+    Args:
+        gcode: Parsed printrun GCode or LazyGCode
+        variables: Slicer settings of the G-code, see read_variables
+        profile: PrinterProfile the G-code was sliced for
+        layer_idx: Layer to inject the holes at the start of
+        conductive_tool: Tool number that injects the holes
+        holes: List of [x, y] print coordinates of the holes
+        layer_height: Z of the layer, filled into the toolchange templates
+        check: Called between the slower steps, may raise to stop planning
+        object_index: objects.ObjectIndex of the G-code, built here if the
+            slicer labelled objects and none is given
+
+    Returns:
+        List of (layer_idx, line_idx, commands) insertions for planner.splice_lines
+
+    Raises:
+        ValueError: If the holes can't be injected at the layer
+    """
+    active_tool = active_tool_at(gcode, layer_idx)
+    if active_tool is not None:
+        print(f"  Active Tool: T{active_tool}")
+    else:
+        print("  No active tool found")
+
+    print("\n=== End Drill Hole Coordinates ===")
+
+    ## If the active tool is not the same as the conductive tool, then we are going to need to change to
+    ## the tool and perform a wipe
+
+    gcode_to = ""
+    gcode_from = ""
+    preheats = []
+    return_preheat = None
+
+    # Reuse a change to the conductive tool that the layer already makes rather than
+    # splicing in another full toolchange (heat, park and wipe) of our own
+    layer = gcode.all_layers[layer_idx]
+    insert_at = None
+    if active_tool is not None and active_tool != conductive_tool:
+        insert_at = planner.find_toolchange_insertion(layer, conductive_tool)
+        if insert_at is not None:
+            print(f"Reusing existing toolchange to T{conductive_tool} at layer line {insert_at}")
+
+    ## Tool temps can be parsed from g-code with the form "; temperature = 205,205,205,230,245"
+    tool_temps = [int(temp.strip()) for temp in variables.get('temperature').split(',')]
+    conductive_tool_idx = int(conductive_tool)
+    idle_temps = planner.parse_tool_values(variables.get('idle_temperature'))
+    def idle_temp(tool):
+        return idle_temps[tool] if tool < len(idle_temps) else None
+
+    if active_tool is not None and active_tool != conductive_tool and insert_at is None:
+
+        # Find if the gcode contains a wipe tower
+        ## Search g-code for comment line '; wipe_tower = 1'
+        if variables.get('wipe_tower') == '1':
+            print("Found wipe tower")
+        else:
+            raise ValueError("The G-code has no wipe tower to change to the conductive tool at")
+
+        ## Now we know the g-code contains a wipe tower, so we need to work ou tthe parameters needed to populate
+        ## the wipe tower g-code snipet
+
+        ### Things we need to work out
+        ### 1. The current layer height
+        ### 2. The current tool number
+        ### 3. The current tool temperature
+        ### 4. The conductive tool temperature
+        ### 5. The location of the wipe tower (x, y)
+        ### 7. The retract length before a toolchange
+
+        ## Current layer height is the marker's layer height, rounded like the
+        ## generated moves so ;HEIGHT doesn't show float noise like 3.799999952316284
+        current_layer_height = compact.format_number(layer_height, compact.COORD_DIGITS)
+
+        ## Current tool number is easy we can use the model's active_tool
+        current_tool_number = active_tool
+
+        # Convert tool numbers to integers for indexing
+        current_tool_idx = int(current_tool_number)
+
+        # The conductive tool goes straight to the injection temperature so the
+        # toolchange and the injection don't each wait on a heat-up
+        to_temp = max(tool_temps[conductive_tool_idx], INJECTION_TEMPERATURE)
+        from_temp = tool_temps[current_tool_idx]
+
+        # Lets find the coordinates of the wipe tower
+        # We're looking for a comment line like this:
+        #; wipe_tower_x = 190.747
+        #; wipe_tower_y = 296.1
+
+        wipe_tower_x = float(variables.get('wipe_tower_x'))
+        wipe_tower_y = float(variables.get('wipe_tower_y'))
+
+        # Print everything nicely
+        print(f"Current Layer Height: {current_layer_height}")
+        print(f"Current Tool Number: {current_tool_number}")
+        print(f"Wipe Tower X: {wipe_tower_x}")
+        print(f"Wipe Tower Y: {wipe_tower_y}")
+
+        ## Fill g-code snippets from the printer profile's precompiled template
+        wipe = profile.wipe_coordinates(wipe_tower_x, wipe_tower_y)
+
+        # Set retract amount
+        retract_amount = profile.toolchange_retract  # mm
+
+        # Populate the template for changing TO the conductive tool
+        gcode_to = profile.toolchange(
+            LAYER_HEIGHT=current_layer_height,
+            RETRACT=retract_amount,
+            FROM_TOOL=current_tool_number,
+            TO_TOOL=conductive_tool,
+            TO_TOOL_TEMP=to_temp,
+            DE_RETRACT=retract_amount,
+            **wipe)
+
+        # Populate the template for changing FROM the conductive tool back to the original tool
+        gcode_from = profile.toolchange(
+            LAYER_HEIGHT=current_layer_height,
+            RETRACT=0,
+            FROM_TOOL=conductive_tool,
+            TO_TOOL=current_tool_number,
+            TO_TOOL_TEMP=from_temp,
+            DE_RETRACT=retract_amount,
+            **wipe)
+
+        ## Schedule non-blocking preheats so the M109s in the toolchanges don't stall
+        to_lead = planner.heatup_time(to_temp, idle_temp(conductive_tool_idx),
+                                      profile.heatup_rate, profile.preheat_margin)
+        preheat_layer, preheat_line = planner.find_preheat_point(
+            gcode, layer_idx, 0, conductive_tool_idx, to_lead)
+        preheats.append((preheat_layer, preheat_line, [f"M104 T{conductive_tool} S{to_temp}"]))
+        print(f"Preheating T{conductive_tool} to {to_temp} at layer {preheat_layer} line {preheat_line} ({to_lead:.0f}s ahead)")
+
+        return_preheat = (current_tool_number, from_temp,
+                          planner.heatup_time(from_temp, idle_temp(current_tool_idx),
+                                              profile.heatup_rate, profile.preheat_margin))
+
+        # Print the generated G-code for verification
+        print("\nGenerated G-code for changing TO conductive tool:")
+        print(gcode_to)
+        print("\nGenerated G-code for changing FROM conductive tool:")
+        print(gcode_from)
+
+    elif active_tool == conductive_tool or insert_at is not None:
+        # The conductive tool is already printing, at the slicer's temperature for it,
+        # so it is heated on to the injection temperature as far ahead as it can be
+        inject_temp = max(tool_temps[conductive_tool_idx], INJECTION_TEMPERATURE)
+        inject_lead = planner.heatup_time(inject_temp, tool_temps[conductive_tool_idx],
+                                          profile.heatup_rate, profile.preheat_margin)
+        preheat_layer, preheat_line = planner.find_preheat_point(
+            gcode, layer_idx, insert_at or 0, conductive_tool_idx, inject_lead, active=True)
+        preheats.append((preheat_layer, preheat_line, [f"M104 T{conductive_tool} S{inject_temp}"]))
+        print(f"Preheating T{conductive_tool} to {inject_temp} at layer {preheat_layer} "
+              f"line {preheat_line} ({inject_lead:.0f}s ahead)")
+
+    # Generate G-code for drilling holes
+    print("\nGenerating G-code for holes...")
+
+    # Find the first move command in the layer to get the starting position
+    first_move = None
+    for line in layer:
+        if hasattr(line, 'is_move') and line.is_move:
+            first_move = line
+            break
+
+    if first_move is None:
+        raise ValueError("No move commands found in the layer")
+
+    layer_start_pos = [first_move.current_x, first_move.current_y, first_move.current_z]
+    print(f"Layer start position: {layer_start_pos}")
+
+    # When reusing a toolchange the injection returns to where the nozzle was at that point
+    start_pos = layer_start_pos
+    if insert_at is not None:
+        start_pos = planner.position_before(layer, insert_at) or layer_start_pos
+        print(f"Injection start position: {start_pos}")
+
+    # The conductive tool is already preheated to the injection temperature unless
+    # the tool it is changed from isn't known, then it heats as the injection begins
+    injection_temp = None if preheats else INJECTION_TEMPERATURE
+
+    # Inject each hole as part of the object it is in, so cancelling an object on the
+    # printer also skips its holes, and leave the print under the label it had
+    hole_objects = None
+    resume_label = objects.NO_OBJECT
+    if object_index is None and objects.uses_labels(variables):
+        object_index = objects.ObjectIndex.from_gcode(gcode, check)
+    if object_index:
+        hole_objects = object_index.objects_at(holes, layer_idx).tolist()
+        resume_label = object_index.label_at(layer_idx, insert_at or 0)
+        for obj in sorted(set(hole_objects) - {objects.NO_OBJECT}):
+            print(f"{hole_objects.count(obj)} holes in {object_index.describe(obj)}")
+
+    # Move as fast as the machine limits allow, then leave the motion state as the print had it
+    motion_profile = motion.MotionProfile.from_variables(variables, int(conductive_tool))
+    resume_motion = motion.state_before(gcode, layer_idx, insert_at or 0)
+
+    # Plan travel hops against what has been printed so far instead of a fixed lift
+    if check:
+        check()
+    height_map = heightmap.build_height_map(
+        gcode, layer_idx, insert_at or 0,
+        min_z=start_pos[2] - INJECTION_DEPTH - heightmap.TRAVEL_CLEARANCE)
+    # Our own toolchange leaves no object labelled
+    hole_gcode = generate_hole_gcode(holes, start_pos, injection_temp=injection_temp,
+                                     print_temp=tool_temps[conductive_tool_idx], height_map=height_map,
+                                     hole_objects=hole_objects,
+                                     label=objects.NO_OBJECT if gcode_to else resume_label,
+                                     motion_profile=motion_profile)
+
+    # Bring the return tool back up while the holes are being injected
+    if return_preheat:
+        return_tool, return_temp, return_lead = return_preheat
+        durations = timing.estimate_block_durations(hole_gcode, start_pos)
+        preheat_idx = planner.find_block_preheat_index(durations, return_lead)
+        hole_gcode.insert(preheat_idx, f"M104 T{return_tool} S{return_temp}")
+    print("\nGenerated G-code for holes:")
+
+    combined_gcode = [line for line in gcode_to.split('\n')]
+    combined_gcode.extend(["M601 \n"])
+    combined_gcode.extend(hole_gcode)
+    combined_gcode.extend([line for line in gcode_from.split('\n')])
+    if gcode_from and resume_label != objects.NO_OBJECT:
+        combined_gcode.append(f"M486 S{resume_label}")
+    combined_gcode.extend(motion.restore_commands(resume_motion, variables))
+
+    # Drop the repeated feedrates, unchanged axes and no-op commands of the filled
+    # templates, the block runs in the absolute XYZ and relative E of the slicer's G-code
+    combined_gcode = list(compact.compact_lines(combined_gcode, compact.ModalState(absolute=True, relative_e=True)))
+
+    # Splice into the layer at the start unless reusing a toolchange
+    return preheats + [(layer_idx, insert_at or 0, combined_gcode)]
+
+def generate_hole_gcode(holes, last_pos, extrusion_amount=0.48, retraction_amount=7.5, print_retraction=2.5,
+                        injection_temp=INJECTION_TEMPERATURE, print_temp=None, height_map=None,
+                        hole_objects=None, label=objects.NO_OBJECT, motion_profile=None):
+    """Generate G-code commands for drilling holes
+
+    Args:
+        holes: List of [x, y] coordinates for holes
+        last_pos: List of [x, y, z] coordinates for starting position
+        extrusion_amount: Amount to extrude for each hole
+        retraction_amount: Amount to retract between holes
+        print_retraction: Amount to retract before returning to print
+        injection_temp: Temperature to inject at, None if the tool was preheated
+        print_temp: Temperature to return to after injecting, the slicer's
+            temperature for the tool, None to leave it at the injection
+            temperature
+        height_map: HeightMap of the printed material to plan travel hops
+            over, without one every hop lifts 5mm above the last Z-height
+        hole_objects: M486 object label of each hole. Only the extrusion of
+            a hole is labelled, so a cancelled object's holes are skipped
+            without the printer losing track of the travel moves
+        label: M486 label in effect around the block
+        motion_profile: motion.MotionProfile of the moves, without one
+            every move runs at F4200
+    """
+    if motion_profile is None:
+        motion_profile = motion.MotionProfile()
+    x_start, y_start, z_start = last_pos
+    gcode = motion_profile.acceleration_commands()
+    move_above_height = 5 + z_start  # Move 5mm above the last Z-height
+
+    z_down = round(z_start-INJECTION_DEPTH, 4)
+
+    def travel(start, end):
+        """Hop between two nozzle positions, combining Z and XY where safe"""
+        if height_map is None:
+            waypoints = [(start[0], start[1], move_above_height),
+                         (end[0], end[1], move_above_height), end]
+        else:
+            # The placed board isn't printed, so hops clear the layer it sits at
+            waypoints = heightmap.plan_hop(height_map, start, end, floor=z_start)
+        pos = tuple(round(v, 4) for v in start)
+        for x, y, z in waypoints:
+            x, y, z = round(x, 4), round(y, 4), round(z, 4)
+            f = motion_profile.travel_feedrate(pos, (x, y, z))
+            if (x, y) == (pos[0], pos[1]):
+                if z != pos[2]:
+                    gcode.append(f"G0 Z{z} F{f}")
+            elif z == pos[2]:
+                gcode.append(f"G0 X{x} Y{y} F{f}")
+            else:
+                gcode.append(f"G0 X{x} Y{y} Z{z} F{f}")
+            pos = (x, y, z)
+
+    retract_f = motion_profile.extruder_feedrate(-retraction_amount)
+    deretract_f = motion_profile.extruder_feedrate(retraction_amount)
+
+    # Set the temp a bit higher
+    if injection_temp is not None:
+        gcode.append(f"M104 S{injection_temp}")
+    # Retract a bit
+    gcode.append(f"G1 E-{retraction_amount} F{retract_f}")
+
+    pos = (x_start, y_start, z_start)
+    for n, (x, y) in enumerate(holes):
+        x = round(x, 4)
+        y = round(y, 4)
+        # Hop over to the hole and lower down to the point
+        travel(pos, (x, y, z_down))
+        hole_label = hole_objects[n] if hole_objects else label
+        if hole_label != label:
+            gcode.append(f"M486 S{hole_label}")
+        # Un-retract
+        gcode.append(f"G1 E{retraction_amount} F{deretract_f}")
+        # Extrude some plastic
+        gcode.append(f"G1 E{extrusion_amount} F{motion_profile.extruder_feedrate(extrusion_amount, inject=True)}")
+        # Wait for 1 second
+        gcode.append(f"G4 P1000")
+        # Retract a bit
+        gcode.append(f"G1 E-{retraction_amount} F{retract_f}")
+        if hole_label != label:
+            gcode.append(f"M486 S{label}")
+        # Wait for 1 second
+        gcode.append(f"G4 P1000")
+        # Move 1mm to the right
+        gcode.append(f"G0 X{x+1} Y{y} F{motion_profile.travel_feedrate((x, y, z_down), (x + 1, y, z_down))}")
+        pos = (x + 1, y, z_down)
+
+    # Hop back to the last x, y, z position
+    travel(pos, (x_start, y_start, z_start))
+
+    # Set the temp back to the print temperature
+    if print_temp is not None:
+        gcode.append(f"M104 S{print_temp}")
+    gcode.append(f"G1 E{retraction_amount-print_retraction} F{deretract_f}")
+
+    return gcode
+
@@ -0,0 +1,86 @@
+import threading
+import time
+
+PROGRESS_INTERVAL = 0.05  # s between progress reports of a stage
+
+
+class Cancelled(Exception):
+    """Raised inside a job's stages once it has been cancelled"""
+
+
+class Job:
+    """Runs stages one after the other on a background thread
+
+    Each stage is a (name, function) pair. The function is called with the
+    job and the previous stage's result, None for the first, and returns
+    its own result. Long stages should call job.progress() as they go,
+    which also stops them by raising Cancelled once the job is cancelled.
+
+    Callbacks are called from the job's thread:
+        on_progress(stage, name, fraction): stage index and name, and how
+            far through the whole job it is from 0 to 1
+        on_done(): once the job has finished, failed or been cancelled,
+            see result, error and cancelled
+    """
+
+    def __init__(self, name, stages, on_progress=None, on_done=None):
+        self.name = name
+        self.stages = stages
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.stage = 0
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.last_report = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"job-{self.name}", daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Stop at the next progress check, on_done is still called"""
+        self.cancelled = True
+
+    def check(self):
+        """Raise Cancelled if the job has been cancelled"""
+        if self.cancelled:
+            raise Cancelled(self.name)
+
+    def progress(self, done, total):
+        """Report progress through the current stage and check for cancellation"""
+        self.check()
+        now = time.monotonic()
+        if self.on_progress and (now - self.last_report >= PROGRESS_INTERVAL or done >= total):
+            self.last_report = now
+            self.report(done / max(total, 1))
+
+    def report(self, fraction):
+        name = self.stages[self.stage][0]
+        self.on_progress(self.stage, name, (self.stage + min(fraction, 1)) / len(self.stages))
+
+    def run(self):
+        result = None
+        try:
+            for stage, (name, function) in enumerate(self.stages):
+                self.stage = stage
+                self.check()
+                if self.on_progress:
+                    self.report(0)
+                result = function(self, result)
+            self.check()
+            self.result = result
+        except Cancelled:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+            import traceback
+            traceback.print_exc()
+        if self.on_done:
+            self.on_done()
+
+    def wait(self, timeout=None):
+        """Block until the job's thread has finished"""
+        if self.thread:
+            self.thread.join(timeout)
@@ -0,0 +1,311 @@
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from printrun.gcoder import Layer
+
+import parallel_parse
+
+LAZY_MIN_BYTES = 32 * 1024 * 1024  # Smaller files are parsed up front as before
+LAYER_CACHE_BYTES = 256 * 1024 * 1024  # Memory budget for parsed layers
+PARSED_BYTES_PER_BYTE = 4  # Rough memory of a parsed layer per byte of G-code
+VIEW_LAYERS_BELOW = 8  # Layers under the current one handed to the viewer
+VIEW_LAYERS_ABOVE = 8  # Layers above it, so small slider moves don't rebuild the view
+
+Z_RE = re.compile(rb';Z:([-+]?[0-9]*\.?[0-9]+)')
+TOOL_RE = re.compile(rb'T(\d+)\b')
+TOOLS_RE = re.compile(rb'^T(\d+)\b', re.MULTILINE)
+Z_HEADER_BYTES = 256  # PrusaSlicer writes ;Z: right after ;LAYER_CHANGE
+# Moves and the commands that change how their coordinates are read
+MOTION_RE = re.compile(rb'^(G[0-3]|G9[0-2]|M8[23])(?![0-9])([^;\n]*)', re.MULTILINE)
+WORD_RE = re.compile(rb'([XYE])\s*([-+]?[0-9]*\.?[0-9]+)')
+
+
+def mode_state(data, offset):
+    """Find the parser state at an offset by searching back from it
+
+    Returns:
+        State dict for parallel_parse.parse_text
+    """
+    g90, g91, m82, m83 = (data.rfind(b'\n' + token, 0, offset)
+                          for token in (b'G90', b'G91', b'M82', b'M83'))
+    tool = 0
+    pos = offset
+    while pos > 0:
+        pos = data.rfind(b'\nT', 0, pos)
+        match = TOOL_RE.match(data, pos + 1) if pos != -1 else None
+        if match:
+            tool = int(match.group(1))
+            break
+
+    state = {
+        'relative': g91 > g90,
+        # G90/G91 switch the extruder too, M82/M83 only the extruder
+        'relative_e': max(g91, m83) > max(g90, m82),
+        'current_tool': tool,
+    }
+    state.update(parallel_parse.last_position(data, offset))
+    return state
+
+
+class LazyLayers:
+    """Stand-in for GCode.all_layers that parses each layer on first access"""
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+
+    def __len__(self):
+        return len(self.gcode.ranges)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Layer {idx} out of range")
+        return self.gcode.get_layer(idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class LazyGCode:
+    """G-code known only by its layer byte ranges until a layer is needed
+
+    The file is memory-mapped and split at the slicer's layer change
+    markers, which is all that happens on load. A layer is parsed with
+    printrun the first time it is accessed and kept in an LRU cache held
+    under a memory budget. Anything written back out (splicing, saving) is
+    copied straight from the mapped bytes without parsing.
+    """
+
+    def __init__(self, data, cache_bytes=LAYER_CACHE_BYTES):
+        self.data = data
+        self.file = None
+        self.temporary = False  # Remove the mapped file on close
+        self.cache_bytes = cache_bytes
+
+        # Everything before the first layer change is layer 0
+        starts = [0] + parallel_parse.find_layer_boundaries(data)
+        self.ranges = list(zip(starts, starts[1:] + [len(data)]))
+        self.zs = []
+        for start, end in self.ranges:
+            match = Z_RE.search(data, start, min(end, start + Z_HEADER_BYTES))
+            self.zs.append(float(match.group(1)) if match else None)
+
+        self.all_layers = LazyLayers(self)
+        self.cache = OrderedDict()  # Parsed layers by index, least recently used first
+        self.cache_used = 0
+        self.cache_lock = threading.Lock()  # Layers are read from the UI thread and background jobs at once
+        self.end_states = {}  # Parser state after each parsed layer, kept after eviction
+
+    @classmethod
+    def open(cls, path, cache_bytes=LAYER_CACHE_BYTES, temporary=False):
+        """Memory-map a G-code file
+
+        Args:
+            temporary: Remove the file once it is closed, e.g. a copy made
+                to read
+        """
+        f = open(path, 'rb')
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            f.close()
+            raise
+        gcode = cls(data, cache_bytes)
+        gcode.file = f
+        gcode.temporary = temporary
+        return gcode
+
+    @classmethod
+    def from_lines(cls, lines, cache_bytes=LAYER_CACHE_BYTES):
+        """Wrap G-code lines ending in newlines, e.g. freshly spliced ones"""
+        return cls(''.join(lines).encode('utf-8'), cache_bytes)
+
+    def close(self):
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_used = 0
+        if self.file:
+            self.data.close()
+            self.file.close()
+            if self.temporary:
+                os.remove(self.file.name)
+            self.file = None
+
+    def layer_cost(self, idx):
+        start, end = self.ranges[idx]
+        return (end - start) * PARSED_BYTES_PER_BYTE
+
+    def raw_lines(self, idx):
+        """Raw lines of a layer as in the file, without parsing it
+
+        Split the way get_layer splits them for parsing, each line keeps
+        its own line ending and the last line of the file gets one.
+        """
+        start, end = self.ranges[idx]
+        text = self.data[start:end].decode('utf-8', errors='replace')
+        lines = text.splitlines(keepends=True)
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            lines[-1] += "\n"
+        return lines
+
+    def line_offset(self, idx, line_idx):
+        """Byte offset of a parsed line of a layer, the layer's end past its last line"""
+        start, end = self.ranges[idx]
+        pos = start
+        for line in self.data[start:end].splitlines(keepends=True):
+            # printrun drops blank lines, so they have no index
+            if line.strip():
+                if not line_idx:
+                    return pos
+                line_idx -= 1
+            pos += len(line)
+        return end
+
+    def lines_before(self, offset, prefix):
+        """Lines starting with prefix before an offset, last first, found without parsing
+
+        Args:
+            prefix: Bytes the lines start with, e.g. b'M204'
+        """
+        pos = offset
+        while pos > 0:
+            pos = self.data.rfind(b'\n' + prefix, 0, pos)
+            if pos == -1:
+                return
+            end = self.data.find(b'\n', pos + 1, offset)
+            yield self.data[pos + 1:end if end != -1 else offset].decode('utf-8', errors='replace')
+
+    def state_before(self, idx):
+        if idx == 0:
+            return {}
+        if idx - 1 in self.end_states:
+            return self.end_states[idx - 1]
+        return mode_state(self.data, self.ranges[idx][0])
+
+    def get_layer(self, idx):
+        """Get a parsed layer, parsing and caching it if needed"""
+        with self.cache_lock:
+            layer = self.cache.get(idx)
+            if layer is not None:
+                self.cache.move_to_end(idx)
+                return layer
+
+        start, end = self.ranges[idx]
+        text = self.data[start:end].decode('utf-8', errors='replace')
+        parsed = parallel_parse.parse_text(text, self.state_before(idx))
+        self.end_states[idx] = parallel_parse.end_state(parsed)
+
+        # printrun may split the range further on Z hops, keep it as one layer.
+        # The last of its layers is the empty append layer
+        lines = []
+        duration = 0
+        for sublayer in parsed.all_layers[:-1]:
+            lines.extend(sublayer)
+            duration += sublayer.duration
+        z = self.zs[idx]
+        if z is None and lines:
+            z = lines[-1].current_z
+        layer = Layer(lines, z)
+        layer.duration = duration
+
+        # Parsed outside the lock, so another thread may have cached the layer
+        # meanwhile. Its copy is kept and the cost only counted once
+        with self.cache_lock:
+            if idx in self.cache:
+                self.cache.move_to_end(idx)
+                return self.cache[idx]
+            # Evict least recently used layers, always keeping the new one
+            self.cache[idx] = layer
+            self.cache_used += self.layer_cost(idx)
+            while self.cache_used > self.cache_bytes and len(self.cache) > 1:
+                old_idx, _ = self.cache.popitem(last=False)
+                self.cache_used -= self.layer_cost(old_idx)
+        return layer
+
+    def window(self, first, last):
+        """Build a printrun GCode of a range of layers for the viewer
+
+        Returns:
+            GCode with first_layer set to the index of its first layer
+        """
+        gcode = parallel_parse.build_gcode([self.get_layer(idx) for idx in range(first, last + 1)])
+        gcode.first_layer = first
+
+        xs = [line.current_x for line in gcode.lines if line.extruding and line.current_x is not None]
+        ys = [line.current_y for line in gcode.lines if line.extruding and line.current_y is not None]
+        gcode.xmin, gcode.xmax = (min(xs), max(xs)) if xs else (0, 0)
+        gcode.ymin, gcode.ymax = (min(ys), max(ys)) if ys else (0, 0)
+        gcode.width = gcode.xmax - gcode.xmin
+        gcode.depth = gcode.ymax - gcode.ymin
+        return gcode
+
+    def extruded_segments(self, progress=None, offsets=False):
+        """Extruded XY segments of every layer read straight from the bytes
+
+        Only moves, positioning modes and G92 are looked at, which is much
+        quicker than parsing each layer and leaves the layer cache alone.
+
+        Args:
+            progress: Called with (layer index, layer count) as layers are read
+            offsets: Also return the byte offset of each segment's move
+
+        Returns:
+            (layers, starts, ends) like pocket.layer_segments, followed by
+            the offsets if asked for
+        """
+        layers, starts, ends, moves = [], [], [], []
+        x = y = None
+        e = 0.0
+        relative = relative_e = False
+        for idx, (start, end) in enumerate(self.ranges):
+            if progress:
+                progress(idx, len(self.ranges))
+            for match in MOTION_RE.finditer(self.data, start, end):
+                command = match.group(1)
+                if command in (b'G90', b'G91'):
+                    # G90/G91 switch the extruder too, M82/M83 only the extruder
+                    relative = relative_e = command == b'G91'
+                    continue
+                if command in (b'M82', b'M83'):
+                    relative_e = command == b'M83'
+                    continue
+                words = {axis: float(value) for axis, value in WORD_RE.findall(match.group(2))}
+                if command == b'G92':
+                    e = words.get(b'E', e)
+                    continue
+
+                new_x, new_y = words.get(b'X'), words.get(b'Y')
+                if relative:
+                    new_x = (x or 0) + (new_x or 0)
+                    new_y = (y or 0) + (new_y or 0)
+                new_x = x if new_x is None else new_x
+                new_y = y if new_y is None else new_y
+                extruding = False
+                if b'E' in words:
+                    extruding = words[b'E'] > (0 if relative_e else e)
+                    e = e + words[b'E'] if relative_e else words[b'E']
+                if extruding and x is not None and y is not None and new_x is not None and new_y is not None:
+                    layers.append(idx)
+                    starts.append((x, y))
+                    ends.append((new_x, new_y))
+                    moves.append(match.start())
+                x, y = new_x, new_y
+        segments = (np.array(layers, dtype=np.int64),
+                    np.array(starts, dtype=np.float64).reshape(-1, 2),
+                    np.array(ends, dtype=np.float64).reshape(-1, 2))
+        if offsets:
+            return segments + (np.array(moves, dtype=np.int64),)
+        return segments
+
+    def tools(self):
+        """Tool numbers used anywhere in the file"""
+        return sorted({int(tool) for tool in TOOLS_RE.findall(self.data)})
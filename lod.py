@@ -0,0 +1,194 @@
+from pyglet.gl import glEnableClientState, glDisableClientState, \
+    GL_VERTEX_ARRAY, GL_COLOR_ARRAY, glVertexPointer, glColorPointer, \
+    GL_FLOAT, glDrawArrays, GL_LINES, glLineWidth, glDisable, GL_LIGHTING
+import numpy as np
+
+from tool_palette import tool_colors
+
+LOD_MIN_LINES = 500000  # Prints with fewer G-code lines are drawn at full detail
+CHUNK_LAYERS = 8  # Layers merged into one decimated segment set
+NEAR_LAYERS = 4  # Layers right under the current one drawn at full detail
+LOD_TOLERANCES = (0.5, 2.0)  # Decimation grid in mm for each level, finest first
+COARSE_CHUNKS = 4  # Chunks further below the current layer than this use the coarsest level
+MAX_CACHED_LAYERS = 64  # Full detail layers kept around while scrubbing
+
+
+def decimate(starts, ends, tools, tolerance):
+    """Simplify a set of segments to a grid
+
+    Segments shorter than a grid cell are dropped and segments joining the
+    same pair of cells with the same tool are merged into one, keeping the
+    highest. Stacked perimeters over a range of layers collapse this way.
+
+    Returns:
+        (starts, ends, tools) of the kept segments
+    """
+    if not len(tools):
+        return starts, ends, tools
+    qs = np.round(starts[:, :2] / tolerance).astype(np.int64)
+    qe = np.round(ends[:, :2] / tolerance).astype(np.int64)
+    keep = np.any(qs != qe, axis=1)
+    starts, ends, tools, qs, qe = starts[keep], ends[keep], tools[keep], qs[keep], qe[keep]
+
+    # Direction doesn't matter, so order each segment's cells
+    swap = (qs[:, 0] > qe[:, 0]) | ((qs[:, 0] == qe[:, 0]) & (qs[:, 1] > qe[:, 1]))
+    lo = np.where(swap[:, None], qe, qs)
+    hi = np.where(swap[:, None], qs, qe)
+    keys = np.column_stack([lo, hi, tools])
+
+    # np.unique keeps the first of each key, so sort highest first
+    order = np.argsort(-np.maximum(starts[:, 2], ends[:, 2]), kind='stable')
+    _, first = np.unique(keys[order], axis=0, return_index=True)
+    chosen = order[first]
+    return starts[chosen], ends[chosen], tools[chosen]
+
+
+class SegmentSet:
+    """A batch of line segments drawn with one call"""
+
+    def __init__(self, starts, ends, tools):
+        self.tools = tools
+        self.vertices = np.empty((2 * len(tools), 3), dtype=np.float32)
+        self.vertices[0::2] = starts
+        self.vertices[1::2] = ends
+        self.colors = None
+        self.palette_key = None
+
+    def display(self, palette, palette_key):
+        if not len(self.tools):
+            return
+        if palette_key != self.palette_key:
+            tools = np.minimum(self.tools, len(palette) - 1)
+            self.colors = np.repeat(palette[tools], 2, axis=0)
+            self.palette_key = palette_key
+        glVertexPointer(3, GL_FLOAT, 0, self.vertices.ctypes.data)
+        glColorPointer(4, GL_FLOAT, 0, self.colors.ctypes.data)
+        glDrawArrays(GL_LINES, 0, len(self.vertices))
+
+
+class LodModelActor:
+    """Level-of-detail stand in for everything below the current layer
+
+    Used on large prints with the printrun model switched to only draw the
+    current layer. The few layers under it are drawn as full detail lines
+    and everything further down as merged, decimated chunks of layers, so
+    frame time stays bounded however tall the print is.
+    """
+
+    def __init__(self, parent_viewer=None):
+        self.parent_viewer = parent_viewer
+        self.loaded = False
+        self.initialized = False
+        self.gcode = None
+        self.chunks = []  # Per chunk, one SegmentSet per LOD level
+        self.layer_starts = []  # Nozzle position entering each layer
+        self.layer_cache = {}  # Full detail SegmentSets by layer index
+        self.viz_to_layer = {}
+
+    def layer_segments(self, layer_idx):
+        """Get the extruding segments of a layer as arrays"""
+        starts, ends, tools = [], [], []
+        prev = self.layer_starts[layer_idx]
+        for line in self.gcode.all_layers[layer_idx]:
+            if not line.is_move:
+                continue
+            pos = (line.current_x, line.current_y, line.current_z)
+            if line.extruding and prev is not None:
+                starts.append(prev)
+                ends.append(pos)
+                tools.append(line.current_tool or 0)
+            prev = pos
+        return (np.array(starts, dtype=np.float32).reshape(-1, 3),
+                np.array(ends, dtype=np.float32).reshape(-1, 3),
+                np.array(tools, dtype=np.int64))
+
+    def load(self, model):
+        """Build the decimated chunks for a newly loaded printrun model"""
+        self.loaded = False
+        self.chunks = []
+        self.layer_cache = {}
+        gcode = model.gcode
+        if len(gcode.lines) < LOD_MIN_LINES:
+            return False
+
+        self.gcode = gcode
+        self.viz_to_layer = {v: k for k, v in model.layer_idxs_map.items()}
+
+        # Remember where each layer starts so any layer can be rebuilt alone
+        self.layer_starts = []
+        prev = None
+        for layer in gcode.all_layers:
+            self.layer_starts.append(prev)
+            for line in reversed(layer):
+                if line.is_move:
+                    prev = (line.current_x, line.current_y, line.current_z)
+                    break
+
+        for first in range(0, len(gcode.all_layers), CHUNK_LAYERS):
+            parts = [self.layer_segments(idx) for idx in
+                     range(first, min(first + CHUNK_LAYERS, len(gcode.all_layers)))]
+            starts = np.concatenate([p[0] for p in parts])
+            ends = np.concatenate([p[1] for p in parts])
+            tools = np.concatenate([p[2] for p in parts])
+            self.chunks.append([SegmentSet(*decimate(starts, ends, tools, tolerance))
+                                for tolerance in LOD_TOLERANCES])
+
+        # The printrun model only draws the current layer from now on
+        model.only_current = True
+        if model.num_layers_to_draw > model.max_layers:
+            model.num_layers_to_draw = model.max_layers
+        self.loaded = True
+        print(f"Level of detail enabled: {len(self.chunks)} chunks of {CHUNK_LAYERS} layers")
+        return True
+
+    def clear(self):
+        self.loaded = False
+        self.gcode = None
+        self.chunks = []
+        self.layer_cache = {}
+
+    def get_layer(self, layer_idx):
+        """Get the full detail segments of a layer, cached while nearby"""
+        if layer_idx not in self.layer_cache:
+            if len(self.layer_cache) >= MAX_CACHED_LAYERS:
+                self.layer_cache.pop(next(iter(self.layer_cache)))
+            self.layer_cache[layer_idx] = SegmentSet(*self.layer_segments(layer_idx))
+        return self.layer_cache[layer_idx]
+
+    def palette(self, model):
+        """Colours of each tool from the printrun model"""
+        colors = tool_colors(model)
+        return np.array(colors, dtype=np.float32), colors
+
+    def display(self, mode_2d=False):
+        model = self.parent_viewer.model if self.parent_viewer else None
+        if not self.loaded or not model or model.gcode is not self.gcode:
+            return
+
+        current = self.viz_to_layer.get(model.num_layers_to_draw)
+        if current is None:
+            return
+        near = max(0, current - NEAR_LAYERS)
+        full_chunks = near // CHUNK_LAYERS
+        palette, palette_key = self.palette(model)
+
+        glDisable(GL_LIGHTING)
+        glLineWidth(1.0)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+
+        # Whole chunks below the detailed layers, coarser further down
+        for idx in range(full_chunks):
+            level = 0 if full_chunks - idx <= COARSE_CHUNKS else len(LOD_TOLERANCES) - 1
+            self.chunks[idx][level].display(palette, palette_key)
+
+        # Full detail from the end of the last whole chunk up to the current layer
+        for layer_idx in range(full_chunks * CHUNK_LAYERS, current):
+            self.get_layer(layer_idx).display(palette, palette_key)
+
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+    def init(self):
+        """Initialize OpenGL state"""
+        self.initialized = True
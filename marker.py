@@ -2,11 +2,22 @@ from pyglet.gl import glPushMatrix, glPopMatrix, glTranslatef, \
     glBegin, glEnd, GL_LINES, glColor4f, glVertex3f, \
     glEnable, glDisable, GL_LINE_SMOOTH, glLineWidth, \
     glGetDoublev, GL_MODELVIEW_MATRIX, GL_PROJECTION_MATRIX, \
-    GLdouble, glGetIntegerv, GL_VIEWPORT, GLint
+    GLdouble, glGetIntegerv, GL_VIEWPORT, GLint, \
+    glEnableClientState, glDisableClientState, glVertexPointer, glDrawArrays, \
+    GL_VERTEX_ARRAY, GL_FLOAT
 import wx
 import numpy as np
 import math
 
+import panel
+
+FRAME_INTERVAL = 16  # ms, drag refreshes are coalesced to about one per display frame
+
+# The three lines of a cross around a point, scaled by its size
+CROSS_VERTICES = np.array([[-1, 0, 0], [1, 0, 0],
+                           [0, -1, 0], [0, 1, 0],
+                           [0, 0, -1], [0, 0, 1]], dtype=np.float32)
+
 class MarkerActor:
     def __init__(self, parent_viewer=None):
         self.color = (0.0, 0.0, 0.0, 1.0)  # Black (R,G,B,A)
@@ -20,7 +31,12 @@ class MarkerActor:
         self.drill_points = {}  # Dictionary to store drill points by tool
         self.current_tool = None
         self.center_offset = [0, 0, 0]  # Offset from center to drill points
+        self.repeat_offsets = np.zeros((1, 2))  # [x, y] of each copy of the pattern from the first
+        self.repeat_text = ""  # What the copies were described with, see panel.parse_repeat
+        self.cross_vertices = None  # Vertex array of the drill point crosses, rebuilt on changes
         self.last_layer_number = 0
+        self.layer_heights = []  # Z of each layer, rebuilt once per loaded model
+        self.layer_heights_model = None
         
         # Get build platform dimensions and offsets
         if self.parent_viewer:
@@ -37,6 +53,9 @@ class MarkerActor:
                            self.depth/2 + self.yoffset, 
                            self.get_current_layer_height()]
             
+            # Coalesces drag refreshes, like the viewer's own refresh_timer
+            self.refresh_timer = wx.CallLater(FRAME_INTERVAL, self.parent_viewer.Refresh)
+
             # Bind mouse events
             canvas = self.parent_viewer.glpanel.canvas
             canvas.Bind(wx.EVT_LEFT_DOWN, self.on_mouse_down)
@@ -93,6 +112,7 @@ class MarkerActor:
         }
         if not self.current_tool:
             self.current_tool = tool_name
+        self.cross_vertices = None
 
         if self.parent_viewer:
             self.parent_viewer.Refresh()
@@ -101,9 +121,39 @@ class MarkerActor:
         """Clear all drill points and reset current tool"""
         self.drill_points = {}
         self.current_tool = None
+        self.cross_vertices = None
+        if self.parent_viewer:
+            self.parent_viewer.Refresh()
+
+    def set_repeat(self, offsets, text=""):
+        """Step and repeat the pattern, one copy at each [x, y] offset from the marker"""
+        self.repeat_offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+        self.repeat_text = text
+        self.cross_vertices = None
         if self.parent_viewer:
             self.parent_viewer.Refresh()
 
+    def placed_points(self):
+        """[x, y] print coordinates of the current tool's holes in every copy"""
+        if not self.current_tool or self.current_tool not in self.drill_points:
+            return np.empty((0, 2))
+        points = panel.repeat_points(self.drill_points[self.current_tool]['points'], self.repeat_offsets)
+        return points + self.position[0:2]
+
+    def placed_boards(self):
+        """[x, y] print coordinates of the current tool's holes, one (holes, 2) array per copy"""
+        points = self.placed_points()
+        return list(points.reshape(len(self.repeat_offsets), -1, 2)) if len(points) else []
+
+    def build_cross_vertices(self):
+        """Line vertices of a cross at every hole of every copy, relative to the marker"""
+        data = self.drill_points[self.current_tool]
+        size = data['size'] * 2.5 / 4  # Crosses 2.5x the tool size
+        points = panel.repeat_points(data['points'], self.repeat_offsets)
+        centres = np.zeros((len(points), 1, 3), dtype=np.float32)
+        centres[:, 0, :2] = points
+        return (centres + CROSS_VERTICES * size).reshape(-1, 3)
+
     def display(self, mode_2d=False):
         """Draw the marker(s)"""
         if not self.initialized:
@@ -132,38 +182,19 @@ class MarkerActor:
         glEnd()
         glPopMatrix()
 
-        # Only draw points for current tool
+        # Only draw points for current tool, every copy in one draw call
         if self.current_tool and self.current_tool in self.drill_points:
-            data = self.drill_points[self.current_tool]
-            points = data['points']
-            size = data['size'] * 2.5  # Make crosses 2.5x the tool size
-            
+            if self.cross_vertices is None:
+                self.cross_vertices = self.build_cross_vertices()
+
             glColor4f(0.0, 0.0, 0.0, 1.0)  # Black for drill points
-            
-            for point in points:
-                glPushMatrix()
-                # Calculate absolute position based on marker position
-                abs_pos = [
-                    self.position[0] + point[0],  # Add offset to marker position
-                    self.position[1] + point[1],
-                    self.position[2]
-                ]
-                glTranslatef(*abs_pos)
-                
-                # Draw cross
-                glBegin(GL_LINES)
-                # Horizontal line
-                glVertex3f(-size/4, 0, 0)
-                glVertex3f(size/4, 0, 0)
-                # Vertical line
-                glVertex3f(0, -size/4, 0)
-                glVertex3f(0, size/4, 0)
-                # Vertical line in Z
-                glVertex3f(0, 0, -size/4)
-                glVertex3f(0, 0, size/4)
-                glEnd()
-                
-                glPopMatrix()
+            glPushMatrix()
+            glTranslatef(*self.position)
+            glEnableClientState(GL_VERTEX_ARRAY)
+            glVertexPointer(3, GL_FLOAT, 0, self.cross_vertices.ctypes.data)
+            glDrawArrays(GL_LINES, 0, len(self.cross_vertices))
+            glDisableClientState(GL_VERTEX_ARRAY)
+            glPopMatrix()
 
         glDisable(GL_LINE_SMOOTH)
         glLineWidth(1.0)
@@ -242,28 +273,61 @@ class MarkerActor:
             self.drag_start = pos
             
             if self.parent_viewer:
-                self.parent_viewer.Refresh()
+                self.request_refresh()
             event.Skip(False)  # Don't propagate event if we're handling it
         else:
             event.Skip()
 
+    def detach(self):
+        """Stop handling mouse events, for a marker being removed from the viewer"""
+        self.is_dragging = False
+        if self.parent_viewer:
+            self.refresh_timer.Stop()
+            canvas = self.parent_viewer.glpanel.canvas
+            canvas.Unbind(wx.EVT_LEFT_DOWN, handler=self.on_mouse_down)
+            canvas.Unbind(wx.EVT_LEFT_UP, handler=self.on_mouse_up)
+            canvas.Unbind(wx.EVT_MOTION, handler=self.on_mouse_move)
+
+    def request_refresh(self):
+        """Schedule a redraw, at most one per frame however many events arrive"""
+        if not self.refresh_timer.IsRunning():
+            self.refresh_timer.Start()
+
+    def update_layer_heights(self, model):
+        """Build the per-layer Z table for a newly loaded model"""
+        heights = []
+        for layer in model.gcode.all_layers:
+            z = None
+            # First Z movement in layer
+            for line in layer:
+                if hasattr(line, 'current_z') and line.current_z is not None:
+                    z = line.current_z
+                    break
+            heights.append(z)
+        self.layer_heights = heights
+        self.layer_heights_model = model
+
     def get_current_layer_height(self):
         """Get the z-height of the current layer"""
         if not self.parent_viewer or not self.parent_viewer.model:
             return self.zoffset
             
-        current_layer = self.parent_viewer.model.num_layers_to_draw
-        if not hasattr(self.parent_viewer.model, 'gcode'):
+        model = self.parent_viewer.model
+        current_layer = model.num_layers_to_draw
+        if not hasattr(model, 'gcode'):
             return self.zoffset
             
-        # Find the z-height of the current layer
-        gcode = self.parent_viewer.model.gcode
-        self.last_layer_number = current_layer - 1  # Convert to 0-based index
+        # The table is only rebuilt when the viewer gets a new model
+        if model is not self.layer_heights_model:
+            self.update_layer_heights(model)
+
+        layer = current_layer - 1  # Convert to 0-based index
+        # Lazily loaded G-code only gives the viewer a window of its layers
+        self.last_layer_number = layer + getattr(model.gcode, 'first_layer', 0)
         
-        # Find first Z movement in layer
-        for line in gcode.all_layers[self.last_layer_number]:
-            if hasattr(line, 'current_z') and line.current_z is not None:
-                return line.current_z + self.zoffset
+        z = self.layer_heights[layer]
+        if z is not None:
+            return z + self.zoffset
                 
         return self.zoffset
 
@@ -271,6 +335,7 @@ class MarkerActor:
         """Set the current tool for visualization"""
         if tool_name in self.drill_points:
             self.current_tool = tool_name
+            self.cross_vertices = None
             if self.parent_viewer:
                 self.parent_viewer.Refresh()
 
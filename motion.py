@@ -0,0 +1,215 @@
+import math
+
+import planner
+import timing
+
+DEFAULT_SPEED = 70  # mm/s, F4200, used for any move whose speed the G-code doesn't give
+INJECT_SPEED = 70  # mm/s the filament is pushed into a hole at, part of the process so not sped up
+NORMAL_MODE = 0  # Index of the normal mode in "normal,stealth" machine limits
+
+
+def setting(variables, key, idx=0):
+    """One value of a slicer setting, None if it is missing, nil or 0
+
+    PrusaSlicer uses 0 for "no limit" or "use the machine limit" in the
+    speeds and accelerations read here.
+    """
+    values = planner.parse_tool_values(variables.get(key))
+    value = values[idx] if idx < len(values) else None
+    return value or None
+
+def capped(value, limit):
+    """value, no more than limit if there is one"""
+    if value is None:
+        return limit
+    return min(value, limit) if limit else value
+
+
+class MotionProfile:
+    """Feedrates and accelerations for the moves of an injection block
+
+    Travel runs at the print's travel speed and the tool's own retract
+    speeds, capped by the machine limits in the slicer config. Moves along
+    several axes are slowed so no axis goes faster than its limit, e.g. a
+    hop that lifts Z while crossing XY.
+
+    Attributes:
+        travel_speed: XY travel speed in mm/s
+        z_speed: Z only travel speed in mm/s
+        retract_speed: Retract speed of the tool in mm/s
+        deretract_speed: Un-retract speed of the tool in mm/s
+        max_speeds: Machine feedrate limit in mm/s by axis, 'X', 'Y', 'Z'
+            and 'E', missing where unknown
+        travel_acceleration: M204 T in mm/s^2, None to leave it
+        retract_acceleration: M204 R in mm/s^2, None to leave it
+    """
+
+    def __init__(self, travel_speed=DEFAULT_SPEED, z_speed=DEFAULT_SPEED, retract_speed=DEFAULT_SPEED,
+                 deretract_speed=DEFAULT_SPEED, max_speeds=None, travel_acceleration=None,
+                 retract_acceleration=None):
+        self.travel_speed = travel_speed
+        self.z_speed = z_speed
+        self.retract_speed = retract_speed
+        self.deretract_speed = deretract_speed
+        self.max_speeds = max_speeds or {}
+        self.travel_acceleration = travel_acceleration
+        self.retract_acceleration = retract_acceleration
+
+    @classmethod
+    def from_variables(cls, variables, tool):
+        """Profile for a tool from the slicer settings of a G-code, see injection.read_variables
+
+        Settings that are missing keep the F4200 moves and accelerations
+        the injection used before machine limits were read.
+        """
+        max_speeds = {}
+        for axis in 'XYZE':
+            limit = setting(variables, f'machine_max_feedrate_{axis.lower()}', NORMAL_MODE)
+            if limit:
+                max_speeds[axis] = limit
+
+        travel_speed = setting(variables, 'travel_speed') or DEFAULT_SPEED
+        # 0 uses the machine's Z limit
+        z_speed = setting(variables, 'travel_speed_z') or max_speeds.get('Z', DEFAULT_SPEED)
+        # Filament overrides of the printer's retraction, for the tool's filament
+        retract_speed = (setting(variables, 'filament_retract_speed', tool)
+                         or setting(variables, 'retract_speed', tool) or DEFAULT_SPEED)
+        deretract_speed = (setting(variables, 'filament_deretract_speed', tool)
+                           or setting(variables, 'deretract_speed', tool) or retract_speed)
+
+        # 0 travel acceleration leaves travel at the machine limit
+        travel_limit = setting(variables, 'machine_max_acceleration_travel', NORMAL_MODE)
+        travel_acceleration = capped(setting(variables, 'travel_acceleration'), travel_limit)
+        retract_acceleration = setting(variables, 'machine_max_acceleration_retracting', NORMAL_MODE)
+
+        return cls(travel_speed=travel_speed, z_speed=z_speed, retract_speed=retract_speed,
+                   deretract_speed=deretract_speed, max_speeds=max_speeds,
+                   travel_acceleration=travel_acceleration, retract_acceleration=retract_acceleration)
+
+    def limit(self, speed, deltas):
+        """Fastest speed up to speed in mm/s at which no axis of a move passes its limit
+
+        Args:
+            deltas: Distance moved along each axis by axis letter
+        """
+        length = math.sqrt(sum(delta * delta for axis, delta in deltas.items() if axis in 'XYZ'))
+        if not length:
+            length = abs(deltas.get('E', 0))
+        for axis, delta in deltas.items():
+            axis_limit = self.max_speeds.get(axis)
+            if axis == 'Z' and delta:
+                axis_limit = capped(self.z_speed, axis_limit)
+            if axis_limit and delta:
+                speed = min(speed, axis_limit * length / abs(delta))
+        return speed
+
+    def travel_feedrate(self, start, end):
+        """F in mm/min of a travel between [x, y, z] positions"""
+        deltas = dict(zip('XYZ', (b - a for a, b in zip(start, end))))
+        speed = self.travel_speed if deltas['X'] or deltas['Y'] else self.z_speed
+        return feedrate(self.limit(speed, deltas))
+
+    def extruder_feedrate(self, amount, inject=False):
+        """F in mm/min of a move of the extruder alone, negative amounts retracting
+
+        Args:
+            inject: Whether the move pushes filament into a hole rather
+                than un-retracting
+        """
+        if inject:
+            speed = INJECT_SPEED
+        else:
+            speed = self.retract_speed if amount < 0 else self.deretract_speed
+        return feedrate(self.limit(speed, {'E': amount}))
+
+    def acceleration_commands(self):
+        """M204 setting the accelerations of the block, if any are known"""
+        words = []
+        if self.retract_acceleration:
+            words.append(f"R{self.retract_acceleration:g}")
+        if self.travel_acceleration:
+            words.append(f"T{self.travel_acceleration:g}")
+        return [f"M204 {' '.join(words)}"] if words else []
+
+
+def feedrate(speed):
+    """F in whole mm/min of a speed in mm/s, rounded down so limits are never passed"""
+    # Rounded first so a limit worked out as 9.9999... mm/s still gives F600
+    return int(round(speed * 60, 6))
+
+def state_before(gcode, layer_idx, line_idx):
+    """Accelerations and feedrate in effect before a line of parsed G-code
+
+    Only the M204 and move lines before it are looked at, lazily loaded
+    G-code is searched in its bytes without parsing its layers, so a print
+    that never sets an acceleration isn't parsed back to its start.
+
+    Returns:
+        ({letter: mm/s^2} of the M204 P, R and T last set, F in mm/min or
+        None if no move set one)
+    """
+    if hasattr(gcode, 'lines_before'):
+        offset = gcode.line_offset(layer_idx, line_idx)
+        return (last_accelerations(gcode.lines_before(offset, b'M204')),
+                last_feedrate(gcode.lines_before(offset, b'G')))
+    accelerations = last_accelerations(raw for raw in raw_lines_before(gcode, layer_idx, line_idx)
+                                       if raw.lstrip()[:4].upper() == 'M204')
+    feed = last_feedrate(raw for raw in raw_lines_before(gcode, layer_idx, line_idx)
+                         if raw.lstrip()[:1].upper() == 'G')
+    return accelerations, feed
+
+def raw_lines_before(gcode, layer_idx, line_idx):
+    """Raw lines of parsed G-code before a line, last first"""
+    for idx in range(layer_idx, -1, -1):
+        layer = gcode.all_layers[idx]
+        end = line_idx if idx == layer_idx else len(layer)
+        for n in range(end - 1, -1, -1):
+            yield layer[n].raw
+
+def last_accelerations(lines):
+    """M204 P, R and T in effect after M204 lines given last first"""
+    accelerations = {}
+    for raw in lines:
+        command, params = timing.parse_words(raw)
+        if command != 'M204':
+            continue
+        if 'S' in params:
+            # S sets the printing and travel accelerations at once
+            params.setdefault('P', params['S'])
+            params.setdefault('T', params['S'])
+        for letter in 'PRT':
+            if letter in params:
+                accelerations.setdefault(letter, params[letter])
+        if 'P' in accelerations and 'T' in accelerations:
+            break
+    return accelerations
+
+def last_feedrate(lines):
+    """F of the last G0/G1 setting one in lines given last first, None if none does"""
+    for raw in lines:
+        command, params = timing.parse_words(raw)
+        if command in ('G0', 'G1') and 'F' in params:
+            return params['F']
+    return None
+
+def restore_commands(state, variables):
+    """Commands putting back the motion state from state_before after a block
+
+    Printing and travel accelerations the print never set go back to the
+    slicer's default acceleration, which is what the printer started with.
+    The retract acceleration is only put back if the print set it, the
+    block sets it to the machine limit the slicer configures the printer
+    with.
+    """
+    accelerations, feed = state
+    accelerations = dict(accelerations)
+    default = setting(variables, 'default_acceleration')
+    for letter in 'PT':
+        if letter not in accelerations and default:
+            accelerations[letter] = default
+    commands = []
+    if accelerations:
+        commands.append("M204 " + " ".join(f"{letter}{value:g}" for letter, value in sorted(accelerations.items())))
+    if feed:
+        commands.append(f"G1 F{feed:g}")
+    return commands
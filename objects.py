@@ -0,0 +1,266 @@
+import re
+
+import numpy as np
+
+NO_OBJECT = -1  # Label of everything printed outside an object, M486 S-1
+
+LABEL_RE = re.compile(r'M486\s+S\s*(-?\d+)(?:\s+A\s*"?([^";]*)"?)?', re.IGNORECASE)
+NAME_RE = re.compile(r'M486\s+A\s*"?([^";]*)"?', re.IGNORECASE)
+LABEL_LINE_RE = re.compile(rb'^[ \t]*(M486[^\n]*)', re.MULTILINE | re.IGNORECASE)
+BLANK_LINE_RE = re.compile(rb'^[ \t\r\f\v]*\n', re.MULTILINE)
+
+
+def count_lines(data, start, end):
+    """Lines printrun keeps between two line starts of G-code bytes, it drops blank ones"""
+    text = data[start:end]
+    lines = text.count(b'\n') + (1 if text and not text.endswith(b'\n') else 0)
+    return lines - len(BLANK_LINE_RE.findall(text))
+
+def uses_labels(variables):
+    """Whether the slicer labelled objects with M486, see injection.read_variables"""
+    return variables.get('gcode_label_objects') == 'firmware'
+
+
+class LabelScan:
+    """Follows the M486 label in effect through the layers of a G-code
+
+    Records the label each layer starts with, where it changes and the
+    spans printed under each object in an ObjectIndex.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.label = NO_OBJECT
+        self.span_start = None  # Line the current object's span started at, None outside objects
+
+    def start_layer(self, layer_idx):
+        self.index.start_labels[layer_idx] = self.label
+        self.span_start = 0 if self.label != NO_OBJECT else None
+
+    def command(self, layer_idx, line_idx, raw):
+        """Take an M486 line of a layer into account"""
+        match = LABEL_RE.match(raw)
+        if not match:
+            # M486 A names the object that is current
+            match = NAME_RE.match(raw)
+            if match and self.label != NO_OBJECT:
+                self.index.names[self.label] = match.group(1).strip()
+            return
+        new_label = int(match.group(1))
+        if match.group(2):
+            self.index.names[new_label] = match.group(2).strip()
+        if new_label == self.label:
+            return
+        self.end_span(layer_idx, line_idx)
+        self.label = new_label
+        self.span_start = line_idx + 1 if new_label != NO_OBJECT else None
+        self.index.changes[layer_idx].append((line_idx, new_label))
+
+    def end_span(self, layer_idx, line_idx):
+        """Close the current object's span in a layer before a line"""
+        if self.span_start is not None and line_idx > self.span_start:
+            self.index.spans.setdefault(self.label, []).append((layer_idx, self.span_start, line_idx))
+
+
+class ObjectIndex:
+    """Where each object of a plate labelled with M486 is printed
+
+    PrusaSlicer starts every object's moves with M486 S<id> and ends them
+    with M486 S-1, which is also what the printer's cancel-object feature
+    goes by. The index keeps, for every object, the line ranges of each
+    layer printed under its label and the bounding box of what it extrudes
+    in each layer.
+
+    Attributes:
+        names: Object name by id, from the slicer's M486 A"..." names
+        spans: List of (layer_idx, start_line, end_line) by object id, end
+            exclusive
+        footprints: (xmin, ymin, xmax, ymax) of each object over all layers
+    """
+
+    def __init__(self, layer_count):
+        self.names = {}
+        self.spans = {}
+        self.footprints = {}
+        self.start_labels = [NO_OBJECT] * layer_count  # Label in effect as each layer starts
+        self.changes = [[] for _ in range(layer_count)]  # (line_idx, label) of each label change
+        # One row per object and layer it extrudes in
+        self.box_objects = np.empty(0, dtype=np.int64)
+        self.box_layers = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float64)
+
+    def __bool__(self):
+        return bool(self.spans)
+
+    @classmethod
+    def from_gcode(cls, gcode, check=None):
+        """Index parsed G-code, printrun GCode or LazyGCode, in one pass over its lines
+
+        Args:
+            check: Called after each layer, may raise to stop
+        """
+        # LazyGCode is scanned from its bytes instead of parsing every layer
+        if getattr(gcode, 'extruded_segments', None):
+            return cls.from_bytes(gcode, check)
+
+        layer_count = len(gcode.all_layers)
+        index = cls(layer_count)
+        scan = LabelScan(index)
+        prev = None
+        labels, layers, xs, ys = [], [], [], []
+        for layer_idx, layer in enumerate(gcode.all_layers):
+            scan.start_layer(layer_idx)
+            for line_idx, line in enumerate(layer):
+                if line.raw.lstrip()[:4].upper() == 'M486':
+                    scan.command(layer_idx, line_idx, line.raw.lstrip())
+                    continue
+                if not line.is_move or line.current_x is None or line.current_y is None:
+                    continue
+                pos = (line.current_x, line.current_y)
+                if line.extruding and scan.label != NO_OBJECT:
+                    for x, y in (prev, pos) if prev is not None else (pos,):
+                        labels.append(scan.label)
+                        layers.append(layer_idx)
+                        xs.append(x)
+                        ys.append(y)
+                prev = pos
+            scan.end_span(layer_idx, len(layer))
+            if check:
+                check()
+
+        index.finish(np.array(labels, dtype=np.int64), np.array(layers, dtype=np.int64),
+                     np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64))
+        return index
+
+    @classmethod
+    def from_bytes(cls, gcode, check=None):
+        """Index a LazyGCode from its mapped bytes, without parsing its layers
+
+        Only the M486 lines are decoded, lines are counted the way printrun
+        numbers them and moves are labelled by the last M486 before them.
+        """
+        data = gcode.data
+        index = cls(len(gcode.ranges))
+        scan = LabelScan(index)
+        offsets, offset_labels = [], []
+        for layer_idx, (start, end) in enumerate(gcode.ranges):
+            scan.start_layer(layer_idx)
+            line_idx, pos = 0, start
+            for match in LABEL_LINE_RE.finditer(data, start, end):
+                line_idx += count_lines(data, pos, match.start())
+                pos = match.start()
+                scan.command(layer_idx, line_idx, match.group(1).decode('utf-8', errors='replace').strip())
+                offsets.append(pos)
+                offset_labels.append(scan.label)
+            if scan.span_start is not None:
+                scan.end_span(layer_idx, line_idx + count_lines(data, pos, end))
+            if check:
+                check()
+
+        progress = (lambda idx, count: check()) if check else None
+        layers, starts, ends, moves = gcode.extruded_segments(progress, offsets=True)
+        # Index -1, a move before any M486, picks the NO_OBJECT on the end
+        at = np.searchsorted(np.array(offsets, dtype=np.int64), moves, side='right') - 1
+        labels = np.array(offset_labels + [NO_OBJECT], dtype=np.int64)[at]
+        labelled = labels != NO_OBJECT
+        labels, layers = labels[labelled], layers[labelled]
+        starts, ends = starts[labelled], ends[labelled]
+        index.finish(np.concatenate([labels, labels]), np.concatenate([layers, layers]),
+                     np.concatenate([starts[:, 0], ends[:, 0]]), np.concatenate([starts[:, 1], ends[:, 1]]))
+        return index
+
+    def finish(self, labels, layers, xs, ys):
+        """Complete an index from the labelled extrusion points of its objects"""
+        # Spans of objects that never extrude still count, e.g. ones already cancelled
+        for obj in self.names:
+            self.spans.setdefault(obj, [])
+        self.set_boxes(labels, layers, xs, ys)
+
+    def set_boxes(self, labels, layers, xs, ys):
+        """Reduce the labelled extrusion points to one box per object and layer"""
+        if not len(labels):
+            return
+        keys, inverse = np.unique(labels * len(self.start_labels) + layers, return_inverse=True)
+        boxes = np.empty((len(keys), 4), dtype=np.float64)
+        boxes[:, :2] = np.inf
+        boxes[:, 2:] = -np.inf
+        np.minimum.at(boxes[:, 0], inverse, xs)
+        np.minimum.at(boxes[:, 1], inverse, ys)
+        np.maximum.at(boxes[:, 2], inverse, xs)
+        np.maximum.at(boxes[:, 3], inverse, ys)
+        self.box_objects = keys // len(self.start_labels)
+        self.box_layers = keys % len(self.start_labels)
+        self.boxes = boxes
+        for obj in np.unique(self.box_objects):
+            rows = boxes[self.box_objects == obj]
+            self.footprints[int(obj)] = (float(rows[:, 0].min()), float(rows[:, 1].min()),
+                                         float(rows[:, 2].max()), float(rows[:, 3].max()))
+
+    def label_at(self, layer_idx, line_idx):
+        """Object label in effect just before a line of a layer"""
+        label = self.start_labels[layer_idx]
+        for change_idx, change_label in self.changes[layer_idx]:
+            if change_idx >= line_idx:
+                break
+            label = change_label
+        return label
+
+    def objects_at(self, points, layer_idx=None):
+        """Object under each of a set of points
+
+        Args:
+            points: [x, y] points
+            layer_idx: Layer to look in, None for anywhere in the print
+
+        Returns:
+            Array of the object id under each point, NO_OBJECT where there
+            is none, the smallest box where several overlap
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if layer_idx is None:
+            objs = np.array(list(self.footprints), dtype=np.int64)
+            boxes = np.array(list(self.footprints.values()), dtype=np.float64).reshape(-1, 4)
+        else:
+            rows = self.box_layers == layer_idx
+            objs, boxes = self.box_objects[rows], self.boxes[rows]
+        if not len(objs):
+            return np.full(len(points), NO_OBJECT, dtype=np.int64)
+        x, y = points[:, 0:1], points[:, 1:2]
+        inside = (x >= boxes[:, 0]) & (x <= boxes[:, 2]) & (y >= boxes[:, 1]) & (y <= boxes[:, 3])
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        best = np.argmin(np.where(inside, areas, np.inf), axis=1)
+        return np.where(inside.any(axis=1), objs[best], NO_OBJECT)
+
+    def object_at(self, x, y, layer_idx=None):
+        """Object under a point, None if there is none"""
+        obj = int(self.objects_at([[x, y]], layer_idx)[0])
+        return None if obj == NO_OBJECT else obj
+
+    def find(self, obj):
+        """Object id from an id or (part of) its name
+
+        Raises:
+            ValueError: If no object, or several, match
+        """
+        if isinstance(obj, int) or str(obj).lstrip('-').isdigit():
+            if int(obj) in self.spans:
+                return int(obj)
+            raise ValueError(f"No object {obj} in the G-code")
+        matches = [idx for idx, name in self.names.items() if str(obj) in name]
+        if len(matches) != 1:
+            raise ValueError(f"{len(matches) or 'No'} objects named like \"{obj}\" in the G-code")
+        return matches[0]
+
+    def centre(self, obj):
+        """Centre of an object's footprint
+
+        Raises:
+            ValueError: If the object never extrudes anything
+        """
+        if obj not in self.footprints:
+            raise ValueError(f"Object {self.names.get(obj, obj)} has no printed extent")
+        xmin, ymin, xmax, ymax = self.footprints[obj]
+        return (xmin + xmax) / 2, (ymin + ymax) / 2
+
+    def describe(self, obj):
+        return self.names.get(obj) or f"Object {obj}"
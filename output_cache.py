@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import shutil
+
+from platformdirs import user_cache_dir
+
+import injection
+
+CACHE_DIR = os.path.join(user_cache_dir('printegration'), 'output')
+CACHE_VERSION = 10  # Bump when the generated G-code changes so old results are ignored
+DISK_BUDGET = 2 * 1024 * 1024 * 1024  # Bytes of stored results kept, least recently used go first
+HASH_BLOCK_SIZE = 1 << 20  # Bytes hashed at a time
+
+_digests = {}  # Digest of each file hashed this session by (path, size, mtime)
+
+
+def file_digest(path, progress=None):
+    """Hash of a file's contents, only read again if the file changed
+
+    Args:
+        progress: Called with (bytes read, file size) as the file is read,
+            e.g. a jobs.Job's progress
+    """
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _digests:
+        digest = hashlib.blake2b()
+        done = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+                done += len(block)
+                if progress:
+                    progress(done, stat.st_size)
+        _digests[stamp] = digest.hexdigest()
+    return _digests[stamp]
+
+def profile_fingerprint(profile):
+    """Hash of everything in a printer profile that changes the generated G-code"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(profile.template_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(repr((profile.name, tuple(profile.wipe_offsets), profile.toolchange_retract,
+                        profile.heatup_rate, profile.preheat_margin)).encode())
+    return digest.hexdigest()
+
+def job_key(source_digest, profile, holes, **params):
+    """Cache key of a printegration
+
+    Args:
+        source_digest: file_digest of the G-code before injection
+        profile: PrinterProfile of the G-code
+        holes: [x, y] print coordinates of the holes
+        params: Everything else the result depends on, e.g. the layer and
+            conductive tool, which must have a stable repr
+    """
+    job = {
+        'version': CACHE_VERSION,
+        'source': source_digest,
+        'profile': profile_fingerprint(profile),
+        'injection': (injection.INJECTION_TEMPERATURE, injection.INJECTION_DEPTH),
+        # Holes are rounded like the generated moves, so sub-micron drags still match
+        'holes': [[round(x, 4), round(y, 4)] for x, y in holes],
+        'params': sorted((name, repr(value)) for name, value in params.items()),
+    }
+    return hashlib.blake2b(json.dumps(job, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+def placement_key(source_digest, profile, holes, layer_idx, conductive_tool, layer_height):
+    """job_key of holes placed on a layer, the same for the GUI and batch runs
+
+    Args:
+        layer_idx: Index of the layer the holes are injected at
+        conductive_tool: Tool number of the conductive filament
+        layer_height: Z of the layer, see injection.layer_z
+    """
+    return job_key(source_digest, profile, holes, layer=int(layer_idx), conductive_tool=int(conductive_tool),
+                   layer_height=float(layer_height))
+
+def result_meta(profile, layer_idx, conductive_tool, holes, report):
+    """Metadata stored with a verified result, as batch runs report it
+
+    Args:
+        holes: [x, y] print coordinates of the holes
+        report: verify.verify_splice report of the result
+    """
+    return {'layer': int(layer_idx), 'conductive_tool': int(conductive_tool), 'holes': len(holes),
+            'inserted_lines': report['summary']['lines'] if report['summary'] else 0,
+            'printer': profile.name}
+
+
+class OutputCache:
+    """Printegrated G-code files on disk by job key
+
+    Each result is a <key>.gcode file with an optional <key>.json of
+    metadata. Reading a result touches it, and storing one evicts the
+    least recently used until the cache fits its disk budget. Several
+    processes may share a cache folder.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, budget=DISK_BUDGET):
+        self.cache_dir = cache_dir
+        self.budget = budget
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.gcode")
+
+    def has(self, key):
+        return key is not None and os.path.exists(self.path(key))
+
+    def get(self, key, dest):
+        """Copy a stored result to dest
+
+        Returns:
+            The result's metadata, {} if it has none, or None on a miss
+        """
+        path = self.path(key)
+        try:
+            shutil.copyfile(path, dest)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, f"{key}.json"), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def put(self, key, src, meta=None):
+        """Store a copy of a result, then evict old ones over the budget"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        shutil.copyfile(src, tmp_path)
+        if meta is not None:
+            with open(os.path.join(self.cache_dir, f"{key}.json"), 'w') as f:
+                json.dump(meta, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used results until the rest fit the budget"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.gcode'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue  # Evicted by another process
+            entries.append((stat.st_mtime, stat.st_size, name[:-len('.gcode')]))
+            total += stat.st_size
+        for _, size, key in sorted(entries):
+            if total <= self.budget:
+                break
+            for path in (self.path(key), os.path.join(self.cache_dir, f"{key}.json")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Gone already or still open, e.g. mapped on Windows
+            total -= size
@@ -0,0 +1,82 @@
+import re
+
+import numpy as np
+
+MAX_COPIES = 1000  # Copies of a pattern allowed, more is a typo in the count or pitch
+
+GRID_RE = re.compile(r'(\d+)\s*[xX]\s*(\d+)\s*@\s*([-+]?[\d.]+)\s*,\s*([-+]?[\d.]+)')
+OFFSET_RE = re.compile(r'([-+]?[\d.]+)\s*,\s*([-+]?[\d.]+)')
+
+
+def grid_offsets(columns, rows, pitch_x, pitch_y):
+    """Offsets of a grid of copies from the first one
+
+    Copies go row by row, every other row backwards, so each copy is next
+    to the one injected before it.
+
+    Returns:
+        (columns * rows, 2) array of [x, y] offsets
+    """
+    if columns < 1 or rows < 1:
+        raise ValueError("A grid needs at least one column and one row")
+    offsets = np.empty((rows, columns, 2), dtype=np.float64)
+    offsets[:, :, 0] = np.arange(columns) * pitch_x
+    offsets[:, :, 1] = (np.arange(rows) * pitch_y)[:, None]
+    offsets[1::2] = offsets[1::2, ::-1]
+    return offsets.reshape(-1, 2)
+
+def parse_repeat(text):
+    """Offsets of the copies described by text
+
+    Either a grid, "<columns>x<rows> @ <pitch x>,<pitch y>" e.g. "5x2 @ 40,35",
+    or explicit offsets from the first copy, "<x>,<y>; <x>,<y>; ..." e.g.
+    "0,0; 60,0; 60,45". Empty text is the pattern on its own.
+
+    Raises:
+        ValueError: If the text is neither or makes too many copies
+    """
+    text = text.strip()
+    if not text:
+        return np.zeros((1, 2), dtype=np.float64)
+    match = GRID_RE.fullmatch(text)
+    if match:
+        columns, rows = int(match.group(1)), int(match.group(2))
+        if columns * rows > MAX_COPIES:
+            raise ValueError(f"{columns * rows} copies is more than the {MAX_COPIES} allowed")
+        return grid_offsets(columns, rows, float(match.group(3)), float(match.group(4)))
+    offsets = []
+    for part in text.split(';'):
+        if not part.strip():
+            continue
+        match = OFFSET_RE.fullmatch(part.strip())
+        if not match:
+            raise ValueError(f"Not a grid like \"5x2 @ 40,35\" or offsets like \"0,0; 60,0\": {part.strip()}")
+        offsets.append([float(match.group(1)), float(match.group(2))])
+    return repeat_offsets(offsets)
+
+def repeat_offsets(repeat):
+    """Offsets of the copies from a job spec's 'repeat', parse_repeat text or a list of [x, y]"""
+    if isinstance(repeat, str):
+        return parse_repeat(repeat)
+    offsets = np.asarray(repeat, dtype=np.float64).reshape(-1, 2)
+    if not len(offsets):
+        raise ValueError("No copies given")
+    if len(offsets) > MAX_COPIES:
+        raise ValueError(f"{len(offsets)} copies is more than the {MAX_COPIES} allowed")
+    return offsets
+
+def repeat_points(points, offsets):
+    """Points of a pattern copied to each offset, copy by copy
+
+    Args:
+        points: [x, y, ...] points of one copy, anything past y is dropped
+        offsets: [x, y] offset of each copy
+
+    Returns:
+        (copies * points, 2) array of [x, y] points
+    """
+    if not len(points):
+        return np.empty((0, 2), dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)[:, :2]
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+    return (offsets[:, None, :] + points[None, :, :]).reshape(-1, 2)
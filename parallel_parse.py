@@ -0,0 +1,436 @@
+import datetime
+import math
+import mmap
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from printrun.gcoder import GCode, Layer, Line
+
+LAYER_CHANGE = ';LAYER_CHANGE'  # PrusaSlicer writes this before every layer
+LAYER_MARKER = b'\n' + LAYER_CHANGE.encode()
+Z_COMMENT = ';Z:'  # PrusaSlicer's Z of the layer, right after LAYER_CHANGE
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024  # Smaller files are parsed in-process
+CHUNKS_PER_WORKER = 4
+STATE_TOLERANCE = 1e-4  # mm a chunk's start position may be off by, above printrun's float32 rounding on a bed
+
+# GLine attributes carried back from the workers, raw is always first
+LINE_FIELDS = ('command', 'is_move', 'x', 'y', 'z', 'e', 'f', 'i', 'j',
+               'relative', 'relative_e', 'extruding',
+               'current_x', 'current_y', 'current_z', 'current_tool')
+
+AXIS_RE = re.compile(rb'([XYZ])\s*([-+]?[0-9]*\.?[0-9]+)')
+E_RE = re.compile(rb'E\s*([-+]?[0-9]*\.?[0-9]+)')
+MODE_RE = re.compile(rb'^(G90|G91|G92|M82|M83|T\d+)\b([^;\n]*)', re.MULTILINE)
+# Parser state a chunk must start in to parse as it would in one go, see parse_gcode
+CHUNK_STATE = ('relative', 'relative_e', 'current_tool', 'current_x', 'current_y', 'current_z',
+               'offset_x', 'offset_y', 'offset_z', 'current_e', 'offset_e')
+
+
+def parsed_value(text):
+    """A number as printrun stores it once parsed, a 32 bit float"""
+    return array('f', [float(text)])[0]
+
+def find_layer_boundaries(data):
+    """Byte offsets of the start of every layer change in the file"""
+    boundaries = []
+    pos = data.find(LAYER_MARKER)
+    while pos != -1:
+        boundaries.append(pos + 1)
+        pos = data.find(LAYER_MARKER, pos + 1)
+    return boundaries
+
+def split_chunks(size, boundaries, nchunks):
+    """Group layers into roughly equal sized byte ranges
+
+    Returns:
+        List of (start, end) offsets, always cut at layer boundaries
+    """
+    target = size / nchunks
+    cuts = [0]
+    for offset in boundaries:
+        if offset - cuts[-1] >= target:
+            cuts.append(offset)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def last_position(data, offset):
+    """Find the nozzle position at an offset from the last moves before it
+
+    Only looks back as far as needed to see every axis, which works because
+    PrusaSlicer writes absolute XYZ.
+    """
+    state = {}
+    pos = offset
+    missing = {b'X': 'current_x', b'Y': 'current_y', b'Z': 'current_z'}
+    while missing and pos > 0:
+        start = data.rfind(b'\n', 0, pos - 1) + 1
+        line = data[start:pos].split(b';', 1)[0]
+        if line.startswith((b'G0 ', b'G1 ', b'G2 ', b'G3 ')):
+            for axis, value in AXIS_RE.findall(line):
+                if axis in missing:
+                    state[missing.pop(axis)] = parsed_value(value)
+        pos = start
+    return state
+
+def last_extrusion(data, offset):
+    """E position at an offset in absolute extrusion mode, 0 if nothing set it
+
+    That's the E of the last move or G92 to give one, printrun only
+    compares the E of the next move with it to tell if it extrudes.
+    """
+    pos = offset
+    while pos > 0:
+        start = data.rfind(b'\n', 0, pos - 1) + 1
+        line = data[start:pos].split(b';', 1)[0]
+        if line.startswith((b'G0 ', b'G1 ', b'G2 ', b'G3 ', b'G92 ')):
+            match = E_RE.search(line)
+            if match:
+                return parsed_value(match.group(1))
+        pos = start
+    return 0.0
+
+def initial_states(data, offsets):
+    """Work out the parser state at each chunk start without parsing up to it
+
+    One regex pass over the file finds every mode and tool change and G92,
+    the state at an offset is then whatever was last set before it. The
+    position is taken from the last moves before the offset, which assumes
+    absolute XYZ, see parse_gcode for what happens when that is wrong.
+
+    Args:
+        data: File contents (bytes or mmap)
+        offsets: Chunk start offsets in increasing order
+
+    Returns:
+        List of state dicts to apply to a GCode before parsing each chunk
+    """
+    changes = MODE_RE.finditer(data)
+    relative = relative_e = False
+    tool = 0
+    offsets_xyz = {'x': 0.0, 'y': 0.0, 'z': 0.0}
+    states = []
+    change = next(changes, None)
+    for offset in offsets:
+        while change is not None and change.start() < offset:
+            token = change.group(1)
+            if token == b'G90':
+                relative = relative_e = False
+            elif token == b'G91':
+                relative = relative_e = True
+            elif token == b'G92':
+                # printrun keeps the position and offsets the coordinates that follow
+                position = last_position(data, change.start())
+                for axis, value in AXIS_RE.findall(change.group(2)):
+                    axis = axis.decode().lower()
+                    current = position.get(f'current_{axis}', 0.0) + offsets_xyz[axis]
+                    offsets_xyz[axis] = current - parsed_value(value)
+            elif token == b'M82':
+                relative_e = False
+            elif token == b'M83':
+                relative_e = True
+            else:
+                tool = int(token[1:])
+            change = next(changes, None)
+        if offset == 0:
+            states.append({})
+            continue
+        state = {'relative': relative, 'relative_e': relative_e, 'current_tool': tool}
+        for name, value in last_position(data, offset).items():
+            state[name] = value + offsets_xyz[name[-1]]
+        for axis, value in offsets_xyz.items():
+            state[f'offset_{axis}'] = value
+        if not relative_e:
+            state['current_e'] = last_extrusion(data, offset)
+        states.append(state)
+    return states
+
+def find_blank_lines(lines):
+    """Lines printrun drops when parsing, so they can be written back out
+
+    Returns:
+        Dict of the blank raw lines, ending in newlines, by the index of
+        the parsed line they come before
+    """
+    blanks = {}
+    count = 0
+    for raw in lines:
+        if raw.strip():
+            count += 1
+        else:
+            blanks.setdefault(count, []).append(raw.rstrip("\r\n") + "\n")
+    return blanks
+
+def slicer_layers(layers, keep_first=True):
+    """Regroup printrun's layers into one layer per LAYER_CHANGE
+
+    printrun starts a layer wherever Z changes after extruding, so where a
+    layer starts depends on the Z hops around it and on where parsing
+    started. The slicer's markers don't, which keeps layer indices the same
+    for a file parsed in one go, in chunks or lazily a layer at a time.
+    Lines before the first marker are layer 0.
+
+    Args:
+        layers: printrun Layers, without the empty append layer
+        keep_first: Whether to keep the lines before the first marker as a
+            layer even when there are none, False for a chunk that starts
+            at a marker
+
+    Returns:
+        List of Layers, each marker starting one
+    """
+    groups = [[]]
+    durations = [0]
+    for layer in layers:
+        # A layer's time goes to the slicer layer it starts in
+        durations[-1] += layer.duration
+        for line in layer:
+            if line.raw.startswith(LAYER_CHANGE):
+                groups.append([])
+                durations.append(0)
+            groups[-1].append(line)
+    if not keep_first and not groups[0]:
+        groups, durations = groups[1:], durations[1:]
+
+    result = []
+    for lines, duration in zip(groups, durations):
+        z = None
+        for line in lines[1:4]:
+            if line.raw.startswith(Z_COMMENT):
+                try:
+                    z = float(line.raw[len(Z_COMMENT):])
+                except ValueError:
+                    pass
+                break
+        if z is None and lines:
+            z = lines[-1].current_z
+        layer = Layer(lines, z)
+        layer.duration = duration
+        result.append(layer)
+    return result
+
+def has_layer_changes(gcode):
+    return any(line.raw.startswith(LAYER_CHANGE) for line in gcode.lines)
+
+def parse_lines(lines):
+    """Parse raw lines with printrun, keeping their blank lines as blank_lines
+
+    Layers are split at the slicer's layer changes, see slicer_layers,
+    G-code without them keeps printrun's layers.
+    """
+    gcode = GCode(lines)
+    if has_layer_changes(gcode):
+        set_layers(gcode, slicer_layers(gcode.all_layers[:-1]))
+    gcode.blank_lines = find_blank_lines(lines)
+    return gcode
+
+def parse_text(text, state):
+    """Parse a piece of G-code starting from a known parser state
+
+    Returns:
+        printrun GCode of just that piece
+    """
+    gcode = GCode(deferred=True)
+    tool = state.get('current_tool', 0)
+    gcode.current_e_multi = [0] * (tool + 1)
+    gcode.offset_e_multi = [0] * (tool + 1)
+    gcode.total_e_multi = [0] * (tool + 1)
+    gcode.max_e_multi = [0] * (tool + 1)
+    for name, value in state.items():
+        setattr(gcode, name, value)
+    gcode.prepare(text.splitlines())
+    return gcode
+
+def end_state(gcode):
+    """Parser state at the end of a parsed piece, to continue from"""
+    return {name: getattr(gcode, name) for name in CHUNK_STATE}
+
+def parse_chunk(path, start, end, state):
+    """Parse a byte range of a G-code file in a worker process
+
+    The range starts at a layer change, or the start of the file.
+
+    Returns:
+        Dict with the chunk's layers as plain tuples and its summary values
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8', errors='replace')
+    gcode = parse_text(text, state)
+    line_count = 0
+
+    layers = []
+    # The last layer is printrun's empty append layer
+    for layer in slicer_layers(gcode.all_layers[:-1], keep_first=start == 0):
+        lines = [(line.raw,) + tuple(getattr(line, name) for name in LINE_FIELDS)
+                 for line in layer]
+        layers.append((layer.z, layer.duration, lines))
+        line_count += len(lines)
+
+    return {
+        'layers': layers,
+        'line_count': line_count,
+        'blank_lines': find_blank_lines(text.splitlines()),
+        'bounds': (gcode.xmin, gcode.xmax, gcode.ymin, gcode.ymax),
+        'filament_length': gcode.filament_length,
+        'filament_length_multi': list(gcode.filament_length_multi),
+        'start_state': state,
+        'end_state': end_state(gcode),
+    }
+
+def build_line(values):
+    """Rebuild a printrun line from the values a worker sent back"""
+    line = Line(values[0])
+    for name, value in zip(LINE_FIELDS, values[1:]):
+        if value is not None:
+            setattr(line, name, value)
+    return line
+
+def build_gcode(layers):
+    """Put already parsed layers together into one GCode object
+
+    Sets up the line and layer indexes and Z range the way a sequential
+    parse would, bounds and totals are left to the caller.
+    """
+    gcode = GCode(deferred=True)
+    gcode.lines = []
+    for layer in layers:
+        gcode.lines.extend(layer)
+    set_layers(gcode, layers)
+    return gcode
+
+def set_layers(gcode, layers):
+    """Replace a GCode's layers and indexes, its lines stay as they are
+
+    Args:
+        layers: Layers holding all of gcode.lines in order, without the
+            empty append layer
+    """
+    gcode.all_layers = all_layers = []
+    gcode.all_zs = set()
+    layer_idxs = array('I')
+    line_idxs = array('I')
+
+    for layer in layers:
+        layer_id = len(all_layers)
+        all_layers.append(layer)
+        gcode.all_zs.add(layer.z)
+        layer_idxs.extend([layer_id] * len(layer))
+        line_idxs.extend(range(len(layer)))
+
+    gcode.layer_idxs = layer_idxs
+    gcode.line_idxs = line_idxs
+    gcode.append_layer_id = len(all_layers)
+    gcode.append_layer = Layer([])
+    gcode.append_layer.duration = 0
+    all_layers.append(gcode.append_layer)
+
+    all_zs = gcode.all_zs.union({0}).difference({None})
+    gcode.zmin = min(all_zs)
+    gcode.zmax = max(all_zs)
+    gcode.height = gcode.zmax - gcode.zmin
+    return gcode
+
+def merge_chunks(results):
+    """Merge parsed chunks into one GCode object like a sequential parse"""
+    layers = []
+    blank_lines = {}
+    total_duration = 0
+    first = 0
+    for result in results:
+        for idx, blanks in result['blank_lines'].items():
+            blank_lines.setdefault(first + idx, []).extend(blanks)
+        first += result['line_count']
+        for z, duration, values in result['layers']:
+            layer = Layer([build_line(v) for v in values], z)
+            layer.duration = duration
+            total_duration += duration
+            layers.append(layer)
+    gcode = build_gcode(layers)
+    gcode.blank_lines = blank_lines
+
+    # Bounding box of the chunks that actually print something
+    printing = [r for r in results if r['filament_length'] > 0] or results
+    gcode.xmin = min(r['bounds'][0] for r in printing)
+    gcode.xmax = max(r['bounds'][1] for r in printing)
+    gcode.ymin = min(r['bounds'][2] for r in printing)
+    gcode.ymax = max(r['bounds'][3] for r in printing)
+    gcode.width = gcode.xmax - gcode.xmin
+    gcode.depth = gcode.ymax - gcode.ymin
+
+    gcode.filament_length = gcode.max_e = sum(r['filament_length'] for r in results)
+    multi = []
+    for r in results:
+        for tool, length in enumerate(r['filament_length_multi']):
+            if tool >= len(multi):
+                multi.append(0)
+            multi[tool] += length
+    gcode.filament_length_multi = multi
+    gcode.duration = datetime.timedelta(seconds=int(total_duration))
+
+    for name, value in results[-1]['end_state'].items():
+        setattr(gcode, name, value)
+    return gcode
+
+def parse_gcode(path, workers=None):
+    """Parse a G-code file, split across processes at layer boundaries
+
+    Files under PARALLEL_MIN_BYTES, or without layer change markers, are
+    parsed in-process. Either way the layers and their indices are the
+    same, see slicer_layers.
+
+    Returns:
+        printrun GCode
+    """
+    size = os.path.getsize(path)
+    workers = workers or os.cpu_count() or 1
+    if size < PARALLEL_MIN_BYTES or workers < 2:
+        with open(path) as f:
+            return parse_lines([line for line in f])
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            boundaries = find_layer_boundaries(data)
+            if not boundaries:
+                return parse_lines([line.decode('utf-8', errors='replace') for line in iter(data.readline, b'')])
+            chunks = split_chunks(size, boundaries, workers * CHUNKS_PER_WORKER)
+            # Cheap prefix pass for the state each chunk starts in
+            states = initial_states(data, [start for start, _ in chunks])
+
+    print(f"Parsing G-code in {len(chunks)} chunks on {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(parse_chunk, [path] * len(chunks),
+                                [start for start, _ in chunks],
+                                [end for _, end in chunks],
+                                states))
+
+    # A chunk that started from the wrong state, e.g. after relative moves
+    # the prefix pass can't follow, is parsed again from where the one
+    # before it really ended
+    for idx in range(1, len(chunks)):
+        if not same_state(results[idx]['start_state'], results[idx - 1]['end_state']):
+            print(f"Parsing chunk {idx} again from the state the chunk before it ended in")
+            results[idx] = parse_chunk(path, *chunks[idx], results[idx - 1]['end_state'])
+    return merge_chunks(results)
+
+def same_state(state, actual):
+    """Whether a chunk's start state matches the end state of the chunk before it
+
+    printrun keeps coordinates as 32 bit floats, so positions only need to
+    agree to within STATE_TOLERANCE.
+    """
+    for name in CHUNK_STATE:
+        if name in ('current_e', 'offset_e'):
+            continue
+        value = state.get(name, getattr(GCode, name))
+        if value is None or actual[name] is None:
+            if value is not actual[name]:
+                return False
+        elif not math.isclose(value, actual[name], rel_tol=0, abs_tol=STATE_TOLERANCE):
+            return False
+    # Only absolute extrusion compares the E of a move with the E before it
+    if actual['relative_e']:
+        return True
+    e = state.get('current_e', 0) - state.get('offset_e', 0)
+    return math.isclose(e, actual['current_e'] - actual['offset_e'], rel_tol=0, abs_tol=STATE_TOLERANCE)
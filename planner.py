@@ -0,0 +1,230 @@
+import timing
+
+TOOLCHANGE_END_MARKER = '; CP TOOLCHANGE END'
+AMBIENT_TEMPERATURE = 25  # Assumed when the slicer has no idle temperature for a tool
+
+
+def find_toolchanges(layer):
+    """Find the tool changes in a layer
+
+    Returns:
+        List of (line index, tool number) in layer order
+    """
+    toolchanges = []
+    for idx, line in enumerate(layer):
+        command = getattr(line, 'command', None)
+        if command and command.startswith('T'):
+            try:
+                toolchanges.append((idx, int(command[1:])))
+            except ValueError:
+                continue
+    return toolchanges
+
+def find_toolchange_insertion(layer, tool):
+    """Find where injection can reuse an existing change to a tool
+
+    The injection goes after the end of the slicer's toolchange block (once
+    the tool is heated and wiped), or straight after the T command if the
+    block has no end marker before the next tool change.
+
+    Returns:
+        Line index in the layer to insert at, or None if the layer never
+        changes to the tool
+    """
+    toolchanges = find_toolchanges(layer)
+    for n, (idx, to_tool) in enumerate(toolchanges):
+        if to_tool != tool:
+            continue
+        next_change = toolchanges[n + 1][0] if n + 1 < len(toolchanges) else len(layer)
+        for end_idx in range(idx + 1, next_change):
+            if layer[end_idx].raw.startswith(TOOLCHANGE_END_MARKER):
+                return end_idx + 1
+        return idx + 1
+    return None
+
+def position_before(layer, line_idx):
+    """Get the nozzle position just before a line of the layer
+
+    Returns:
+        [x, y, z] of the last line with a known position, or None
+    """
+    for line in reversed(layer[:line_idx]):
+        if getattr(line, 'current_x', None) is not None:
+            return [line.current_x, line.current_y, line.current_z]
+    return None
+
+def parse_tool_values(value):
+    """Parse a per-tool slicer setting like "70,70,nil,70,70" into floats (None for nil)"""
+    values = []
+    for item in (value or '').split(','):
+        try:
+            values.append(float(item))
+        except ValueError:
+            values.append(None)
+    return values
+
+def heatup_time(target_temp, start_temp, heatup_rate, margin=0):
+    """Seconds needed to heat a tool from start_temp to target_temp"""
+    if start_temp is None:
+        start_temp = AMBIENT_TEMPERATURE
+    return max(0, target_temp - start_temp) / heatup_rate + margin
+
+def touches_tool_temp(line, tool, active=False):
+    """Check if a line changes to a tool or sets its temperature
+
+    Args:
+        active: Whether the tool is the active one at the line, so that a
+            temperature set without a T is its own
+    """
+    command, params = timing.parse_words(line.raw)
+    if command == f"T{tool}":
+        return True
+    if command not in ('M104', 'M109'):
+        return False
+    return params.get('T') == tool or (active and 'T' not in params)
+
+def find_preheat_point(gcode, layer_idx, line_idx, tool, lead_time, active=False):
+    """Find where to start heating a tool so it is hot by a given point
+
+    Walks back from (layer_idx, line_idx) through the estimated move times
+    of the preceding G-code until lead_time seconds are covered. The search
+    stops at the last line that used the tool or set its temperature, since
+    a preheat before that would be overridden.
+
+    Args:
+        active: Whether the tool is already the active one at (layer_idx,
+            line_idx), e.g. after the slicer's own change to it
+
+    Returns:
+        (layer_idx, line_idx) to insert the preheat command before
+    """
+    # Only estimate a window of layers that printrun reckons covers the lead time
+    window_layer = layer_idx
+    covered = 0
+    while window_layer > 0 and covered < lead_time:
+        window_layer -= 1
+        covered += gcode.all_layers[window_layer].duration
+    window_layer = max(0, window_layer - 1)
+
+    # Layers are walked directly so lazily loaded G-code only parses the window
+    window = []
+    positions = []  # (layer_idx, line_idx) of each window line
+    for idx in range(window_layer, layer_idx + 1):
+        layer = gcode.all_layers[idx]
+        count = line_idx if idx == layer_idx else len(layer)
+        window.extend(layer[:count])
+        positions.extend((idx, n) for n in range(count))
+    durations = timing.estimate_gline_durations(window)
+
+    idx = len(window)
+    elapsed = 0
+    while idx > 0 and elapsed < lead_time:
+        if touches_tool_temp(window[idx - 1], tool, active):
+            break
+        # Before a change to another tool the temperatures set without a T aren't this tool's
+        if active and window[idx - 1].raw.startswith('T'):
+            active = False
+        idx -= 1
+        elapsed += durations[idx]
+
+    if idx >= len(window):
+        return layer_idx, line_idx
+    return positions[idx]
+
+def find_block_preheat_index(durations, lead_time, earliest=0):
+    """Find where to put a preheat in a generated block so it is hot by the end
+
+    Returns:
+        Index into the block to insert before, never earlier than earliest
+    """
+    idx = len(durations)
+    elapsed = 0
+    while idx > earliest and elapsed < lead_time:
+        idx -= 1
+        elapsed += durations[idx]
+    return idx
+
+def raw_lines(gcode, layer_idx, first=0):
+    """Raw lines of a layer ending in newlines, with the file's blank lines
+
+    printrun drops blank lines when parsing, parsed G-code has them in
+    blank_lines, see parallel_parse.parse_lines. Lazily loaded G-code is
+    read straight from its bytes without parsing.
+
+    Args:
+        first: Index of the layer's first line in the parsed G-code
+
+    Returns:
+        (lines, starts) with the index in lines of each parsed line of the
+        layer
+    """
+    if hasattr(gcode, 'raw_lines'):
+        lines = gcode.raw_lines(layer_idx)
+        return lines, [n for n, line in enumerate(lines) if line.strip()]
+    blanks = getattr(gcode, 'blank_lines', {})
+    layer = gcode.all_layers[layer_idx]
+    lines, starts = [], []
+    for n, line in enumerate(layer):
+        lines.extend(blanks.get(first + n, ()))
+        starts.append(len(lines))
+        lines.append(line.raw + "\n")
+    if layer_idx == len(gcode.all_layers) - 1:
+        # Blank lines at the end of the file
+        lines.extend(blanks.get(first + len(layer), ()))
+    return lines, starts
+
+def splice_runs(gcode, insertions, progress=None):
+    """Runs of raw lines of G-code with commands inserted into its layers
+
+    Yields:
+        (lines, inserted) in file order, see splice_lines for the arguments
+    """
+    by_layer = {}
+    for layer_idx, line_idx, commands in insertions:
+        inserted = [c.strip() + "\n" for c in commands if c.strip()]
+        by_layer.setdefault(layer_idx, []).append((line_idx, inserted))
+
+    layer_count = len(gcode.all_layers)
+    first = 0
+    for idx in range(layer_count):
+        if progress:
+            progress(idx, layer_count)
+        lines, starts = raw_lines(gcode, idx, first)
+        first += len(starts)
+        if idx not in by_layer:
+            yield lines, False
+            continue
+        last = 0
+        for line_idx, inserted in sorted(by_layer[idx], key=lambda item: item[0]):
+            # Blank lines before the line stay before the inserted commands
+            pos = starts[line_idx] if line_idx < len(starts) else len(lines)
+            yield lines[last:pos], False
+            yield inserted, True
+            last = pos
+        yield lines[last:], False
+
+def iter_splice(gcode, insertions, progress=None):
+    """Spliced raw lines one at a time, see splice_lines
+
+    The slicer's M73 progress markers are retimed for the estimated
+    duration of the inserted commands.
+    """
+    inserted_seconds = sum(timing.estimate_block_duration([c for c in commands if c.strip()], None)
+                           for _, _, commands in insertions)
+    return timing.retime_progress(splice_runs(gcode, insertions, progress), inserted_seconds)
+
+def splice_lines(gcode, insertions, progress=None):
+    """Serialise G-code with commands inserted into its layers
+
+    Args:
+        gcode: Parsed printrun GCode or LazyGCode
+        insertions: List of (layer_idx, line_idx, commands), the commands
+            are inserted before that line of the layer. Insertions at the
+            same line keep their order
+        progress: Called with (layers done, layer count) after each layer
+
+    Returns:
+        List of raw G-code lines ending in newlines, with M73 progress
+        markers retimed as by iter_splice
+    """
+    return list(iter_splice(gcode, insertions, progress))
@@ -0,0 +1,161 @@
+import numpy as np
+
+CELL_SIZE = 0.5  # mm per occupancy cell under the board
+FOOTPRINT_MARGIN = 1.0  # mm around the outermost holes taken to be under the board
+VOID_MAX = 0.05  # A layer with at most this much of the footprint printed is open
+FILLED_MIN = 0.5  # A layer with at least this much printed covers the board
+
+
+def footprint_of(holes, margin=FOOTPRINT_MARGIN):
+    """Rectangle (xmin, ymin, xmax, ymax) under a drill pattern"""
+    holes = np.asarray(holes, dtype=np.float64).reshape(-1, 2)
+    xmin, ymin = holes.min(axis=0) - margin
+    xmax, ymax = holes.max(axis=0) + margin
+    return float(xmin), float(ymin), float(xmax), float(ymax)
+
+def layer_segments(gcode, progress=None):
+    """Extruded XY segments of every layer
+
+    Args:
+        progress: Called with (layer index, layer count) as layers are read,
+            e.g. a jobs.Job's progress
+
+    Returns:
+        (layers, starts, ends) arrays with the layer index of each segment
+    """
+    # LazyGCode reads them from its bytes instead of parsing every layer
+    extruded_segments = getattr(gcode, 'extruded_segments', None)
+    if extruded_segments:
+        return extruded_segments(progress)
+
+    layers, starts, ends = [], [], []
+    prev = None
+    n_layers = len(gcode.all_layers)
+    for idx, layer in enumerate(gcode.all_layers):
+        if progress:
+            progress(idx, n_layers)
+        for line in layer:
+            if not line.is_move or line.current_x is None or line.current_y is None:
+                continue
+            pos = (line.current_x, line.current_y)
+            if line.extruding and prev is not None:
+                layers.append(idx)
+                starts.append(prev)
+                ends.append(pos)
+            prev = pos
+    return (np.array(layers, dtype=np.int64),
+            np.array(starts, dtype=np.float64).reshape(-1, 2),
+            np.array(ends, dtype=np.float64).reshape(-1, 2))
+
+def layer_occupancy(segments, n_layers, footprint, cell_size=CELL_SIZE):
+    """Fraction of the footprint printed in each layer, all layers at once
+
+    The footprint is split into cells and every extruded segment is sampled
+    twice per cell, marking the cells it passes through in a
+    (layer, y, x) grid.
+
+    Args:
+        segments: (layers, starts, ends) from layer_segments
+        n_layers: Number of layers of the G-code
+
+    Returns:
+        Array of the occupied fraction of each layer
+    """
+    x0, y0, x1, y1 = footprint
+    nx = max(1, int(np.ceil((x1 - x0) / cell_size)))
+    ny = max(1, int(np.ceil((y1 - y0) / cell_size)))
+    layers, starts, ends = segments
+
+    # Only segments crossing the footprint
+    lo = np.minimum(starts, ends)
+    hi = np.maximum(starts, ends)
+    keep = (hi[:, 0] >= x0) & (lo[:, 0] <= x1) & (hi[:, 1] >= y0) & (lo[:, 1] <= y1)
+    layers, starts, ends = layers[keep], starts[keep], ends[keep]
+
+    occupied = np.zeros((n_layers, ny, nx), dtype=bool)
+    if len(layers):
+        lengths = np.hypot(*(ends - starts).T)
+        counts = np.maximum(1, np.ceil(lengths / (cell_size / 2))).astype(np.int64) + 1
+        seg = np.repeat(np.arange(len(starts)), counts)
+        offsets = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+        t = offsets / np.repeat(counts - 1, counts)
+        points = starts[seg] + (ends[seg] - starts[seg]) * t[:, None]
+        ix = np.floor((points[:, 0] - x0) / cell_size).astype(np.int64)
+        iy = np.floor((points[:, 1] - y0) / cell_size).astype(np.int64)
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        occupied[layers[seg[inside]], iy[inside], ix[inside]] = True
+    return occupied.mean(axis=(1, 2))
+
+def find_pocket_layer(gcode, boards, zs=None, progress=None):
+    """Recommend the layer to insert PCBs at, where their pockets close
+
+    A pocket is a run of open layers under a board followed by a layer
+    that covers it. The PCBs go in before that covering layer is printed,
+    all at once, so every board's pocket has to be open below it and
+    covered by it. If there are several, the deepest is taken, the highest
+    of equals. Each board is looked at under its own footprint, one box
+    around boards placed apart would take in the print between them.
+
+    Args:
+        gcode: printrun GCode or LazyGCode
+        boards: [x, y] print coordinates of the holes of each board, e.g.
+            each copy of each placed pattern
+        zs: Z of each layer, taken from the G-code if not given
+        progress: Called with (layer index, layer count) as layers are read
+
+    Returns:
+        Dict with the covering 'layer' (None if no pocket was found), the
+        pocket 'depth' in mm, the 'footprints' of the boards, and the
+        'occupancy' and printed 'area' in mm² of each layer under each
+        footprint, as (board, layer) arrays
+    """
+    footprints = [footprint_of(holes) for holes in boards if len(holes)]
+    n_layers = len(gcode.all_layers)
+    segments = layer_segments(gcode, progress)
+    occupancy = np.array([layer_occupancy(segments, n_layers, footprint) for footprint in footprints],
+                         dtype=np.float64).reshape(len(footprints), n_layers)
+    sizes = np.array([(x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in footprints], dtype=np.float64)
+    result = {'layer': None, 'depth': 0.0, 'footprints': footprints, 'occupancy': occupancy,
+              'area': occupancy * sizes[:, None]}
+    if not footprints or n_layers < 2:
+        return result
+
+    if zs is None:
+        # LazyGCode knows its layer heights without parsing the layers again
+        zs = getattr(gcode, 'zs', None) or [layer.z for layer in gcode.all_layers]
+    zs = np.array([np.nan if z is None else z for z in zs], dtype=np.float64)
+
+    # Open where no board has anything printed under it, covering where every board is covered
+    open_layers = occupancy.max(axis=0) <= VOID_MAX
+    covered = occupancy.min(axis=0) >= FILLED_MIN
+    idx = np.arange(n_layers)
+    # The layer each open run starts above
+    last_closed = np.maximum.accumulate(np.where(open_layers, -1, idx))
+    covers = np.flatnonzero(open_layers[:-1] & covered[1:]) + 1
+    # A pocket needs a printed floor under it
+    covers = covers[last_closed[covers - 1] >= 0]
+    if not len(covers):
+        return result
+
+    depths = zs[covers - 1] - zs[last_closed[covers - 1]]
+    depths = np.nan_to_num(depths, nan=0.0)
+    best = len(covers) - 1 - int(np.argmax(depths[::-1]))
+    result['layer'] = int(covers[best])
+    result['depth'] = round(float(depths[best]), 4)
+    return result
+
+def resolve_layer(gcode, boards, layer):
+    """Layer index from a number or "auto" for the recommended layer
+
+    Args:
+        boards: Holes of each board, see find_pocket_layer
+
+    Raises:
+        ValueError: If "auto" finds no pocket under the holes
+    """
+    if layer != "auto":
+        return int(layer)
+    found = find_pocket_layer(gcode, boards)
+    if found['layer'] is None:
+        raise ValueError("No pocket found under the drill holes")
+    return found['layer']
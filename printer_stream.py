@@ -0,0 +1,199 @@
+import threading
+import time
+
+from printrun.printcore import printcore
+from printrun.gcoder import Line
+
+SEND_WINDOW = 4  # Lines sent ahead of acknowledgements, Marlin's default command buffer
+DEFAULT_BAUD = 115200
+CONNECT_TIMEOUT = 10  # Seconds to wait for the printer to answer
+PAUSE_COMMAND = 'M601'  # Injected before the holes, the PCB is placed while paused
+
+
+def command_of(raw):
+    """G-code command of a raw line without comments, e.g. "M601" """
+    words = raw.split(';', 1)[0].split()
+    return words[0].upper() if words else None
+
+
+class WindowedPrintcore(printcore):
+    """printcore that keeps several lines in flight instead of one
+
+    printcore sends a line, clears its `clear` flag and waits for the next
+    "ok" to set it again. Here `clear` counts instead: clearing it takes a
+    slot in the send window and setting it frees one, so printcore's own
+    send loop, resend handling and callbacks run unchanged with up to
+    `window` unacknowledged lines.
+
+    When the firmware asks for a resend it drops every line after the bad
+    one, so the window is emptied and lines are resent one at a time until
+    the resend has caught up.
+    """
+
+    def __init__(self, window=SEND_WINDOW):
+        self.window = window
+        self.in_flight = 0
+        self.recovering = False
+        self.window_lock = threading.Lock()
+        super().__init__()
+        self.in_flight = 0
+
+    @property
+    def clear(self):
+        limit = 1 if self.recovering else self.window
+        return self.in_flight < limit
+
+    @clear.setter
+    def clear(self, value):
+        with self.window_lock:
+            if value:
+                self.in_flight = max(0, self.in_flight - 1)
+                if self.recovering and self.in_flight == 0 and self.resendfrom == -1:
+                    self.recovering = False
+            else:
+                self.in_flight += 1
+
+    def _readline(self):
+        line = super()._readline()
+        if line and (line.lower().startswith("resend") or line.startswith("rs")):
+            with self.window_lock:
+                self.in_flight = 0
+                self.recovering = True
+        return line
+
+
+class LineQueue:
+    """The parts of a printrun GCode that printcore streams from, over raw lines
+
+    Lines are only wrapped for printcore as they are sent, so G-code that
+    was spliced or lazily loaded doesn't have to be parsed again to print.
+    """
+
+    def __init__(self, lines):
+        self.lines = [line.rstrip("\r\n") for line in lines]
+        self.all_layers = [self]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, idx):
+        return Line(self.lines[idx])
+
+    def has_index(self, idx):
+        return idx < len(self.lines)
+
+    def idxs(self, idx):
+        return 0, idx
+
+    def append(self, command):
+        """Commands sent while printing are queued after the file"""
+        self.lines.append(command)
+        return Line(command)
+
+
+class PrinterStream:
+    """Stream G-code to a printer over serial
+
+    At each M601 the lines before it are allowed to finish, then sending
+    waits in place for resume() instead of pausing the printer, so nothing
+    moves while the PCB is placed. The M601 itself is not sent.
+
+    Callbacks run on printcore's threads:
+        on_progress(sent, total): After each line of the file is sent
+        on_pause(index): Waiting at the M601 at index, until resume()
+        on_done(): The whole file was sent, or cancelled if `cancelled` is set
+        on_error(message): printcore reported an error
+    """
+
+    def __init__(self, port, baud=DEFAULT_BAUD, window=SEND_WINDOW,
+                 on_progress=None, on_pause=None, on_done=None, on_error=None):
+        self.port = port
+        self.baud = baud
+        self.on_progress = on_progress
+        self.on_pause = on_pause
+        self.on_done = on_done
+        self.on_error = on_error
+        self.total = 0
+        self.paused = False
+        self.cancelled = False
+        self.pause_pending = False
+        self.online = threading.Event()
+        self.resume_event = threading.Event()
+
+        self.core = WindowedPrintcore(window)
+        self.core.onlinecb = self.online.set
+        self.core.preprintsendcb = self.before_send
+        self.core.printsendcb = self.after_send
+        self.core.endcb = self.finished
+        self.core.errorcb = self.error
+
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        """Open the port and wait for the printer to answer
+
+        Raises:
+            ConnectionError: If the printer doesn't answer within timeout
+        """
+        self.core.connect(self.port, self.baud)
+        if not self.core.printer:
+            raise ConnectionError(f"Could not open {self.port}")
+        if not self.online.wait(timeout):
+            self.core.disconnect()
+            raise ConnectionError(f"No answer from a printer on {self.port}")
+
+    def disconnect(self):
+        self.core.disconnect()
+
+    def start(self, lines):
+        """Start streaming G-code lines, returning once sending has begun"""
+        self.total = len(lines)
+        self.cancelled = False
+        self.resume_event.clear()
+        if not self.core.startprint(LineQueue(lines)):
+            raise ConnectionError("The printer is offline or already printing")
+
+    def before_send(self, gline, next_gline):
+        # Lines queued before the M601 must be done before it's safe to pause.
+        # printcore has already taken a window slot for this line
+        if self.pause_pending:
+            self.pause_pending = False
+            while self.core.in_flight > 1 and self.core.printing and not self.cancelled:
+                time.sleep(0.01)
+            self.wait_for_resume()
+        if command_of(gline.raw) == PAUSE_COMMAND:
+            # Wait for the moves before it to complete, then pause before the next line
+            self.pause_pending = True
+            return Line("M400")
+        return gline
+
+    def wait_for_resume(self):
+        if self.cancelled:
+            return
+        self.paused = True
+        if self.on_pause:
+            self.on_pause(self.core.queueindex)
+        self.resume_event.wait()
+        self.resume_event.clear()
+        self.paused = False
+
+    def after_send(self, gline):
+        if self.on_progress:
+            self.on_progress(self.core.queueindex + 1, self.total)
+
+    def resume(self):
+        """Continue sending after a pause"""
+        self.resume_event.set()
+
+    def cancel(self):
+        """Stop sending, the printer finishes the lines it already has"""
+        self.cancelled = True
+        self.resume_event.set()
+        self.core.cancelprint()
+
+    def finished(self):
+        if self.on_done:
+            self.on_done()
+
+    def error(self, message):
+        print(f"Printer error: {message}")
+        if self.on_error:
+            self.on_error(message)
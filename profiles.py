@@ -0,0 +1,131 @@
+import os
+import re
+
+# Directory holding the toolchange templates shipped with Printegration
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Placeholders a toolchange template is allowed to use, e.g. [TO_TOOL]
+TOOLCHANGE_PLACEHOLDERS = {
+    'LAYER_HEIGHT', 'RETRACT', 'DE_RETRACT',
+    'FROM_TOOL', 'TO_TOOL', 'TO_TOOL_TEMP',
+    'WIPE_X1', 'WIPE_X2', 'WIPE_Y1', 'WIPE_Y2',
+}
+
+PLACEHOLDER_RE = re.compile(r'\[([A-Z][A-Z0-9_]*)\]')
+
+# Built-in printer profiles. Each profile is matched against the G-code
+# metadata and carries everything needed to splice a toolchange into it.
+PRINTER_PROFILES = {
+    'Prusa XL': {
+        'model_markers': ['printer_model = XL', 'printer_model = XL2', 'printer_model = XL5'],
+        'content_markers': ['generated by PrusaSlicer'],
+        'toolchange_template': 'toolchange.gcode',
+        # Wipe moves relative to the wipe tower origin (x1, y1, x2, y2)
+        'wipe_offsets': (-0.25, 0.25, -1.75, -0.75),
+        'toolchange_retract': 20,  # mm
+        'heatup_rate': 2.5,  # degC/s, used to schedule tool preheats
+        'preheat_margin': 5,  # s, extra lead so the tool settles before use
+    },
+}
+
+
+def compile_template(template):
+    """Compile a toolchange template into a single substitution function
+
+    The template is split once into literal chunks and placeholder names so
+    filling it is one join instead of a chain of str.replace calls.
+
+    Args:
+        template: Template text using [PLACEHOLDER] markers
+
+    Returns:
+        A function taking the placeholder values as keyword arguments and
+        returning the filled G-code
+    """
+    parts = PLACEHOLDER_RE.split(template)
+    literals = parts[0::2]
+    names = parts[1::2]
+
+    unknown = set(names) - TOOLCHANGE_PLACEHOLDERS
+    if unknown:
+        raise ValueError(f"Unknown placeholders in toolchange template: {', '.join(sorted(unknown))}")
+
+    required = set(names)
+
+    def fill(**values):
+        missing = required - values.keys()
+        if missing:
+            raise KeyError(f"Missing toolchange values: {', '.join(sorted(missing))}")
+        out = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            out.append(str(values[name]))
+            out.append(literal)
+        return ''.join(out)
+
+    fill.placeholders = required
+    return fill
+
+
+class PrinterProfile:
+    def __init__(self, name, model_markers, content_markers, toolchange_template,
+                 wipe_offsets, toolchange_retract, heatup_rate, preheat_margin):
+        self.name = name
+        self.model_markers = model_markers
+        self.content_markers = content_markers
+        self.wipe_offsets = wipe_offsets
+        self.toolchange_retract = toolchange_retract
+        self.heatup_rate = heatup_rate
+        self.preheat_margin = preheat_margin
+
+        template_path = toolchange_template
+        if not os.path.isabs(template_path):
+            template_path = os.path.join(TEMPLATE_DIR, template_path)
+        self.template_path = template_path
+        with open(template_path, 'r') as f:
+            self.toolchange = compile_template(f.read())
+
+        if len(wipe_offsets) != 4:
+            raise ValueError(f"Profile {name}: wipe_offsets needs 4 values, got {len(wipe_offsets)}")
+
+    def matches(self, content):
+        """Check if G-code content was sliced for this printer"""
+        model_match = any(marker in content for marker in self.model_markers)
+        content_match = any(marker in content for marker in self.content_markers)
+        return model_match and content_match
+
+    def wipe_coordinates(self, wipe_tower_x, wipe_tower_y):
+        """Get the wipe move coordinates for a wipe tower position"""
+        dx1, dy1, dx2, dy2 = self.wipe_offsets
+        return {
+            'WIPE_X1': wipe_tower_x + dx1,
+            'WIPE_Y1': wipe_tower_y + dy1,
+            'WIPE_X2': wipe_tower_x + dx2,
+            'WIPE_Y2': wipe_tower_y + dy2,
+        }
+
+
+_profiles = None
+
+def load_profiles():
+    """Load and compile all printer profiles, only done once per process"""
+    global _profiles
+    if _profiles is None:
+        profiles = {}
+        for name, spec in PRINTER_PROFILES.items():
+            try:
+                profiles[name] = PrinterProfile(name, **spec)
+            except Exception as e:
+                print(f"Error loading printer profile {name}: {str(e)}")
+        _profiles = profiles
+    return _profiles
+
+def get_profile(name):
+    """Get a loaded printer profile by name"""
+    return load_profiles().get(name)
+
+def match_profile(content):
+    """Find the printer profile matching the G-code content, if any"""
+    for profile in load_profiles().values():
+        if profile.matches(content):
+            return profile
+    return None
@@ -0,0 +1,168 @@
+from pyglet.gl import glPushMatrix, glPopMatrix, glTranslatef, glRotatef, \
+    glScalef, glMultMatrixd, glClear, glClearColor, GLuint, \
+    glGenFramebuffers, glBindFramebuffer, glDeleteFramebuffers, \
+    glGenRenderbuffers, glBindRenderbuffer, glDeleteRenderbuffers, \
+    glRenderbufferStorage, glFramebufferRenderbuffer, glCheckFramebufferStatus, \
+    glBlitFramebuffer, GL_FRAMEBUFFER, GL_READ_FRAMEBUFFER, GL_DRAW_FRAMEBUFFER, \
+    GL_RENDERBUFFER, GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT, GL_RGBA8, \
+    GL_DEPTH_COMPONENT24, GL_FRAMEBUFFER_COMPLETE, GL_COLOR_BUFFER_BIT, \
+    GL_DEPTH_BUFFER_BIT, GL_NEAREST
+from pyglet.gl.lib import GLException, MissingFunctionException
+from printrun.gl.trackball import build_rotmatrix
+
+from tool_palette import palette_colors
+
+
+class SceneCache:
+    """Cache the static part of a gcview scene in an offscreen framebuffer
+
+    The platform and G-code model are only re-rendered when the camera,
+    viewport, layer state or model colours change, or invalidate() is
+    called for a new model. Every other frame just
+    blits the cached colour and depth buffers and draws the overlay actors
+    (e.g. the marker) on top, so dragging an overlay costs one blit.
+    """
+
+    def __init__(self, viewer, overlays):
+        self.viewer = viewer
+        self.glpanel = viewer.glpanel
+        self.overlays = overlays  # Actors drawn every frame on top of the cache
+        self.version = 0  # Bumped by invalidate(), ids of freed models may be reused by new ones
+        self.key = None
+        self.size = None
+        self.fbo = None
+        self.color_rb = None
+        self.depth_rb = None
+        self.broken = False  # Fall back to drawing everything if FBOs fail
+        self.blit_depth = True
+
+        # Take over the panel's per-frame draw
+        self.draw_all = self.glpanel.draw_objects
+        self.glpanel.draw_objects = self.draw_objects
+
+    def invalidate(self):
+        """Force the cached scene to be re-rendered on the next frame
+
+        Called whenever the viewer is cleared or given a new model.
+        """
+        self.version += 1
+
+    def scene_key(self):
+        """Everything that changes how the cached part of the scene looks"""
+        model = self.viewer.model
+        model_state = None
+        if model:
+            model_state = (model.loaded, model.initialized,
+                           getattr(model, 'num_layers_to_draw', None),
+                           getattr(model, 'printed_until', None),
+                           getattr(model, 'only_current', None),
+                           palette_colors(model))
+        mvmat = self.glpanel.get_modelview_mat(True)
+        return (tuple(mvmat), self.glpanel.width, self.glpanel.height, self.version, model_state)
+
+    def draw_scene(self, overlays):
+        """Draw either the cached objects or the overlay objects of the scene"""
+        self.glpanel.create_objects()
+
+        glPushMatrix()
+        # Same transforms as GcodeViewPanel.draw_objects
+        glMultMatrixd(build_rotmatrix(self.glpanel.basequat))
+        platformx0 = -self.glpanel.build_dimensions[3] - self.viewer.platform.width / 2
+        platformy0 = -self.glpanel.build_dimensions[4] - self.viewer.platform.depth / 2
+        glTranslatef(platformx0, platformy0, 0)
+
+        for obj in self.viewer.objects:
+            if not obj.model or not obj.model.loaded:
+                continue
+            if (obj.model in self.overlays) != overlays:
+                continue
+            glPushMatrix()
+            glTranslatef(*(obj.offsets))
+            glRotatef(obj.rot, 0.0, 0.0, 1.0)
+            glTranslatef(*(obj.centeroffset))
+            glScalef(*obj.scale)
+            obj.model.display()
+            glPopMatrix()
+        glPopMatrix()
+
+    def create_framebuffer(self, width, height):
+        """(Re)create the offscreen framebuffer for a viewport size"""
+        self.delete_framebuffer()
+        fbo = GLuint()
+        glGenFramebuffers(1, fbo)
+        color_rb = GLuint()
+        depth_rb = GLuint()
+        glGenRenderbuffers(1, color_rb)
+        glGenRenderbuffers(1, depth_rb)
+        self.fbo, self.color_rb, self.depth_rb = fbo, color_rb, depth_rb
+
+        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+        glBindRenderbuffer(GL_RENDERBUFFER, color_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, color_rb)
+        glBindRenderbuffer(GL_RENDERBUFFER, depth_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth_rb)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise GLException(f"Incomplete framebuffer: {status:#x}")
+        self.size = (width, height)
+
+    def delete_framebuffer(self):
+        if self.fbo is not None:
+            glDeleteFramebuffers(1, self.fbo)
+            glDeleteRenderbuffers(1, self.color_rb)
+            glDeleteRenderbuffers(1, self.depth_rb)
+        self.fbo = self.color_rb = self.depth_rb = None
+        self.size = None
+        self.key = None
+
+    def blit(self, width, height):
+        """Copy the cached scene into the window's framebuffer"""
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+        if self.blit_depth:
+            try:
+                glBlitFramebuffer(0, 0, width, height, 0, 0, width, height,
+                                  GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+            except GLException:
+                # Depth formats differ from the window's, overlays will just draw on top
+                print("Depth blit not supported, drawing overlays without depth")
+                self.blit_depth = False
+        if not self.blit_depth:
+            glBlitFramebuffer(0, 0, width, height, 0, 0, width, height,
+                              GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def draw_objects(self):
+        """Replacement for the panel's draw_objects, called once per frame"""
+        if self.broken or not self.glpanel.width or not self.glpanel.height:
+            self.draw_all()
+            return
+
+        width, height = int(self.glpanel.width), int(self.glpanel.height)
+        try:
+            if self.size != (width, height):
+                self.create_framebuffer(width, height)
+
+            key = self.scene_key()
+            if key != self.key:
+                glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+                glClearColor(*self.glpanel.color_background)
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                self.draw_scene(overlays=False)
+                glBindFramebuffer(GL_FRAMEBUFFER, 0)
+                self.key = key
+
+            self.blit(width, height)
+        except (GLException, MissingFunctionException) as e:
+            print(f"Offscreen rendering failed, drawing directly: {str(e)}")
+            glBindFramebuffer(GL_FRAMEBUFFER, 0)
+            self.broken = True
+            self.delete_framebuffer()
+            self.draw_all()
+            return
+
+        self.draw_scene(overlays=True)
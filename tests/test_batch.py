@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('printrun')
+
+import batch
+import drill_library
+import injection
+import output_cache
+import parallel_parse
+import profiles
+
+DRILL = "M48\nT1C0.8\n%\nT1\nX-5.0Y5.0\nX5.0Y5.0\nX0.0Y-5.0\nM30\n"
+
+
+def write_plate(path):
+    """Two-tool XL plate with a pocket under the board and blank lines like PrusaSlicer's"""
+    lines = ["; generated by PrusaSlicer 2.8.1", "", "G90", "M83", "T0", ""]
+    for layer in range(30):
+        z = round(0.2 * (layer + 1), 2)
+        lines += [";LAYER_CHANGE", f";Z:{z}", f"G1 Z{z} F600", "", "T0" if layer % 2 == 0 else "T1"]
+        y = 0.0
+        spacing = 0.45 if layer < 5 or layer >= 18 else 3.0
+        while y <= 40:
+            if 10 <= layer < 18 and 9 < y < 31:
+                lines += [f"G1 X100 Y{100 + y:.2f} F3000", f"G1 X109 Y{100 + y:.2f} E0.5",
+                          f"G1 X131 Y{100 + y:.2f} F3000", f"G1 X140 Y{100 + y:.2f} E0.5"]
+            else:
+                lines += [f"G1 X100 Y{100 + y:.2f} F3000", f"G1 X140 Y{100 + y:.2f} E1"]
+            y += spacing
+        lines.append("")
+    lines += ["; printer_model = XL5", "; wipe_tower = 1", "; wipe_tower_x = 190.5", "; wipe_tower_y = 250.1",
+              "; temperature = 215,215,215,215,230", "; idle_temperature = 100,100,100,100,150"]
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n\n")
+
+def write_job(tmp_path):
+    """Plate, drill file and spec placing the board's holes in the plate's pocket"""
+    plate = tmp_path / "plate.gcode"
+    write_plate(plate)
+    drill = tmp_path / "board.drl"
+    drill.write_text(DRILL)
+    spec = {'layer': 'auto', 'conductive_tool': 1,
+            'patterns': [{'drill': str(drill), 'tool': "T1", 'position': [120, 120]}]}
+    return plate, drill, spec
+
+def test_printegrate_file_keeps_blank_lines(tmp_path):
+    plate, drill, spec = write_job(tmp_path)
+    output = tmp_path / "out.gcode"
+
+    # Raises if the output fails verification against the original
+    result = batch.printegrate_file(str(plate), spec, str(output))
+
+    assert result['holes'] == 3
+    original = plate.read_text().splitlines()
+    written = output.read_text().splitlines()
+    assert written.count("") == original.count("")
+
+def test_printegrate_file_copies_result_saved_in_gui(tmp_path):
+    plate, drill, spec = write_job(tmp_path)
+    cache = output_cache.OutputCache(str(tmp_path / "cache"))
+    first = batch.printegrate_file(str(plate), spec, str(tmp_path / "first.gcode"))
+
+    # Stored under the key the GUI builds from the placement it shows, with the metadata it saves
+    holes = injection.pattern_holes(drill_library.parse_drill_text(DRILL), "T1", [120, 120])
+    gcode = parallel_parse.parse_gcode(str(plate), workers=1)
+    profile = profiles.match_profile(plate.read_text())
+    key = output_cache.placement_key(output_cache.file_digest(str(plate)), profile, holes, first['layer'],
+                                     first['conductive_tool'], injection.layer_z(gcode, first['layer']))
+    report = {'summary': {'lines': first['inserted_lines']}}
+    cache.put(key, str(tmp_path / "first.gcode"),
+              meta=output_cache.result_meta(profile, first['layer'], first['conductive_tool'], holes, report))
+
+    output = tmp_path / "out.gcode"
+    result = batch.printegrate_file(str(plate), spec, str(output), cache)
+
+    assert result['cached']
+    assert result['layer'] == first['layer'] and result['holes'] == 3
+    assert output.read_text() == (tmp_path / "first.gcode").read_text()
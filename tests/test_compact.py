@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compact
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def compacted(lines, **state):
+    return list(compact.compact_lines(lines, compact.ModalState(**state)))
+
+def test_repeated_feedrate_dropped():
+    assert compacted(["G1 X10 Y10 F1500", "G1 X20 Y10 F1500.0", "G1 X30 F1800"], absolute=True) == \
+        ["G1 X10 Y10 F1500", "G1 X20", "G1 X30 F1800"]
+
+def test_unchanged_axis_dropped():
+    assert compacted(["G1 X10 Y10 Z0.2", "G1 X10.0001 Y20 Z0.2 E0.5", "G1 X10 Y20"],
+                     absolute=True, relative_e=True) == ["G1 X10 Y10 Z0.2", "G1 Y20 E0.5"]
+    # Relative moves only lose their zero axes
+    assert compacted(["G1 X5 Y0 Z0", "G1 X5"], absolute=False) == ["G1 X5", "G1 X5"]
+
+def test_zero_dwell_after_a_move_kept():
+    assert compacted(["G1 X10 E1", "G4 S0", "G4 S0", "M400", "G1 X20 E1", "M400"]) == \
+        ["G1 X10 E1", "G4 S0", "G1 X20 E1", "M400"]
+
+def test_speed_factor_backup_and_restore_kept():
+    lines = ["M220 S100", "M220 B", "M220 S50", "M220 S50", "M220 R", "M220 S50"]
+    # Once restored the factor is the one backed up, so setting 50 again counts
+    assert compacted(lines) == ["M220 S100", "M220 B", "M220 S50", "M220 R", "M220 S50"]
+
+def test_state_forgotten_after_tool_changes_and_pauses():
+    for command in ("T1", "P0 S1", "M601"):
+        lines = ["G1 X10 Y10 F1500", command, "G1 X10 Y10 F1500"]
+        assert compacted(lines, absolute=True) == lines
+
+def test_cli_compacts_whole_file(tmp_path):
+    source = tmp_path / "in.gcode"
+    output = tmp_path / "out.gcode"
+    source.write_text("G90\nM83\n; layer\nG1 X10.00000 Y10 F1500\nG1 X20 Y10 F1500 ; infill\n"
+                      "G4 S0\nM117 Printing\nG1 X20 Y10\n")
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "compact.py"), str(source), str(output)],
+                            capture_output=True, text=True, check=True)
+    assert output.read_text() == ("G90\nM83\n; layer\nG1 X10 Y10 F1500\nG1 X20 ; infill\n"
+                                  "G4 S0\nM117 Printing\n")
+    assert result.stdout.startswith("8 -> 7 lines")
+
+    # Compacting in place would read the file as it is replaced
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "compact.py"), str(source), str(source)],
+                            capture_output=True, text=True)
+    assert result.returncode == 2
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heightmap
+import injection
+
+
+def empty_map():
+    return heightmap.HeightMap(np.empty((0, 3)), np.empty((0, 3)))
+
+def test_hop_clears_floor_over_empty_map():
+    waypoints = heightmap.plan_hop(empty_map(), (100, 100, 1.55), (110, 100, 1.55), floor=2.0)
+    clear_z = pytest.approx(2.0 + heightmap.TRAVEL_CLEARANCE)
+    assert [z for _, _, z in waypoints[:-1]] == [clear_z, clear_z]
+    assert waypoints[-1] == (110, 100, 1.55)
+
+def test_holes_over_empty_map_lift_between_holes():
+    layer_z = 3.8
+    holes = [[115, 115], [125, 115], [120, 125]]
+    gcode = injection.generate_hole_gcode(holes, [140, 139, layer_z], height_map=empty_map())
+    pos = [140, 139, layer_z]
+    for line in gcode:
+        if not line.startswith('G0'):
+            continue
+        words = {word[0]: float(word[1:]) for word in line.split()[1:]}
+        end = [words.get(axis, value) for axis, value in zip('XYZ', pos)]
+        # Apart from the 1mm wipe out of each hole, nothing moves sideways below the board
+        if np.hypot(end[0] - pos[0], end[1] - pos[1]) > 1:
+            assert min(pos[2], end[2]) >= layer_z, line
+        pos = end
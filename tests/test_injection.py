@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('printrun')
+
+import injection
+import parallel_parse
+import profiles
+
+VARIABLES = {'temperature': "215,215,215,215,230", 'idle_temperature': "100,100,100,100,150",
+             'wipe_tower': "1", 'wipe_tower_x': "190.5", 'wipe_tower_y': "250.1"}
+HOLES = [[115, 115], [125, 125]]
+
+
+def layer_lines(z, toolchange_to=None):
+    """One layer printing rows with T0, changing to another tool half way like PrusaSlicer"""
+    lines = [";LAYER_CHANGE", f";Z:{z}", f"G1 Z{z} F600"]
+    rows = [f"G1 X{100 + (n % 2) * 40} Y{100 + n * 0.5} E1 F1500" for n in range(40)]
+    lines += rows[:20]
+    if toolchange_to is not None:
+        tool = toolchange_to
+        lines += ["; CP TOOLCHANGE START", "G1 E-0.8 F2100", "P0 S1 L2 D0",
+                  f"M109 S215 T{tool}", f"T{tool} S1 L0 D0", f"M109 S215 T{tool}",
+                  "G1 X190 Y250 F24000", "G1 X220 Y250 E2 F1500", "G1 X190 Y252 E2",
+                  "G1 X220 Y252 E2", "G92 E0", "; CP TOOLCHANGE END"]
+    lines += rows[20:]
+    return lines
+
+def plan(lines, layer_idx, conductive_tool):
+    gcode = parallel_parse.parse_lines([line + "\n" for line in lines])
+    profile = profiles.get_profile('Prusa XL')
+    z = injection.layer_z(gcode, layer_idx)
+    return gcode, injection.plan_injection(gcode, VARIABLES, profile, layer_idx, conductive_tool, HOLES, z)
+
+def test_reused_toolchange_preheats_inside_it():
+    lines = ["G90", "M83", "T0"]
+    for layer in range(4):
+        lines += layer_lines(round(0.2 * (layer + 1), 2), toolchange_to=1 if layer == 3 else None)
+    gcode, insertions = plan(lines, 4, 1)
+
+    layer = [line.raw for line in gcode.all_layers[4]]
+    insert_at = layer.index("; CP TOOLCHANGE END") + 1
+    (preheat_layer, preheat_line, preheat), (block_layer, block_line, block) = insertions
+    assert (block_layer, block_line) == (4, insert_at)
+    # Ahead of the injection, but not before the slicer's own wait for the tool
+    assert preheat == ["M104 T1 S240"]
+    assert preheat_layer == 4
+    assert layer.index("T1 S1 L0 D0") + 1 < preheat_line < insert_at
+    assert not any(line.startswith("M104 S240") for line in block)
+    # Back to the slicer's temperature for the tool, not a fixed one
+    assert "M104 S215" in block
+
+def test_active_conductive_tool_preheats_a_layer_ahead():
+    lines = ["G90", "M83", "T4", "M104 S230"]
+    for layer in range(4):
+        lines += layer_lines(round(0.2 * (layer + 1), 2))
+    gcode, insertions = plan(lines, 4, 4)
+
+    (preheat_layer, preheat_line, preheat), (block_layer, block_line, block) = insertions
+    assert preheat == ["M104 T4 S240"]
+    assert (block_layer, block_line) == (4, 0)
+    assert preheat_layer < 4
+    assert "M104 S230" in block
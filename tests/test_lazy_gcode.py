@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('printrun')
+
+import lazy_gcode
+import motion
+import parallel_parse
+
+
+def make_gcode(layers=30):
+    lines = ["G90", "M83"]
+    for layer in range(layers):
+        z = round(0.2 * (layer + 1), 2)
+        lines += [";LAYER_CHANGE", f";Z:{z}", f"G1 Z{z} F600"]
+        lines += [f"G1 X{10 + i} Y{10 + layer} E0.1" for i in range(20)]
+    return [line + "\n" for line in lines]
+
+def test_layer_cache_shared_between_threads():
+    gcode = lazy_gcode.LazyGCode.from_lines(make_gcode())
+    # Room for a few layers, so threads evict each other's layers
+    gcode.cache_bytes = gcode.layer_cost(1) * 5
+
+    def read_layers():
+        for _ in range(10):
+            for idx in range(len(gcode.all_layers)):
+                assert gcode.get_layer(idx) is not None
+
+    threads = [threading.Thread(target=read_layers) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert gcode.cache_used == sum(gcode.layer_cost(idx) for idx in gcode.cache)
+    assert gcode.cache_used <= gcode.cache_bytes
+
+def test_motion_state_read_without_parsing():
+    lines = ["G90", "M83", "M204 S1000", "G1 F3000"]
+    for layer in range(20):
+        z = round(0.2 * (layer + 1), 2)
+        lines += [";LAYER_CHANGE", f";Z:{z}", "", f"G1 Z{z} F600"]
+        if layer == 5:
+            lines.append("M204 P1500")
+        lines += [f"G1 X{10 + i} Y{10 + layer} E0.1" for i in range(20)]
+        lines += ["G1 X50 Y50 F9000", "G10"]
+    gcode = lazy_gcode.LazyGCode.from_lines([line + "\n" for line in lines])
+    parsed = parallel_parse.parse_lines([line + "\n" for line in lines])
+
+    for layer_idx, line_idx in ((1, 0), (3, 2), (10, 0), (10, 3), (20, 24)):
+        expected = motion.state_before(parsed, layer_idx, line_idx)
+        assert motion.state_before(gcode, layer_idx, line_idx) == expected
+    assert motion.state_before(gcode, 10, 0) == ({'P': 1500, 'T': 1000}, 9000)
+    assert motion.state_before(gcode, 1, 0) == ({'P': 1000, 'T': 1000}, 3000)
+    # Nothing was parsed looking back to the start of the print
+    assert not gcode.cache
+
+def test_temporary_copy_removed_on_close(tmp_path):
+    path = tmp_path / "copy.gcode"
+    path.write_text("".join(make_gcode(3)))
+    gcode = lazy_gcode.LazyGCode.open(str(path), temporary=True)
+    assert len(gcode.all_layers) == 4
+    gcode.close()
+    assert not path.exists()
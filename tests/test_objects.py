@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('printrun')
+
+import lazy_gcode
+import objects
+
+
+def make_gcode(layers=6):
+    """Two labelled objects per layer, with the blank lines printrun drops"""
+    lines = ["G90", "M83", 'M486 S0 A"Left"', 'M486 S1 A"Right"', "M486 S-1", ""]
+    for layer in range(layers):
+        z = round(0.2 * (layer + 1), 2)
+        lines += [";LAYER_CHANGE", f";Z:{z}", f"G1 Z{z} F600", ""]
+        for obj, x in ((0, 10), (1, 60)):
+            lines += [f"M486 S{obj}", f"G1 X{x} Y10", "   "]
+            lines += [f"G1 X{x + 20} Y{10 + i} E0.5" for i in range(10)]
+            # An object's print may run on into the next layer
+            if not (obj == 1 and layer % 2):
+                lines.append("M486 S-1")
+        lines.append("G1 X100 Y100")
+    return [line + "\n" for line in lines]
+
+def test_bytes_index_matches_parsed_layers():
+    gcode = lazy_gcode.LazyGCode.from_lines(make_gcode())
+
+    class Parsed:
+        """The same layers, read line by line instead of from the bytes"""
+        all_layers = gcode.all_layers
+
+    scanned = objects.ObjectIndex.from_gcode(gcode)
+    parsed = objects.ObjectIndex.from_gcode(Parsed())
+    assert scanned.names == parsed.names == {0: "Left", 1: "Right"}
+    assert scanned.spans == parsed.spans
+    assert scanned.start_labels == parsed.start_labels
+    assert scanned.changes == parsed.changes
+    assert scanned.footprints == pytest.approx(parsed.footprints)
+    assert scanned.box_layers.tolist() == parsed.box_layers.tolist()
+    assert scanned.boxes == pytest.approx(parsed.boxes)
+    assert scanned.object_at(70, 15, 3) == 1
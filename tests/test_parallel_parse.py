@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('printrun')
+
+import lazy_gcode
+import parallel_parse
+
+
+def write_plate(path):
+    """Plate with Z hops, a G92 shift of the coordinates and a stretch of relative moves"""
+    lines = ["; generated by PrusaSlicer 2.8.1", "G90", "M83", "G28", ""]
+    for layer in range(40):
+        z = round(0.2 * (layer + 1), 2)
+        lines += [";LAYER_CHANGE", f";Z:{z}", ";HEIGHT:0.2", f"G1 Z{z} F600"]
+        for row in range(10):
+            y = 100 + row
+            lines += [f"G1 X100 Y{y} F3000", f"G1 X140 Y{y} E1.2",
+                      # Hop over to the next row, which printrun starts a layer at
+                      f"G1 Z{z + 0.4} F600", f"G1 X100 Y{y + 0.5}", f"G1 Z{z}"]
+        if layer == 15:
+            lines += ["G92 X0 Y0", "G1 X-20 Y-20 E0.5"]
+        if layer == 25:
+            lines += ["G91", "G1 X5 Y5 E0.2", "G1 Z0.2", "G1 Z-0.2", "G90"]
+        lines.append("")
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+def positions(layer):
+    return [(line.raw, line.current_x, line.current_y, line.current_z, line.extruding) for line in layer]
+
+def test_parse_paths_give_the_same_layers(tmp_path, monkeypatch):
+    plate = tmp_path / "plate.gcode"
+    write_plate(plate)
+    sequential = parallel_parse.parse_gcode(str(plate), workers=1)
+    # Small chunks, so some start after the G92 and the relative moves
+    monkeypatch.setattr(parallel_parse, 'PARALLEL_MIN_BYTES', 0)
+    monkeypatch.setattr(parallel_parse, 'CHUNKS_PER_WORKER', 10)
+    chunked = parallel_parse.parse_gcode(str(plate), workers=2)
+    lazy = lazy_gcode.LazyGCode.open(str(plate))
+
+    # One layer per ;LAYER_CHANGE, plus the header and printrun's append layer
+    assert len(sequential.all_layers) == len(chunked.all_layers) == len(lazy.all_layers) + 1 == 42
+    assert list(sequential.layer_idxs) == list(chunked.layer_idxs)
+    assert list(sequential.line_idxs) == list(chunked.line_idxs)
+    for idx in range(len(lazy.all_layers)):
+        assert positions(sequential.all_layers[idx]) == positions(chunked.all_layers[idx])
+        assert [line.raw for line in sequential.all_layers[idx]] == [line.raw for line in lazy.all_layers[idx]]
+        assert sequential.all_layers[idx].z == chunked.all_layers[idx].z == lazy.all_layers[idx].z
+    lazy.close()
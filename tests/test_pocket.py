@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('printrun')
+
+import lazy_gcode
+import parallel_parse
+import pocket
+
+# Two boards side by side, each over its own pocket, solid print between them
+POCKETS = [(104, 116), (124, 136)]
+BOARDS = [[[106, 106], [114, 114]], [[126, 106], [134, 114]]]
+
+
+def plate_lines():
+    lines = ["G90", "M83"]
+    for layer in range(30):
+        z = round(0.2 * (layer + 1), 2)
+        lines += [";LAYER_CHANGE", f";Z:{z}", f"G1 Z{z} F600"]
+        y = 100.0
+        while y <= 120:
+            x = 100
+            # Layers 10 to 17 leave the pockets open
+            gaps = POCKETS if 10 <= layer < 18 and 102 < y < 118 else []
+            for start, end in gaps:
+                lines += [f"G1 X{x} Y{y:.2f} F3000", f"G1 X{start} Y{y:.2f} E0.5"]
+                x = end
+            lines += [f"G1 X{x} Y{y:.2f} F3000", f"G1 X140 Y{y:.2f} E0.5"]
+            y += 0.45
+    return [line + "\n" for line in lines]
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_pockets_of_boards_placed_apart(lazy):
+    lines = plate_lines()
+    gcode = lazy_gcode.LazyGCode.from_lines(lines) if lazy else parallel_parse.parse_lines(lines)
+
+    found = pocket.find_pocket_layer(gcode, BOARDS)
+
+    # Layer 0 is everything before the first layer change
+    assert found['layer'] == 19
+    assert found['depth'] == pytest.approx(1.6)
+    assert found['occupancy'].shape == (2, len(gcode.all_layers))
+
+def test_one_box_over_both_boards_finds_no_pocket():
+    gcode = parallel_parse.parse_lines(plate_lines())
+    holes = [hole for board in BOARDS for hole in board]
+
+    assert pocket.find_pocket_layer(gcode, [holes])['layer'] is None
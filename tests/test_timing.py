@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timing
+
+
+def retimed(before, after, inserted=("G4 S120\n",)):
+    """Retime markers around a two minute inserted block"""
+    runs = [(before, False), (list(inserted), True), (after, False)]
+    return list(timing.retime_progress(runs, timing.estimate_block_duration(list(inserted), None)))
+
+def test_markers_before_and_after_insert():
+    lines = retimed(["M73 P0 R10\n", "G1 X10\n", "M73 P50 R5\n"], ["M73 P75 R2\n", "M73 P100 R0\n"])
+    # 10 minutes became 12, the markers before the block have it still ahead
+    assert lines == ["M73 P0 R12\n", "G1 X10\n", "M73 P42 R7\n", "G4 S120\n",
+                     "M73 P79 R2\n", "M73 P100 R0\n"]
+
+def test_silent_mode_markers():
+    lines = retimed(["M73 Q0 S12\n", "M73 Q50 S6 ; silent\n"], ["M73 Q100 S0\n"])
+    assert lines == ["M73 Q0 S14\n", "M73 Q43 S8 ; silent\n", "G4 S120\n", "M73 Q100 S0\n"]
+
+def test_colour_change_times_left_alone():
+    lines = retimed(["M73 P0 R10\n", "M73 C3 D4\n", "M73 P50 R5 C1 D2\n"], ["M73 C0\n"])
+    assert lines == ["M73 P0 R12\n", "M73 C3 D4\n", "M73 P42 R7 C1 D2\n", "G4 S120\n", "M73 C0\n"]
+
+def test_nothing_inserted_leaves_markers():
+    lines = ["M73 P0 R10\n", "M73 P50 R5\n"]
+    assert list(timing.retime_progress([(lines, False)], 0)) == lines
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('pyglet')
+pytest.importorskip('printrun')
+
+import tool_palette
+
+
+class Move:
+    def __init__(self, end_vertex, extruding, tool):
+        self.gcview_end_vertex = end_vertex
+        self.extruding = extruding
+        self.current_tool = tool
+
+class Model:
+    color_tool0 = (1, 0, 0, 1)
+    color_tool1 = (0, 1, 0, 1)
+    color_tool2 = (0, 0, 1, 1)
+    color_travel = (0.6, 0.6, 0.6, 0.6)
+    count_print_vertices = [0, 2, 4, 6, 8]
+
+    class gcode:
+        lines = [Move(1, True, 0), Move(2, False, 0), Move(3, True, 7), Move(4, True, 1)]
+
+def test_travel_has_its_own_palette_slot():
+    model = Model()
+    travel = tool_palette.palette_colors(model).index(model.color_travel)
+    assert travel == 3
+    # Tools past the last colour use the last one, like movement_color
+    assert tool_palette.vertex_tools(model).tolist() == [0, 0, travel, travel, 2, 2, 1, 1]
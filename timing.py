@@ -0,0 +1,204 @@
+import math
+import re
+
+DEFAULT_FEEDRATE = 4200  # mm/min
+DEFAULT_ACCELERATION = 1250  # mm/s^2, matches the M204 in the toolchange template
+
+WORD_RE = re.compile(r'([A-Z])\s*([-+]?[0-9]*\.?[0-9]+)')
+
+
+def parse_words(raw):
+    """Split a raw G-code line into its command and parameters
+
+    Returns:
+        (command, params) e.g. ("G1", {'X': 10.0, 'F': 4200.0}), command is
+        None for blank and comment-only lines
+    """
+    code = raw.split(';', 1)[0].strip().upper()
+    if not code:
+        return None, {}
+    words = WORD_RE.findall(code)
+    if not words:
+        return code.split()[0], {}
+    command = words[0][0] + str(int(float(words[0][1])))
+    params = {letter: float(value) for letter, value in words[1:]}
+    return command, params
+
+def move_time(distance, feedrate, acceleration=DEFAULT_ACCELERATION):
+    """Time in seconds for a move with a trapezoidal speed profile
+
+    Args:
+        distance: Move length in mm
+        feedrate: Feedrate in mm/min
+        acceleration: Acceleration in mm/s^2
+    """
+    if distance <= 0 or feedrate <= 0:
+        return 0.0
+    speed = feedrate / 60.0
+    # Distance needed to reach full speed and stop again
+    ramp = speed * speed / acceleration
+    if distance >= ramp:
+        return distance / speed + speed / acceleration
+    # Never reaches full speed, triangle profile
+    return 2 * math.sqrt(distance / acceleration)
+
+def dwell_time(params):
+    """Time in seconds for a G4 dwell"""
+    if 'P' in params:
+        return params['P'] / 1000.0
+    return params.get('S', 0.0)
+
+def estimate_block_durations(lines, start_pos=(0, 0, 0), feedrate=DEFAULT_FEEDRATE,
+                             acceleration=DEFAULT_ACCELERATION):
+    """Estimate how long each line of a raw G-code block takes
+
+    XYZ are taken as absolute and E as relative, which is how PrusaSlicer
+    writes G-code for the XL and how injection blocks are generated.
+
+    Args:
+        lines: Raw G-code lines
+        start_pos: [x, y, z] of the nozzle before the block, None to start
+            where the block first moves to
+        feedrate: Feedrate in effect before the block (mm/min)
+        acceleration: Acceleration in effect before the block (mm/s^2),
+            M204 in the block then sets it for extruding, retracting and
+            travel moves
+
+    Returns:
+        List of durations in seconds, one per line
+    """
+    if start_pos is None:
+        start_pos = first_position(lines)
+    x, y, z = start_pos
+    accelerations = dict.fromkeys('PRT', acceleration)
+    durations = []
+    for raw in lines:
+        command, params = parse_words(raw)
+        duration = 0.0
+        if command in ('G0', 'G1'):
+            feedrate = params.get('F', feedrate)
+            nx = params.get('X', x)
+            ny = params.get('Y', y)
+            nz = params.get('Z', z)
+            distance = math.sqrt((nx - x) ** 2 + (ny - y) ** 2 + (nz - z) ** 2)
+            if distance == 0:
+                distance = abs(params.get('E', 0.0))
+                kind = 'R'
+            else:
+                kind = 'P' if params.get('E', 0.0) > 0 else 'T'
+            duration = move_time(distance, feedrate, accelerations[kind])
+            x, y, z = nx, ny, nz
+        elif command == 'G4':
+            duration = dwell_time(params)
+        elif command == 'M204':
+            if 'S' in params:
+                accelerations['P'] = accelerations['T'] = params['S']
+            for letter in 'PRT':
+                accelerations[letter] = params.get(letter, accelerations[letter])
+        durations.append(duration)
+    return durations
+
+def first_position(lines):
+    """First X, Y and Z each moved to in a raw G-code block, 0 for any never given"""
+    pos = {}
+    for raw in lines:
+        command, params = parse_words(raw)
+        if command in ('G0', 'G1'):
+            for axis in 'XYZ':
+                if axis in params:
+                    pos.setdefault(axis, params[axis])
+            if len(pos) == 3:
+                break
+    return tuple(pos.get(axis, 0.0) for axis in 'XYZ')
+
+def estimate_block_duration(lines, start_pos=(0, 0, 0), feedrate=DEFAULT_FEEDRATE,
+                            acceleration=DEFAULT_ACCELERATION):
+    """Estimate how long a raw G-code block takes in seconds"""
+    return sum(estimate_block_durations(lines, start_pos, feedrate, acceleration))
+
+def estimate_gline_durations(glines, feedrate=DEFAULT_FEEDRATE, acceleration=DEFAULT_ACCELERATION):
+    """Estimate how long each parsed printrun line takes
+
+    Uses the absolute positions printrun has already resolved on each line,
+    so relative moves and G92 offsets are handled by the parser.
+
+    Returns:
+        List of durations in seconds, one per line
+    """
+    durations = []
+    last = None
+    for line in glines:
+        duration = 0.0
+        command = getattr(line, 'command', None)
+        if command in ('G0', 'G1'):
+            if line.f is not None:
+                feedrate = line.f
+            pos = (line.current_x, line.current_y, line.current_z)
+            if last is not None and None not in pos:
+                distance = math.dist(pos, last)
+                if distance == 0 and line.e is not None:
+                    distance = abs(line.e)
+                duration = move_time(distance, feedrate, acceleration)
+            last = pos
+        elif command == 'G4':
+            duration = dwell_time(parse_words(line.raw)[1])
+        durations.append(duration)
+    return durations
+
+def progress_marker(raw):
+    """Words of an M73 progress line in order, e.g. [('P', 12.0), ('R', 95.0)], or None"""
+    command, _ = parse_words(raw)
+    if command != 'M73':
+        return None
+    code = raw.split(';', 1)[0].strip().upper()
+    return [(letter, float(value)) for letter, value in WORD_RE.findall(code)[1:]]
+
+def retime_progress(runs, inserted_seconds):
+    """Rewrite the slicer's M73 progress markers for inserted lines
+
+    PrusaSlicer writes M73 P<percent> R<minutes left> through the file, and
+    Q<percent> S<minutes left> for the silent mode. Each marker gets the
+    inserted time still ahead of it added to its remaining time, and its
+    percentage is worked out again against the longer total. Times to the
+    next colour change (C and D) are left as they are. Lines are handled
+    one at a time, so the file is never held whole.
+
+    Args:
+        runs: Iterable of (lines, inserted) runs of raw lines in file order
+        inserted_seconds: Estimated total of estimate_block_duration over
+            the inserted runs, with no start_pos
+
+    Yields:
+        Raw lines
+    """
+    remaining = inserted_seconds  # Inserted time still ahead
+    totals = {}  # Original total minutes of each mode by its percentage letter
+    for lines, inserted in runs:
+        if inserted:
+            remaining -= estimate_block_duration(lines, None)
+            yield from lines
+            continue
+        if inserted_seconds <= 0:
+            yield from lines
+            continue
+        for raw in lines:
+            words = progress_marker(raw) if raw.startswith(('M73', 'm73')) else None
+            if not words:
+                yield raw
+                continue
+            values = dict(words)
+            for percent, minutes in (('P', 'R'), ('Q', 'S')):
+                if percent not in values or minutes not in values:
+                    continue
+                if percent not in totals and values[percent] < 100:
+                    totals[percent] = values[minutes] * 100 / (100 - values[percent])
+                total = totals.get(percent)
+                if not total:
+                    continue
+                elapsed = total * values[percent] / 100 + (inserted_seconds - remaining) / 60
+                new_total = total + inserted_seconds / 60
+                values[percent] = min(100, max(0, round(100 * elapsed / new_total)))
+                values[minutes] = round(values[minutes] + max(remaining, 0) / 60)
+            text = ' '.join(f"{letter}{values[letter]:g}" for letter, _ in words)
+            comment = raw.partition(';')[2].rstrip('\r\n')
+            yield f"M73 {text}" + (f" ;{comment}" if comment else "") + "\n"
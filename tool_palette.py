@@ -0,0 +1,194 @@
+from ctypes import byref
+
+import numpy as np
+import pyglet.gl
+from pyglet.gl import glGenTextures, glBindTexture, glTexImage1D, glTexSubImage1D, \
+    glTexParameteri, glTexEnvi, glTexCoordPointer, glVertexPointer, glNormalPointer, \
+    glEnable, glDisable, glColor3f, glEnableClientState, glDisableClientState, GLuint, \
+    GL_TEXTURE_1D, GL_RGB, GL_FLOAT, \
+    GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE, \
+    GL_NEAREST, GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE, GL_TEXTURE_COORD_ARRAY, \
+    GL_COLOR_ARRAY
+from printrun.gl.libtatlin.actors import numpy2vbo
+
+PALETTE_SIZE = 8  # Texels in the palette texture, more than the model has tool and travel colours
+
+
+def tool_colors(model):
+    """Colours of each tool set on a printrun model, color_tool0 onwards"""
+    colors = []
+    tool = 0
+    while hasattr(model, f'color_tool{tool}'):
+        colors.append(tuple(getattr(model, f'color_tool{tool}')))
+        tool += 1
+    return tuple(colors)
+
+def palette_colors(model):
+    """Colours of a model's palette, its tool colours then color_travel"""
+    return tool_colors(model) + (tuple(model.color_travel),)
+
+def vertex_tools(model):
+    """Palette index of every vertex of a fully loaded GcodeModel
+
+    Matches the model's movement_color, tools past the last colour and
+    moves without a tool use the last one, moves that don't extrude the
+    travel colour after them.
+    """
+    travel = len(tool_colors(model))
+    last = travel - 1
+    ends = np.array(model.count_print_vertices, dtype=np.int64)
+    entries, tools = [], []
+    for gline in model.gcode.lines:
+        entry = getattr(gline, 'gcview_end_vertex', None)
+        if entry and gline.extruding:
+            entries.append(entry)
+            tools.append(gline.current_tool if gline.current_tool is not None else -1)
+    entry_tools = np.full(len(ends), travel, dtype=np.int64)
+    tools = np.array(tools, dtype=np.int64)
+    entry_tools[np.array(entries, dtype=np.int64)] = np.where((tools >= 0) & (tools < last), tools, last)
+    # Each entry's vertices follow the previous entry's
+    return np.repeat(entry_tools, np.diff(ends, prepend=0))
+
+
+class ToolPalette:
+    """Draws a printrun GcodeModel's moves with a per-tool colour palette
+
+    printrun bakes each tool's colour into a colour per vertex, so changing
+    one means rebuilding the buffer for the whole print. Here every vertex
+    gets a texture coordinate into a small 1-D palette texture instead,
+    built once when the model is fully loaded. Changing color_tool{n} or
+    color_travel on the model then only re-uploads the palette texels that
+    changed, on the next frame.
+
+    Use attach() to take over a model's drawing of its moves.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.draw_default = model._display_movements
+        self.coord_buffer = None
+        self.texture = None
+        self.uploaded = [None] * PALETTE_SIZE
+
+    def __del__(self):
+        if self.texture is not None:
+            try:
+                pyglet.gl.current_context.delete_texture(self.texture.value)
+            except Exception:
+                pass  # No context left at exit
+
+    def init(self):
+        """Build the texture coordinates and palette, in the GL context"""
+        tools = vertex_tools(self.model)
+        coords = ((tools + 0.5) / PALETTE_SIZE).astype(np.float32)
+        self.coord_buffer = numpy2vbo(coords, use_vbos=self.model.use_vbos)
+
+        self.texture = GLuint()
+        glGenTextures(1, byref(self.texture))
+        glBindTexture(GL_TEXTURE_1D, self.texture)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        empty = np.zeros((PALETTE_SIZE, 3), dtype=np.float32)
+        glTexImage1D(GL_TEXTURE_1D, 0, GL_RGB, PALETTE_SIZE, 0, GL_RGB, GL_FLOAT, empty.ctypes.data)
+        glBindTexture(GL_TEXTURE_1D, 0)
+
+    def update_palette(self):
+        """Upload the tool and travel colours that changed since the last frame"""
+        for idx, color in enumerate(palette_colors(self.model)[:PALETTE_SIZE]):
+            # Like printrun's colour buffer, alpha is ignored
+            color = color[:3]
+            if self.uploaded[idx] != color:
+                texel = np.array(color, dtype=np.float32)
+                glTexSubImage1D(GL_TEXTURE_1D, 0, idx, 1, GL_RGB, GL_FLOAT, texel.ctypes.data)
+                self.uploaded[idx] = color
+
+    def enable_palette(self):
+        glEnable(GL_TEXTURE_1D)
+        glColor3f(1.0, 1.0, 1.0)  # Lit white, tinted by the palette
+
+    def display_movements(self, has_vbo):
+        """GcodeModel._display_movements with the palette for colours"""
+        model = self.model
+        if not model.fully_loaded:
+            # Still loading, the vertices aren't final yet
+            return self.draw_default(has_vbo)
+        if self.coord_buffer is None:
+            self.init()
+
+        model.vertex_buffer.bind()
+        glVertexPointer(3, GL_FLOAT, 0, model.vertex_buffer.ptr)
+        model.vertex_normal_buffer.bind()
+        glNormalPointer(GL_FLOAT, 0, model.vertex_normal_buffer.ptr)
+        self.coord_buffer.bind()
+        glTexCoordPointer(1, GL_FLOAT, 0, self.coord_buffer.ptr)
+        model.index_buffer.bind()
+
+        glDisableClientState(GL_COLOR_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glBindTexture(GL_TEXTURE_1D, self.texture)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+        self.update_palette()
+
+        # Same sections as printrun, the palette replacing its colour array
+        max_layers = model.layers_loaded
+        layer_selected = model.num_layers_to_draw <= max_layers
+        if layer_selected:
+            end_prev_layer = model.layer_stops[model.num_layers_to_draw - 1]
+        else:
+            end_prev_layer = 0
+        end = model.layer_stops[min(model.num_layers_to_draw, max_layers)]
+
+        # Printed moves until end or end_prev_layer
+        glColor3f(*model.color_printed[:-1])
+        cur_end = min(model.printed_until, end)
+        if not model.only_current:
+            if 1 <= end_prev_layer <= cur_end:
+                model._draw_elements(1, end_prev_layer)
+            elif cur_end >= 1:
+                model._draw_elements(1, cur_end)
+
+        # Moves not printed yet until end_prev_layer
+        self.enable_palette()
+        start = max(cur_end, 1)
+        if end_prev_layer >= start:
+            if not model.only_current:
+                model._draw_elements(start, end_prev_layer)
+            cur_end = end_prev_layer
+
+        if layer_selected:
+            glDisable(GL_TEXTURE_1D)
+            glColor3f(*model.color_current_printed[:-1])
+            if cur_end > end_prev_layer:
+                model._draw_elements(end_prev_layer + 1, cur_end)
+            glColor3f(*model.color_current[:-1])
+            if end > cur_end:
+                model._draw_elements(cur_end + 1, end)
+            self.enable_palette()
+
+        # Moves not printed until end, if not ending at a given layer
+        start = max(model.printed_until, 1)
+        if not layer_selected and end >= start:
+            model._draw_elements(start, end)
+
+        glDisable(GL_TEXTURE_1D)
+        glBindTexture(GL_TEXTURE_1D, 0)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        # printrun's display() disables the colour array it enabled itself
+        glEnableClientState(GL_COLOR_ARRAY)
+
+        model.index_buffer.unbind()
+        model.vertex_buffer.unbind()
+        self.coord_buffer.unbind()
+        model.vertex_normal_buffer.unbind()
+
+
+def attach(model):
+    """Draw a GcodeModel's moves with a ToolPalette, once per model
+
+    Models that aren't GcodeModels, e.g. the light model, are left alone.
+    """
+    if model is None or not hasattr(model, 'count_print_vertices') or hasattr(model, 'tool_palette'):
+        return
+    model.tool_palette = ToolPalette(model)
+    model._display_movements = model.tool_palette.display_movements
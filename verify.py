@@ -0,0 +1,180 @@
+import hashlib
+import sys
+from itertools import zip_longest
+
+import parallel_parse
+import timing
+
+BLOCK_SIZE = 1024 * 1024  # Bytes read at a time from each file
+
+
+def iter_layers(f, block_size=BLOCK_SIZE):
+    """Read a binary G-code stream one layer at a time
+
+    Layers are split at the slicer's layer change markers the same way as
+    parallel_parse and lazy_gcode, with everything before the first
+    marker as layer 0. Only one layer is held in memory.
+
+    Yields:
+        Bytes of each layer
+    """
+    marker = parallel_parse.LAYER_MARKER
+    buf = bytearray()
+    search_from = 0
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        buf += block
+        start = 0
+        pos = buf.find(marker, search_from)
+        while pos != -1:
+            yield bytes(buf[start:pos + 1])
+            start = pos + 1
+            pos = buf.find(marker, start)
+        del buf[:start]
+        # A marker may be split across blocks
+        search_from = max(0, len(buf) - len(marker))
+    if buf:
+        yield bytes(buf)
+
+def find_insertions(original, output, key=None):
+    """Check that output lines are the original lines with lines inserted
+
+    Args:
+        original, output: Lists of lines
+        key: Optional function lines are compared by
+
+    Returns:
+        List of (output line index, inserted lines) for each inserted run,
+        or None if any original line is missing or changed
+    """
+    if key:
+        original = [key(line) for line in original]
+    insertions = []
+    run = None
+    idx = 0
+    for out_idx, line in enumerate(output):
+        if idx < len(original) and (key(line) if key else line) == original[idx]:
+            idx += 1
+            run = None
+        else:
+            if run is None:
+                run = (out_idx, [])
+                insertions.append(run)
+            run[1].append(line)
+    if idx < len(original):
+        return None
+    return insertions
+
+def progress_key(line):
+    """Compare lines ignoring the values of M73 progress markers"""
+    line = line.strip()
+    return b'M73' if line[:3].upper() == b'M73' else line
+
+def summarise_block(lines):
+    """Line count, tools referenced, Z range and net E of inserted lines"""
+    tools = set()
+    zs = []
+    net_e = 0.0
+    for raw in lines:
+        command, params = timing.parse_words(raw.decode('utf-8', errors='replace'))
+        if command is None:
+            continue
+        if command.startswith('T') and command[1:].isdigit():
+            tools.add(int(command[1:]))
+        elif command in ('M104', 'M109') and 'T' in params:
+            tools.add(int(params['T']))
+        elif command in ('G0', 'G1'):
+            if 'Z' in params:
+                zs.append(params['Z'])
+            net_e += params.get('E', 0.0)
+    return {
+        'lines': len(lines),
+        'tools': sorted(tools),
+        'z_range': (min(zs), max(zs)) if zs else None,
+        'net_e': round(net_e, 5),
+    }
+
+def verify_splice(original_path, output_path):
+    """Verify that a spliced file only adds lines to the original
+
+    Both files are streamed a layer at a time and each pair of layers is
+    compared by hash. Only layers whose hashes differ are split into lines
+    and checked to be the original with lines inserted.
+
+    Returns:
+        Dict with 'ok', the number of 'layers', the 'changed_layers' with
+        their insertions, a 'summary' of all inserted lines, the number of
+        'retimed_layers' whose M73 progress markers changed, any 'errors'
+        and 'warnings' for layers whose lines only differ in whitespace
+    """
+    report = {'ok': True, 'layers': 0, 'changed_layers': [], 'summary': None,
+              'retimed_layers': 0, 'errors': [], 'warnings': []}
+    inserted = []
+    with open(original_path, 'rb') as original_file, open(output_path, 'rb') as output_file:
+        pairs = zip_longest(iter_layers(original_file), iter_layers(output_file))
+        for layer_idx, (original, output) in enumerate(pairs):
+            report['layers'] = layer_idx + 1
+            if original is None or output is None:
+                which = "output" if original is None else "original"
+                report['errors'].append(f"Layer {layer_idx}: only in the {which} file, layers were added or lost")
+                break
+            if hashlib.blake2b(original).digest() == hashlib.blake2b(output).digest():
+                continue
+
+            original_lines = original.splitlines(keepends=True)
+            output_lines = output.splitlines(keepends=True)
+            insertions = find_insertions(original_lines, output_lines)
+            if insertions is None:
+                # printrun strips lines when parsing, which is harmless to the printer
+                insertions = find_insertions(original_lines, output_lines, key=bytes.strip)
+                if insertions is not None:
+                    report['warnings'].append(f"Layer {layer_idx}: whitespace differs around original lines")
+            if insertions is None:
+                # Progress markers are retimed for the inserted lines
+                insertions = find_insertions(original_lines, output_lines, key=progress_key)
+                if insertions is not None:
+                    report['retimed_layers'] += 1
+            if insertions is None:
+                report['errors'].append(f"Layer {layer_idx}: original lines were changed or removed")
+                continue
+            for line_idx, lines in insertions:
+                report['changed_layers'].append({
+                    'layer': layer_idx,
+                    'line': line_idx,
+                    **summarise_block(lines),
+                })
+                inserted.extend(lines)
+
+    report['summary'] = summarise_block(inserted)
+    report['ok'] = not report['errors']
+    return report
+
+def format_report(report):
+    """Human readable verification report"""
+    lines = ["Verified: only insertions" if report['ok'] else "Verification FAILED"]
+    lines.append(f"Layers compared: {report['layers']}")
+    for change in report['changed_layers']:
+        z_range = change['z_range']
+        z_text = f", Z {z_range[0]}-{z_range[1]}" if z_range else ""
+        tools = ", ".join(f"T{tool}" for tool in change['tools']) or "none"
+        lines.append(f"Layer {change['layer']} line {change['line']}: {change['lines']} lines inserted, "
+                     f"tools {tools}{z_text}, net E {change['net_e']}")
+    summary = report['summary']
+    if summary:
+        lines.append(f"Total inserted: {summary['lines']} lines")
+    if report.get('retimed_layers'):
+        lines.append(f"Progress markers retimed in {report['retimed_layers']} layers")
+    lines.extend(report['warnings'])
+    lines.extend(report['errors'])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python verify.py <original.gcode> <output.gcode>")
+        sys.exit(2)
+    report = verify_splice(sys.argv[1], sys.argv[2])
+    print(format_report(report))
+    sys.exit(0 if report['ok'] else 1)